@@ -0,0 +1,125 @@
+# pylint: disable=E0401
+"""
+Micro-benchmark comparing file hashing strategies across file and buffer sizes, used to select the
+defaults in Modules/hashing.py.
+
+Built-in modules
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+# Add project root to path so the custom modules can be imported when run from any directory #
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# Custom modules #
+from Modules.hashing import DIGEST_ALGORITHMS, hash_file
+
+
+# Pseudo constants #
+FILE_SIZES = (4 * 1024, 1024 * 1024, 32 * 1024 * 1024, 256 * 1024 * 1024)
+BUFFER_SIZES = (64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+
+
+def legacy_hash(file_path: Path, algorithms: tuple) -> dict[str, str]:
+    """
+    Hashes the file the way the original hash_send did, 4096 byte reads and one pass per digest.
+
+    :param file_path:  The path to the file to be hashed.
+    :param algorithms:  The hashlib algorithm names to be computed.
+    :return:  Dictionary mapping each algorithm name to its hex digest.
+    """
+    digests = {}
+
+    # Iterate through the algorithms, re-reading the file for each #
+    for algorithm in algorithms:
+        hasher = hashlib.new(algorithm)
+
+        with file_path.open('rb') as in_file:
+            # Read the data and hash by 4096 byte chunks #
+            for byte_chunk in iter(lambda: in_file.read(4096), b''):
+                hasher.update(byte_chunk)
+
+        digests[algorithm] = hasher.hexdigest()
+
+    return digests
+
+
+def time_call(func, repeat: int) -> float:
+    """
+    Times the passed in callable, returning the best of the repeated runs.
+
+    :param func:  The callable to be timed.
+    :param repeat:  The number of timed runs.
+    :return:  The fastest run time in seconds.
+    """
+    best = float('inf')
+
+    # Iterate through the number of runs #
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main():
+    """
+    Creates test files of each size, times every strategy, and prints the throughput table.
+
+    :return:  Nothing
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks the file hashing strategies.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=FILE_SIZES,
+                        help='File sizes in bytes to benchmark.')
+    parser.add_argument('--buffers', type=int, nargs='+', default=BUFFER_SIZES,
+                        help='Buffer sizes in bytes to benchmark.')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per measurement.')
+    args = parser.parse_args()
+
+    print(f'{"file size":>12} {"digests":>8} {"strategy":>12} {"buffer":>9} {"MB/s":>10}')
+
+    # Iterate through the file sizes to be tested #
+    for file_size in args.sizes:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            test_file = Path(temp_dir) / 'bench.bin'
+            # Write random data so compression in the filesystem can not skew results #
+            with test_file.open('wb') as out_file:
+                remaining = file_size
+                while remaining:
+                    chunk_size = min(remaining, 4 * 1024 * 1024)
+                    out_file.write(os.urandom(chunk_size))
+                    remaining -= chunk_size
+
+            runs = []
+            # Iterate through single and multi digest cases #
+            for algorithms in (('sha256',), DIGEST_ALGORITHMS):
+                runs.append((algorithms, 'legacy', 4096,
+                             lambda algos=algorithms: legacy_hash(test_file, algos)))
+
+                # If single digest, hashlib.file_digest is available #
+                if len(algorithms) == 1:
+                    runs.append((algorithms, 'file_digest', 0,
+                                 lambda algos=algorithms: hash_file(test_file, algos,
+                                                                    strategy='file_digest')))
+
+                # Iterate through the buffered strategies and buffer sizes #
+                for strategy in ('buffered', 'mmap'):
+                    for buffer_size in args.buffers:
+                        runs.append((algorithms, strategy, buffer_size,
+                                     lambda algos=algorithms, strat=strategy, size=buffer_size:
+                                     hash_file(test_file, algos, size, strat)))
+
+            # Iterate through the runs and print the measured throughput #
+            for algorithms, strategy, buffer_size, func in runs:
+                elapsed = time_call(func, args.repeat)
+                throughput = file_size / elapsed / (1024 * 1024)
+                print(f'{file_size:>12} {len(algorithms):>8} {strategy:>12} {buffer_size:>9} '
+                      f'{throughput:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+# pylint: disable=E0401
+"""
+End-to-end scan benchmark over synthetic docks, run against the local stub server in
+Benchmarks/stub_vt_server.py. The API time windows are scaled down so a run that would take hours
+against the real API finishes in seconds, while the request counts stay identical.
+
+Built-in modules
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+# Add project root to path so the custom modules can be imported when run from any directory #
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# Custom modules #
+from Benchmarks.stub_vt_server import start_server, StubSettings
+from Modules.key_pool import KEY_COOLDOWNS
+from Modules.quota_ledger import DAY_SECONDS, MINUTE_SECONDS
+from Modules.quota_profile import get_quota_profile, QUOTA_PROFILES
+from Modules.retry_queue import RETRY_BASE, RETRY_CAP
+from Modules.scan_engine import ScanEngine, ScanError
+from Modules.submit_queue import POLL_BASE, POLL_CAP
+from Modules.utils import get_files, TimeTracker
+
+
+# Pseudo constants #
+DOCKS = ('small', 'huge', 'dupes')
+KIB = 1024
+MIB = 1024 * 1024
+
+
+def make_dock(dock_dir: Path, dock: str, files: int, huge_size: int, seed: int):
+    """
+    Writes the seeded synthetic files of the passed in dock, identical on every run.
+
+    :param dock_dir:  The directory the files are written to.
+    :param dock:  The dock name, small for many small files, huge for a few large files, or dupes
+                  for many copies of a few files.
+    :param files:  The number of files in the small and dupes docks.
+    :param huge_size:  The size in bytes of each file in the huge dock.
+    :param seed:  The seed of the file contents.
+    :return:  Nothing
+    """
+    rand = random.Random(f'{dock}-{seed}')
+    dock_dir.mkdir(parents=True)
+
+    # If the dock is many small unique files #
+    if dock == 'small':
+        for index in range(files):
+            (dock_dir / f'small_{index:05d}.bin').write_bytes(
+                rand.randbytes(rand.randint(KIB, 64 * KIB)))
+    # If the dock is a few large files #
+    elif dock == 'huge':
+        for index in range(4):
+            with (dock_dir / f'huge_{index}.bin').open('wb') as out_file:
+                # Write by chunks so the file is never held in memory whole #
+                for _ in range(huge_size // MIB):
+                    out_file.write(rand.randbytes(MIB))
+                out_file.write(rand.randbytes(huge_size % MIB))
+    # If the dock is heavily duplicated, about one unique file per twenty copies #
+    else:
+        contents = [rand.randbytes(rand.randint(KIB, 64 * KIB))
+                    for _ in range(max(1, files // 20))]
+        for index in range(files):
+            (dock_dir / f'dupe_{index:05d}.bin').write_bytes(rand.choice(contents))
+
+
+def run_scan(dock_dir: Path, state_dir: Path, api_keys: list[str], settings: StubSettings,
+             engine_options: dict) -> dict:
+    """
+    Scans the dock end to end through the stub server, measuring the run.
+
+    :param dock_dir:  The directory holding the dock files.
+    :param state_dir:  The directory holding the quota ledgers, databases, and reports.
+    :param api_keys:  The API keys requests are spread across.
+    :param settings:  The stub server settings, whose counters are read before and after the run.
+    :param engine_options:  The scan engine options with the scaled limits and backoff.
+    :return:  Dictionary of the run measurements.
+    """
+    time_obj = TimeTracker()
+    start_time = datetime.now()
+    time_obj.month, time_obj.day, time_obj.hour = start_time.month, start_time.day, start_time.hour
+
+    files = get_files(dock_dir)
+    dock_bytes = sum(file.stat().st_size for file in files)
+    before = settings.snapshot()
+    engine = ScanEngine(api_keys, state_dir, time_obj, **engine_options)
+
+    results, stopped = [], 0
+    start = time.perf_counter()
+    try:
+        # Iterate through the scan results as they arrive #
+        for result in engine.scan(files):
+            results.append(result)
+
+    # If an API response stopped the scan, record it with the partial results #
+    except ScanError as scan_err:
+        print(f'Scan of {dock_dir.name} stopped: {scan_err}', file=sys.stderr)
+        stopped = 1
+
+    elapsed = time.perf_counter() - start
+
+    after = settings.snapshot()
+    served = {name: after.get(name, 0) - before.get(name, 0)
+              for name in ('requests', 'connections', 'throttled', 'forbidden', 'errors',
+                           'not_found', 'uploads', 'queued')}
+
+    return {'files': len(files), 'results': len(results),
+            'unique': len({result.digests['sha256'] for result in results}),
+            'cached': sum(1 for result in results if result.cached),
+            'failed': sum(1 for result in results if result.error), 'stopped': stopped, **served,
+            'files_per_request': len(results) / served['requests'] if served['requests'] else 0.0,
+            'elapsed': elapsed, 'mb_per_sec': dock_bytes / MIB / elapsed}
+
+
+def main():
+    """
+    Builds the synthetic docks, scans each cold and then warm against the stub server, and prints \
+    the median measurements.
+
+    :return:  Nothing
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks end-to-end scans against a stub '
+                                                 'Virus-Total server.')
+    parser.add_argument('--docks', nargs='+', choices=DOCKS, default=DOCKS,
+                        help='Synthetic docks to scan.')
+    parser.add_argument('--files', type=int, default=200,
+                        help='Number of files in the small and dupes docks.')
+    parser.add_argument('--huge-size', type=int, default=64 * MIB,
+                        help='Size in bytes of each file in the huge dock.')
+    parser.add_argument('--keys', type=int, default=1, help='Number of API keys in the pool.')
+    parser.add_argument('--forbidden', type=int, default=0,
+                        help='Number of extra pool keys the stub answers with 403.')
+    parser.add_argument('--errors', type=float, default=0.0,
+                        help='Share of requests the stub fails with a transient 503.')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds the stub delays each response.')
+    parser.add_argument('--time-scale', type=float, default=0.01,
+                        help='Factor the API time windows are scaled by, 1 for real time.')
+    parser.add_argument('--margin', type=float, default=0.05,
+                        help='Seconds added to rate limit waits, not scaled as it absorbs the '
+                             'request latency.')
+    parser.add_argument('--quota-profile', choices=QUOTA_PROFILES, default='public',
+                        help='Request limits the client and stub enforce per key.')
+    parser.add_argument('--concurrency', type=int,
+                        help='Number of requests kept in flight, overriding the quota profile.')
+    parser.add_argument('--submit', action='store_true',
+                        help='Upload the files the stub reports as not found and poll for their '
+                             'analysis.')
+    parser.add_argument('--analysis-delay', type=float, default=120.0,
+                        help='Seconds the stub reports an uploaded file as queued, scaled by the '
+                             'time scale.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per dock, the median is shown.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic file contents.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the measurements as JSON for regression tracking.')
+    args = parser.parse_args()
+
+    api_keys = [f'bench-key-{index}' for index in range(args.keys)]
+    forbidden_keys = [f'bench-forbidden-{index}' for index in range(args.forbidden)]
+    window = MINUTE_SECONDS * args.time_scale
+    quota_profile = get_quota_profile(args.quota_profile, {'concurrency': args.concurrency})
+    # The stub throttles at the real limit so a client that overruns it is visible as 204s #
+    settings = StubSettings(args.latency, quota_profile.minute_limit, window, forbidden_keys,
+                            error_ratio=args.errors, seed=args.seed,
+                            analysis_delay=args.analysis_delay * args.time_scale)
+    server, api_base = start_server(settings)
+    engine_options = {
+        'quota_profile': quota_profile,
+        'pool_options': {'limits': ((quota_profile.minute_limit, window),
+                                    (quota_profile.daily_limit, DAY_SECONDS)),
+                         'cooldowns': {code: seconds * args.time_scale
+                                       for code, seconds in KEY_COOLDOWNS.items()},
+                         'margin': args.margin, 'api_base': api_base},
+        'retry_options': {'base': RETRY_BASE * args.time_scale, 'cap': RETRY_CAP * args.time_scale},
+        'submit': args.submit,
+        'submit_options': {'poll_base': POLL_BASE * args.time_scale,
+                           'poll_cap': POLL_CAP * args.time_scale}
+    }
+    measurements = {}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Iterate through the docks to be scanned #
+        for dock in args.docks:
+            dock_dir = Path(temp_dir) / dock
+            make_dock(dock_dir, dock, args.files, args.huge_size, args.seed)
+
+            cold_runs, warm_runs = [], []
+            # Iterate through the runs, each with fresh state so no quota carries over #
+            for run in range(args.repeat):
+                state_dir = Path(temp_dir) / f'state_{dock}_{run}'
+                state_dir.mkdir()
+                cold_runs.append(run_scan(dock_dir, state_dir, api_keys + forbidden_keys,
+                                          settings, engine_options))
+                # Rescan with the manifest and report cache of the cold run #
+                warm_runs.append(run_scan(dock_dir, state_dir, api_keys + forbidden_keys,
+                                          settings, engine_options))
+
+            # Iterate through the cold and warm runs, keeping the median of each measurement #
+            for label, runs in ((dock, cold_runs), (f'{dock} warm', warm_runs)):
+                median = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+                # Convert the scaled run time to the time the run would take on the real API #
+                median['api_minutes'] = median['elapsed'] / args.time_scale / MINUTE_SECONDS
+                median['files_per_api_minute'] = (median['results'] / median['api_minutes']
+                                                  if median['api_minutes'] else 0.0)
+                measurements[label] = median
+
+    server.shutdown()
+
+    # If JSON output was requested #
+    if args.json:
+        print(json.dumps({'settings': vars(args), 'docks': measurements}, indent=4))
+        return
+
+    print(f'{"dock":>11} {"files":>6} {"unique":>6} {"cached":>6} {"reqs":>5} {"conns":>5} '
+          f'{"204":>4} {"403":>4} {"5xx":>4} {"upl":>4} {"fail":>4} {"stop":>4} {"files/req":>9} '
+          f'{"seconds":>8} {"API min":>8} {"files/min":>9} {"MB/s":>8}')
+    # Iterate through the dock measurements #
+    for label, median in measurements.items():
+        print(f'{label:>11} {median["files"]:>6.0f} {median["unique"]:>6.0f} '
+              f'{median["cached"]:>6.0f} {median["requests"]:>5.0f} '
+              f'{median["connections"]:>5.0f} {median["throttled"]:>4.0f} '
+              f'{median["forbidden"]:>4.0f} {median["errors"]:>4.0f} {median["uploads"]:>4.0f} '
+              f'{median["failed"]:>4.0f} {median["stopped"]:>4.0f} '
+              f'{median["files_per_request"]:>9.2f} '
+              f'{median["elapsed"]:>8.2f} {median["api_minutes"]:>8.1f} '
+              f'{median["files_per_api_minute"]:>9.1f} {median["mb_per_sec"]:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
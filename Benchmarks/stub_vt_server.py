@@ -0,0 +1,425 @@
+# pylint: disable=C0103
+"""
+Local stand-in for the Virus-Total v2 file/report and file/scan endpoints, used to benchmark
+end-to-end scans without spending real API quota. It answers with deterministic reports, adds
+configurable latency, throttles each key with 204 responses past the per minute limit, rejects
+forbidden keys with 403, reports a fixed share of hashes as not found, and fails a share of
+requests with 503. Uploaded files are hashed as they stream in and reported as queued until their
+analysis delay has passed.
+
+Built-in modules
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+
+
+# Pseudo constants #
+REPORT_PATH = '/vtapi/v2/file/report'
+SCAN_PATH = '/vtapi/v2/file/scan'
+ENGINE_COUNT = 70
+NOT_FOUND_MSG = 'The requested resource is not among the finished, queued or pending scans'
+QUEUED_MSG = 'Your resource is queued for analysis'
+SCAN_QUEUED_MSG = 'Scan request successfully queued, come back later for the report'
+UPLOAD_BLOCK = 64 * 1024
+
+
+class StubSettings:
+    """ Class to group the behaviour of the stub server and the counters of what it served. """
+    def __init__(self, latency: float = 0.05, minute_limit: int = 4, window: float = 60.0,
+                 forbidden_keys: tuple = (), not_found_ratio: float = 0.25,
+                 error_ratio: float = 0.0, seed: int = 1, analysis_delay: float = 1.0,
+                 max_upload: int = 32 * 1024 * 1024):
+        """
+        Initialize the stub behaviour and zeroed request counters.
+
+        :param latency:  Seconds each response is delayed to mimic the network round trip.
+        :param minute_limit:  The number of requests a key may make per window, 0 for no limit.
+        :param window:  The length in seconds of the throttle window, scaled down for benchmarks.
+        :param forbidden_keys:  The API keys answered with 403.
+        :param not_found_ratio:  The share of hashes reported as not found, from 0 to 1.
+        :param error_ratio:  The share of requests failed with a transient 503, from 0 to 1.
+        :param seed:  The seed of which requests fail, so runs fail the same requests.
+        :param analysis_delay:  Seconds an uploaded file is reported as queued before its report.
+        :param max_upload:  The size in bytes of the largest upload accepted, larger are 413.
+        """
+        self.latency = latency
+        self.minute_limit = minute_limit
+        self.window = window
+        self.forbidden_keys = set(forbidden_keys)
+        self.not_found_ratio = not_found_ratio
+        self.error_ratio = error_ratio
+        self.analysis_delay = analysis_delay
+        self.max_upload = max_upload
+        self._rand = random.Random(seed)
+        self.counters = defaultdict(int)
+        self._key_times = defaultdict(deque)
+        # Time each uploaded file analysis finishes, keyed by SHA256 #
+        self._analyses = {}
+        self._lock = Lock()
+
+    def count(self, name: str, amount: int = 1):
+        """
+        Adds to the named request counter.
+
+        :param name:  The name of the counter.
+        :param amount:  The amount added to the counter.
+        :return:  Nothing
+        """
+        with self._lock:
+            self.counters[name] += amount
+
+    def is_failed(self) -> bool:
+        """
+        Draws whether the current request fails with a transient error.
+
+        :return:  True if the request is to be failed, otherwise False.
+        """
+        with self._lock:
+            return self._rand.random() < self.error_ratio
+
+    def is_throttled(self, api_key: str) -> bool:
+        """
+        Records a request of the passed in key, checking it against the sliding throttle window.
+
+        :param api_key:  The API key of the request.
+        :return:  True if the key exceeded the limit of the window, otherwise False.
+        """
+        # If throttling is disabled #
+        if not self.minute_limit:
+            return False
+
+        curr_time = time.monotonic()
+        with self._lock:
+            key_times = self._key_times[api_key]
+            # Drop the requests that left the window #
+            while key_times and key_times[0] <= curr_time - self.window:
+                key_times.popleft()
+
+            # If the window is full, the request is throttled and not recorded #
+            if len(key_times) >= self.minute_limit:
+                return True
+
+            key_times.append(curr_time)
+            return False
+
+    def report(self, resource: str) -> dict:
+        """
+        Builds the report of the passed in hash, queued while its uploaded file is analysed.
+
+        :param resource:  The hash the report is requested for.
+        :return:  The report dictionary in the Virus-Total v2 format.
+        """
+        with self._lock:
+            ready_time = self._analyses.get(resource.lower())
+
+        # If the file was never uploaded #
+        if ready_time is None:
+            return make_report(resource, self.not_found_ratio)
+
+        # If the analysis has not finished #
+        if time.monotonic() < ready_time:
+            return {'response_code': -2, 'resource': resource, 'verbose_msg': QUEUED_MSG}
+
+        return make_report(resource, 0.0)
+
+    def snapshot(self) -> dict:
+        """
+        Copies the request counters.
+
+        :return:  Dictionary mapping each counter name to its value.
+        """
+        with self._lock:
+            return dict(self.counters)
+
+    def submit(self, file_hash: str):
+        """
+        Queues the analysis of an uploaded file, a file uploaded again keeps its first analysis.
+
+        :param file_hash:  The SHA256 digest of the uploaded file.
+        :return:  Nothing
+        """
+        with self._lock:
+            self._analyses.setdefault(file_hash, time.monotonic() + self.analysis_delay)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Class to answer file report requests the way the Virus-Total v2 API does. """
+    # The settings of the server the handler belongs to #
+    settings = StubSettings()
+    # Keep connections open between requests, as the real API does #
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        """
+        Answers a file report request for one or more comma-separated resources.
+
+        :return:  Nothing
+        """
+        url = urlparse(self.path)
+        # If the path is not the file report endpoint #
+        if url.path != REPORT_PATH:
+            self.send_json(404, {'verbose_msg': 'Not found'})
+            return
+
+        params = parse_qs(url.query)
+        api_key = params.get('apikey', [''])[0]
+        resources = [resource.strip() for resource in params.get('resource', [''])[0].split(',')
+                     if resource.strip()]
+        self.settings.count('requests')
+        self.settings.count('resources', len(resources))
+
+        # If the request was answered with an error #
+        if self.send_request_error(api_key):
+            return
+
+        # If no resource was passed #
+        if not resources:
+            self.settings.count('bad_requests')
+            self.send_json(400, None)
+            return
+
+        reports = [self.settings.report(resource) for resource in resources]
+        self.settings.count('not_found', sum(1 for report in reports
+                                             if not report['response_code']))
+        self.settings.count('queued', sum(1 for report in reports
+                                          if report['response_code'] == -2))
+        # A single resource is answered with a report, several with a list of reports #
+        self.send_json(200, reports[0] if len(reports) == 1 else reports)
+
+    def do_POST(self):
+        """
+        Answers a file upload, hashing the multipart body as it streams in.
+
+        :return:  Nothing
+        """
+        url = urlparse(self.path)
+        # If the path is not the file scan endpoint, the unread body ends the connection #
+        if url.path != SCAN_PATH:
+            self.close_connection = True
+            self.send_json(404, {'verbose_msg': 'Not found'})
+            return
+
+        api_key = parse_qs(url.query).get('apikey', [''])[0]
+        # Read the whole body before answering, so the connection can be reused #
+        file_hash, file_size = self.read_upload()
+        self.settings.count('requests')
+        self.settings.count('uploads')
+        self.settings.count('upload_bytes', file_size)
+
+        # If the request was answered with an error #
+        if self.send_request_error(api_key):
+            return
+
+        # If the body was not a multipart file upload #
+        if file_hash is None:
+            self.settings.count('bad_requests')
+            self.send_json(400, None)
+            return
+
+        # If the file is over the upload limit #
+        if file_size > self.settings.max_upload:
+            self.settings.count('too_large')
+            self.send_json(413, None)
+            return
+
+        self.settings.submit(file_hash)
+        self.send_json(200, {'response_code': 1, 'resource': file_hash, 'sha256': file_hash,
+                             'scan_id': f'{file_hash}-{int(time.time())}',
+                             'permalink': f'https://www.virustotal.com/gui/file/{file_hash}',
+                             'verbose_msg': SCAN_QUEUED_MSG})
+
+    def handle(self):
+        """
+        Counts the new connection, then answers every request sent over it.
+
+        :return:  Nothing
+        """
+        self.settings.count('connections')
+        super().handle()
+
+    def read_upload(self) -> tuple[str | None, int]:
+        """
+        Reads a multipart upload body a block at a time, hashing the file part without holding \
+        the body in memory.
+
+        :return:  Tuple of the SHA256 digest of the file, or None if the body is not a multipart \
+                  upload, and the size of the file in bytes.
+        """
+        boundary = self.headers.get_param('boundary') or ''
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        remaining = int(self.headers.get('Content-Length', 0))
+        digest, buffer, file_size, in_file = hashlib.sha256(), b'', 0, False
+
+        # While the body is not read whole #
+        while remaining:
+            chunk = self.rfile.read(min(remaining, UPLOAD_BLOCK))
+            # If the client closed the connection early #
+            if not chunk:
+                break
+
+            remaining -= len(chunk)
+            buffer += chunk
+            # If the part headers before the file were not read yet #
+            if not in_file:
+                head_end = buffer.find(b'\r\n\r\n')
+                # If the part headers are not complete #
+                if head_end < 0:
+                    continue
+
+                buffer, in_file = buffer[head_end + 4:], True
+
+            # Hash all but the end of the buffer, which may be the closing boundary #
+            held = max(0, len(buffer) - len(tail))
+            digest.update(buffer[:held])
+            file_size += held
+            buffer = buffer[held:]
+
+        # If the body did not end with the closing boundary #
+        if not boundary or not in_file or buffer != tail:
+            return None, file_size
+
+        return digest.hexdigest(), file_size
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """
+        Silences the per request access log.
+
+        :return:  Nothing
+        """
+
+    def send_json(self, status: int, body):
+        """
+        Sends the response status with an optional JSON body.
+
+        :param status:  The HTTP status code.
+        :param body:  The object to be sent as JSON, or None for an empty body.
+        :return:  Nothing
+        """
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_request_error(self, api_key: str) -> bool:
+        """
+        Delays the response by the latency, then answers with the error the request drew, if any.
+
+        :param api_key:  The API key of the request.
+        :return:  True if an error response was sent, otherwise False.
+        """
+        time.sleep(self.settings.latency)
+
+        # If the key is rejected #
+        if api_key in self.settings.forbidden_keys:
+            self.settings.count('forbidden')
+            self.send_json(403, None)
+            return True
+
+        # If the request drew a transient server error #
+        if self.settings.is_failed():
+            self.settings.count('errors')
+            self.send_json(503, None)
+            return True
+
+        # If the key made too many requests in the window #
+        if self.settings.is_throttled(api_key):
+            self.settings.count('throttled')
+            self.send_json(204, None)
+            return True
+
+        return False
+
+
+def make_report(resource: str, not_found_ratio: float) -> dict:
+    """
+    Builds a deterministic report for the passed in hash, so repeated runs get identical answers.
+
+    :param resource:  The hash the report is requested for.
+    :param not_found_ratio:  The share of hashes reported as not found, from 0 to 1.
+    :return:  The report dictionary in the Virus-Total v2 format.
+    """
+    seed = int(hashlib.sha256(resource.lower().encode('utf-8')).hexdigest()[:8], 16)
+
+    # If the hash falls in the not found share #
+    if seed % 1000 < not_found_ratio * 1000:
+        return {'response_code': 0, 'resource': resource, 'verbose_msg': NOT_FOUND_MSG}
+
+    positives = seed % 7 if seed % 3 == 0 else 0
+    scans = {f'Engine{index:02d}': {'detected': index < positives, 'version': '1.0',
+                                    'result': 'Stub.Malware' if index < positives else None,
+                                    'update': '20240101'}
+             for index in range(ENGINE_COUNT)}
+
+    return {'response_code': 1, 'resource': resource, 'sha256': resource.lower(),
+            'scan_id': f'{resource.lower()}-1700000000', 'scan_date': '2024-01-01 00:00:00',
+            'permalink': f'https://www.virustotal.com/gui/file/{resource.lower()}',
+            'positives': positives, 'total': ENGINE_COUNT, 'scans': scans,
+            'verbose_msg': 'Scan finished, information embedded'}
+
+
+def start_server(settings: StubSettings, port: int = 0) -> tuple:
+    """
+    Starts the stub server in a background thread.
+
+    :param settings:  The behaviour of the stub server.
+    :param port:  The local port to listen on, 0 for any free port.
+    :return:  Tuple of the server instance and the API base URL to point the client at.
+    """
+    handler = type('BoundStubHandler', (StubHandler,), {'settings': settings})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f'http://127.0.0.1:{server.server_address[1]}/vtapi/v2/'
+
+
+def main():
+    """
+    Runs the stub server in the foreground until interrupted.
+
+    :return:  Nothing
+    """
+    parser = argparse.ArgumentParser(description='Runs a local stand-in Virus-Total API server.')
+    parser.add_argument('--port', type=int, default=8080, help='Local port to listen on.')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds each response is delayed.')
+    parser.add_argument('--minute-limit', type=int, default=4,
+                        help='Requests per key per window before 204 is returned, 0 for no limit.')
+    parser.add_argument('--window', type=float, default=60.0,
+                        help='Seconds in the throttle window.')
+    parser.add_argument('--forbidden', nargs='*', default=(), help='API keys answered with 403.')
+    parser.add_argument('--not-found', type=float, default=0.25,
+                        help='Share of hashes reported as not found.')
+    parser.add_argument('--errors', type=float, default=0.0,
+                        help='Share of requests failed with a transient 503.')
+    parser.add_argument('--analysis-delay', type=float, default=60.0,
+                        help='Seconds an uploaded file is reported as queued for analysis.')
+    args = parser.parse_args()
+
+    settings = StubSettings(args.latency, args.minute_limit, args.window, args.forbidden,
+                            args.not_found, args.errors, analysis_delay=args.analysis_delay)
+    server, api_base = start_server(settings, args.port)
+    print(f'Serving stub API at {api_base}, set VTOTAL_API_BASE to use it, Ctrl+C to stop')
+
+    try:
+        # Wait in the foreground so the server keeps running #
+        while True:
+            time.sleep(1)
+
+    # If the user stopped the server #
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f'\nServed {settings.snapshot()}')
+
+
+if __name__ == '__main__':
+    main()
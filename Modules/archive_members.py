@@ -0,0 +1,553 @@
+"""
+Archive-aware hashing of the members of zip, tar, and 7z archives. Each member is hashed straight
+from the decompression stream with nothing extracted to disk, so the files inside a bundle are
+looked up rather than only the container, which Virus-Total has usually never seen. Nesting depth,
+member count, and total expanded bytes are limited per archive to guard against zip bombs.
+
+Built-in modules
+"""
+import hashlib
+import io
+import logging
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
+from pathlib import Path
+# External modules #
+try:
+    import py7zr
+# If the optional 7z package is not installed #
+except ImportError:
+    py7zr = None
+# Custom modules #
+from Modules.hashing import BUFFER_SIZE, DIGEST_ALGORITHMS
+
+
+# Pseudo constants #
+ARCHIVE_SCAN = os.environ.get('VTOTAL_ARCHIVES', '').lower() in ('1', 'true', 'yes')
+ARCHIVE_DEPTH = os.environ.get('VTOTAL_ARCHIVE_DEPTH', 2)
+ARCHIVE_MAX_MEMBERS = os.environ.get('VTOTAL_ARCHIVE_MAX_MEMBERS', 10000)
+ARCHIVE_MAX_BYTES = os.environ.get('VTOTAL_ARCHIVE_MAX_BYTES', 1024 * 1024 * 1024)
+# Largest nested archive held in memory, since a zip can not be read from a stream #
+ARCHIVE_BUFFER = 64 * 1024 * 1024
+# Leading bytes read to detect an archive, up to the end of the tar ustar magic #
+HEADER_LENGTH = 262
+# Leading bytes of each archive format, compressed streams are opened as tar archives #
+ARCHIVE_SIGNATURES = (
+    (b'PK\x03\x04', 'zip'),
+    (b'PK\x05\x06', 'zip'),
+    (b'7z\xbc\xaf\x27\x1c', '7z'),
+    (b'\x1f\x8b', 'tar'),
+    (b'BZh', 'tar'),
+    (b'\xfd7zXZ\x00', 'tar')
+)
+# Errors of a corrupt, truncated, or unsupported archive, which is skipped rather than stopping #
+ARCHIVE_ERRORS = (OSError, EOFError, ValueError, zipfile.BadZipFile, tarfile.TarError, zlib.error,
+                  lzma.LZMAError, NotImplementedError)
+# If the optional 7z package is installed, skip 7z archives it can not read #
+if py7zr:
+    ARCHIVE_ERRORS += (py7zr.exceptions.ArchiveError, py7zr.exceptions.PasswordRequired)
+
+
+class ArchiveLimitError(Exception):
+    """ Class for an archive that expands past a zip bomb guard. """
+
+
+class ArchiveLimits:
+    """ Class to group the zip bomb guards applied to each archive expanded. """
+    def __init__(self, depth: int = ARCHIVE_DEPTH, max_members: int = ARCHIVE_MAX_MEMBERS,
+                 max_bytes: int = ARCHIVE_MAX_BYTES):
+        """
+        Initialize the limits from their setting values, raising ValueError if any is malformed.
+
+        :param depth:  The number of nested archive levels expanded, 1 for only the members of the
+                       archives in the dock.
+        :param max_members:  The number of members hashed per archive, nested members included.
+        :param max_bytes:  The number of decompressed bytes read per archive, nested members
+                           included.
+        """
+        # Iterate through the settings, validating each #
+        for setting, value in (('depth', depth), ('max_members', max_members),
+                               ('max_bytes', max_bytes)):
+            try:
+                value = int(value)
+
+            # If the setting is not a number #
+            except ValueError as parse_err:
+                raise ValueError(f'Invalid archive setting {setting}={value}, expected a '
+                                 'positive integer') from parse_err
+
+            # If the setting is not positive #
+            if value < 1:
+                raise ValueError(f'Invalid archive setting {setting}={value}, expected a '
+                                 'positive integer')
+
+            setattr(self, setting, value)
+
+
+class ArchiveMember:
+    """ Class to name a file inside an archive, standing in for its path through the scan. """
+    def __init__(self, archive, member: str):
+        """
+        Initialize the archive the member belongs to and its name within it.
+
+        :param archive:  The path to the archive, or the ArchiveMember of a nested archive.
+        :param member:  The path of the member within the archive.
+        """
+        self.archive = archive
+        self.member = member
+        self.name = member.rstrip('/').rsplit('/', 1)[-1]
+
+    def __eq__(self, other) -> bool:
+        """
+        Checks whether another member names the same file.
+
+        :param other:  The object compared against.
+        :return:  True if the other object is the same member of the same archive.
+        """
+        return isinstance(other, ArchiveMember) and str(self) == str(other)
+
+    def __hash__(self) -> int:
+        """
+        Hashes the member by its full name, so members can be used as dictionary keys.
+
+        :return:  The hash of the full name.
+        """
+        return hash(str(self))
+
+    def __repr__(self) -> str:
+        """
+        Formats the member for debugging.
+
+        :return:  The class name and full name of the member.
+        """
+        return f'ArchiveMember({str(self)!r})'
+
+    def __str__(self) -> str:
+        """
+        Formats the member as the archive path and member path joined by !/, as in jar URLs.
+
+        :return:  The full name of the member, such as VTotalScanDock/bundle.zip!/bin/tool.exe.
+        """
+        return f'{self.archive}!/{self.member}'
+
+    def resolve(self):
+        """
+        Gets the member with the path of its archive on disk made absolute.
+
+        :return:  The ArchiveMember with the resolved archive path.
+        """
+        return ArchiveMember(self.archive.resolve(), self.member)
+
+    def root(self) -> Path:
+        """
+        Gets the archive on disk the member was read from, through any nested archives.
+
+        :return:  The path to the archive on disk.
+        """
+        archive = self.archive
+        # While the archive is itself a member of another archive #
+        while isinstance(archive, ArchiveMember):
+            archive = archive.archive
+
+        return archive
+
+    def stat(self) -> os.stat_result:
+        """
+        Gets the stat data of the archive on disk, which changes whenever the member does.
+
+        :return:  The stat result of the archive on disk.
+        """
+        return self.root().stat()
+
+
+class MemberHasher:
+    """ Class to hash a member as its decompressed bytes arrive, counted against the limits. """
+    def __init__(self, expander, member: ArchiveMember, depth: int):
+        """
+        Initialize the digest state of the member, raising ArchiveLimitError if the archive \
+        already holds the maximum number of members.
+
+        :param expander:  The ArchiveExpander of the archive holding the member.
+        :param member:  The member being hashed.
+        :param depth:  The nesting level of the archive holding the member.
+        """
+        # If the member would pass the member limit #
+        if expander.started >= expander.limits.max_members:
+            raise ArchiveLimitError(f'more than {expander.limits.max_members} members')
+
+        expander.started += 1
+        self.expander = expander
+        self.member = member
+        self.depth = depth
+        self.hashers = [hashlib.new(algorithm) for algorithm in DIGEST_ALGORITHMS]
+        self.finished = False
+        self._size = 0
+        # Leading bytes of the member, kept whole while it may be an archive to be expanded #
+        self._nested = bytearray() if depth < expander.limits.depth else None
+
+    def close(self):
+        """
+        Finishes the member once py7zr decompressed it.
+
+        :return:  Nothing
+        """
+        self.finish()
+
+    def finish(self):
+        """
+        Records the digests of the member once every byte was hashed, then expands it if it is \
+        a nested archive. Calling it again does nothing.
+
+        :return:  Nothing
+        """
+        # If the member was already finished #
+        if self.finished:
+            return
+
+        self.finished = True
+        self.expander.members.append((self.member, {
+            algorithm: hasher.hexdigest()
+            for algorithm, hasher in zip(DIGEST_ALGORITHMS, self.hashers)}))
+
+        # If the member is a nested archive #
+        if self._nested is not None and (archive_type := get_archive_type(self._nested)):
+            self.expander.expand_nested(self.member, archive_type, io.BytesIO(self._nested),
+                                        self.depth + 1)
+
+    def flush(self):
+        """
+        Does nothing, as nothing is buffered for output.
+
+        :return:  Nothing
+        """
+
+    def read(self, _size: int = None) -> bytes:
+        """
+        Reads nothing back, as the member bytes are not kept.
+
+        :param _size:  The number of bytes to be read, ignored.
+        :return:  Empty bytes.
+        """
+        return b''
+
+    def seek(self, _offset: int, _whence: int = 0) -> int:
+        """
+        Does not seek, as the member bytes are not kept.
+
+        :param _offset:  The offset to seek to, ignored.
+        :param _whence:  The position the offset is relative to, ignored.
+        :return:  0
+        """
+        return 0
+
+    def size(self) -> int:
+        """
+        Gets the number of member bytes hashed so far.
+
+        :return:  The number of bytes.
+        """
+        return self._size
+
+    def update(self, chunk: memoryview):
+        """
+        Hashes the next chunk of the member, raising ArchiveLimitError if the archive expands \
+        past the byte limit. A member that may be a nested archive is buffered in memory up to \
+        the buffer size while it is hashed.
+
+        :param chunk:  The next decompressed bytes of the member.
+        :return:  Nothing
+        """
+        self._size += len(chunk)
+        self.expander.expanded += len(chunk)
+        # If the archive expands past the byte limit, such as a zip bomb #
+        if self.expander.expanded > self.expander.limits.max_bytes:
+            raise ArchiveLimitError(f'more than {self.expander.limits.max_bytes} expanded bytes')
+
+        # Iterate through the hashers updating each with the same chunk #
+        for hasher in self.hashers:
+            hasher.update(chunk)
+
+        # If the member may be a nested archive #
+        if self._nested is not None:
+            self._nested += chunk
+            # If the header shows it is not an archive, stop keeping its bytes #
+            if len(self._nested) >= HEADER_LENGTH and not get_archive_type(self._nested):
+                self._nested = None
+            # If the nested archive is too large to be held in memory #
+            elif len(self._nested) > ARCHIVE_BUFFER:
+                logging.warning('Not expanding %s, nested archives over %s bytes are not '
+                                'expanded', self.member, ARCHIVE_BUFFER)
+                self._nested = None
+
+    def write(self, data: bytes) -> int:
+        """
+        Hashes the next bytes py7zr decompressed of the member.
+
+        :param data:  The next decompressed bytes of the member.
+        :return:  The number of bytes taken.
+        """
+        with memoryview(data) as data_view:
+            self.update(data_view)
+
+        return len(data)
+
+
+class MemberFactory:
+    """ Class to stand in for a py7zr writer factory, handing out a hasher per member. """
+    def __init__(self, expander, archive, depth: int):
+        """
+        Initialize the archive the members belong to and the hashers handed out.
+
+        :param expander:  The ArchiveExpander of the archive.
+        :param archive:  The path to the archive, or the ArchiveMember of a nested archive.
+        :param depth:  The nesting level of the archive.
+        """
+        self.expander = expander
+        self.archive = archive
+        self.depth = depth
+        self.created = []
+
+    def create(self, filename: str) -> MemberHasher:
+        """
+        Hands out the hasher of the member py7zr is about to decompress, in place of its output \
+        file.
+
+        :param filename:  The path of the member within the archive.
+        :return:  The member hasher, written the decompressed bytes of the member.
+        """
+        self.created.append(MemberHasher(self.expander, ArchiveMember(self.archive, filename),
+                                         self.depth))
+        return self.created[-1]
+
+
+class ArchiveExpander:
+    """ Class to hash the members of an archive from its decompression stream, within limits. """
+    def __init__(self, limits: ArchiveLimits):
+        """
+        Initialize the limits and the member digests and expanded bytes counted so far.
+
+        :param limits:  The zip bomb guards of the archive.
+        """
+        self.limits = limits
+        # (ArchiveMember, digests) tuples of the members hashed so far #
+        self.members = []
+        # Number of members started, counted against the member limit #
+        self.started = 0
+        self.expanded = 0
+        # Read buffer shared by every member, nested archives are expanded after it is done #
+        self._buffer = bytearray(BUFFER_SIZE)
+
+    def _expand_7z(self, archive, in_file, depth: int):
+        """
+        Hashes the members of a 7z archive as py7zr decompresses them, with a member hasher \
+        standing in for each output file, so nothing is written to disk or held in memory.
+
+        :param archive:  The path to the archive, or the ArchiveMember of a nested archive.
+        :param in_file:  The binary file object the archive is read from.
+        :param depth:  The nesting level of the archive.
+        :return:  Nothing
+        """
+        member_factory = MemberFactory(self, archive, depth)
+
+        with py7zr.SevenZipFile(in_file, mode='r') as seven_zip:
+            # If any member is encrypted, it can not be read without the password #
+            if seven_zip.needs_password():
+                logging.warning('Skipping the members of %s, it is encrypted', archive)
+                return
+
+            seven_zip.extractall(factory=member_factory)
+
+        # Finish the members py7zr versions without the close hook left open #
+        for member_hasher in member_factory.created:
+            member_hasher.finish()
+
+    def _expand_tar(self, archive, in_file, depth: int):
+        """
+        Hashes the members of a plain or compressed tar archive in a single sequential pass, \
+        without indexing or seeking through the archive.
+
+        :param archive:  The path to the archive, or the ArchiveMember of a nested archive.
+        :param in_file:  The binary file object the archive is read from.
+        :param depth:  The nesting level of the archive.
+        :return:  Nothing
+        """
+        with tarfile.open(fileobj=in_file, mode='r|*') as tar_file:
+            # Iterate through the members as they are reached in the stream #
+            for info in tar_file:
+                # If the member is a directory, link, or special file #
+                if not info.isfile():
+                    continue
+
+                with tar_file.extractfile(info) as member_file:
+                    self._hash_member(ArchiveMember(archive, info.name), member_file, depth)
+
+    def _expand_zip(self, archive, in_file, depth: int):
+        """
+        Hashes the members of a zip archive, skipping encrypted members.
+
+        :param archive:  The path to the archive, or the ArchiveMember of a nested archive.
+        :param in_file:  The binary file object the archive is read from.
+        :param depth:  The nesting level of the archive.
+        :return:  Nothing
+        """
+        with zipfile.ZipFile(in_file) as zip_file:
+            # Iterate through the members in the central directory #
+            for info in zip_file.infolist():
+                # If the member is a directory #
+                if info.is_dir():
+                    continue
+
+                member = ArchiveMember(archive, info.filename)
+                # If the member is encrypted, it can not be read without the password #
+                if info.flag_bits & 0x1:
+                    logging.warning('Skipping %s, it is encrypted', member)
+                    continue
+
+                with zip_file.open(info) as member_file:
+                    self._hash_member(member, member_file, depth)
+
+    def _hash_member(self, member: ArchiveMember, member_file, depth: int):
+        """
+        Hashes a member from its decompression stream through the shared read buffer.
+
+        :param member:  The member being hashed.
+        :param member_file:  The binary file object the member is read from.
+        :param depth:  The nesting level of the archive holding the member.
+        :return:  Nothing
+        """
+        member_hasher = MemberHasher(self, member, depth)
+
+        with memoryview(self._buffer) as buffer_view:
+            # Read into the buffer until the end of the member #
+            while bytes_read := member_file.readinto(self._buffer):
+                member_hasher.update(buffer_view[:bytes_read])
+
+        member_hasher.finish()
+
+    def expand(self, file: Path) -> list[tuple]:
+        """
+        Hashes the members of the file if it is an archive. If the archive passes a limit, the \
+        members hashed before it are kept and the rest are skipped.
+
+        :param file:  The path to the file.
+        :return:  List of (ArchiveMember, member digests) tuples, empty if the file is not an \
+                  archive.
+        """
+        try:
+            with file.open('rb') as in_file:
+                archive_type = get_archive_type(in_file.read(HEADER_LENGTH))
+                # If the file is not an archive #
+                if archive_type is None:
+                    return []
+
+                in_file.seek(0)
+                self.expand_nested(file, archive_type, in_file, 1)
+
+        # If the file can not be read, it is still scanned as a whole #
+        except OSError as file_err:
+            logging.warning('Not expanding %s, unable to read it: %s', file, file_err)
+
+        # If the archive expanded past a zip bomb guard #
+        except ArchiveLimitError as limit_err:
+            logging.warning('Stopped expanding %s at %s, keeping the %s members hashed before',
+                            file, limit_err, len(self.members))
+
+        return self.members
+
+    def expand_nested(self, archive, archive_type: str, in_file, depth: int):
+        """
+        Hashes the members of an archive opened from the passed in file object. A corrupt or \
+        unsupported archive is logged and skipped, keeping the members hashed before the error.
+
+        :param archive:  The path to the archive, or the ArchiveMember of a nested archive.
+        :param archive_type:  The archive format, zip, tar, or 7z.
+        :param in_file:  The binary file object the archive is read from.
+        :param depth:  The nesting level of the archive, 1 for an archive in the dock.
+        :return:  Nothing
+        """
+        try:
+            # If the archive is a zip, read its members through the central directory #
+            if archive_type == 'zip':
+                self._expand_zip(archive, in_file, depth)
+            # If the archive is a 7z, which requires the optional package #
+            elif archive_type == '7z':
+                # If the optional 7z package is not installed #
+                if py7zr is None:
+                    logging.warning('Not expanding %s, 7z archives require the py7zr package',
+                                    archive)
+                    return
+
+                self._expand_7z(archive, in_file, depth)
+            else:
+                self._expand_tar(archive, in_file, depth)
+
+        # If the compressed stream does not hold a tar archive, such as a single gzipped file #
+        except tarfile.ReadError as read_err:
+            logging.info('Not expanding %s, it is not a tar archive: %s', archive, read_err)
+
+        # If the archive is corrupt, truncated, or encrypted #
+        except ARCHIVE_ERRORS as archive_err:
+            logging.warning('Stopped expanding %s, unable to read it: %s', archive, archive_err)
+
+
+def expand_archive(file: Path, limits: ArchiveLimits = None) -> list[tuple]:
+    """
+    Hashes the members of the file if it is an archive, with nothing extracted to disk.
+
+    :param file:  The path to the file.
+    :param limits:  The zip bomb guards of the archive, the configured limits if not set.
+    :return:  List of (ArchiveMember, member digests) tuples, empty if the file is not an archive.
+    """
+    return ArchiveExpander(limits or get_archive_limits()).expand(file)
+
+
+def get_archive_limits(overrides: dict = None) -> ArchiveLimits:
+    """
+    Gets the archive limits of the environment settings with the passed in overrides applied \
+    over them, raising ValueError if any setting is malformed.
+
+    :param overrides:  Optional dictionary of settings replacing those of the environment, None
+                       values are ignored.
+    :return:  The archive limits.
+    """
+    return ArchiveLimits(**{setting: value for setting, value in (overrides or {}).items()
+                            if value is not None})
+
+
+def get_archive_type(header: bytes) -> str | None:
+    """
+    Detects the archive format from the leading bytes of a file.
+
+    :param header:  The leading bytes of the file, up to the header length.
+    :return:  The archive format, zip, tar, or 7z, or None if the file is not an archive.
+    """
+    # Iterate through the known signatures #
+    for signature, archive_type in ARCHIVE_SIGNATURES:
+        # If the file starts with the signature #
+        if header.startswith(signature):
+            return archive_type
+
+    # If the file is an uncompressed tar archive #
+    if header[257:262] == b'ustar':
+        return 'tar'
+
+    return None
+
+
+def is_archive(file: Path) -> bool:
+    """
+    Checks whether a file is an archive by its leading bytes.
+
+    :param file:  The path to the file.
+    :return:  True if the file is an archive, False if not or it can not be read.
+    """
+    try:
+        with file.open('rb') as in_file:
+            return get_archive_type(in_file.read(HEADER_LENGTH)) is not None
+
+    # If the file can not be read #
+    except OSError:
+        return False
@@ -0,0 +1,384 @@
+"""
+Watching of the scan dock and its subdirectories for files that land in them, through inotify on
+Linux and a polling fallback elsewhere. A file is only handed to the scan once it was closed for
+writing or moved in, stayed unchanged for the debounce period, and passed the walk filter, so
+partially written files are never scanned.
+
+Built-in modules
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import stat
+import struct
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+from threading import Event
+# Custom modules #
+from Modules.file_walker import filter_files, get_walk_filter, walk_files, WalkFilter
+
+
+# Pseudo constants #
+WATCH_DEBOUNCE = float(os.environ.get('VTOTAL_WATCH_DEBOUNCE', 5.0))
+WATCH_POLL = float(os.environ.get('VTOTAL_WATCH_POLL', 10.0))
+# Longest wait between checks for a stop #
+WATCH_TICK = 1.0
+# inotify event masks from sys/inotify.h #
+IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO = 0x2, 0x8, 0x40, 0x80
+IN_CREATE, IN_DELETE, IN_Q_OVERFLOW, IN_IGNORED = 0x100, 0x200, 0x4000, 0x8000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# Header of each inotify event: watch descriptor, mask, cookie, and name length #
+EVENT_STRUCT = struct.Struct('iIII')
+EVENT_BUFFER = 64 * 1024
+
+
+class DirWatcher:
+    """ Class to collect the files landing in a directory, handing them out once writes settle. """
+    def __init__(self, path: Path, walk_filter: WalkFilter = None,
+                 debounce: float = WATCH_DEBOUNCE, poll_interval: float = WATCH_POLL,
+                 use_inotify: bool = True):
+        """
+        Initialize the watch settings and open inotify, falling back to polling if unavailable.
+
+        :param path:  The directory to be watched.
+        :param walk_filter:  The filter applied to the watched subdirectories and landed files, the
+                             configured filter if not set.
+        :param debounce:  The seconds a file has to stay unchanged before it is handed out.
+        :param poll_interval:  The seconds between directory listings when polling.
+        :param use_inotify:  Whether to use inotify where available, otherwise always poll.
+        """
+        self.path = path
+        self.walk_filter = walk_filter or get_walk_filter()
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        # Files waiting out the debounce, mapped to their [(size, mtime_ns), last change time] #
+        self._pending = {}
+        # Files handed out, mapped to the (size, mtime_ns) they had so unchanged files are skipped #
+        self._seen = {}
+        # Watched directories mapped by their inotify watch descriptor #
+        self._watches = {}
+        self._inotify = open_inotify() if use_inotify else None
+        # If the dock itself could not be watched, poll it instead #
+        if self._inotify is not None and self._add_watch(path) is None:
+            self.close()
+
+        self.mode = 'polling' if self._inotify is None else 'inotify'
+
+    def _add_watch(self, dir_path: Path) -> int | None:
+        """
+        Watches a directory with inotify, unless inotify is closed or it is already watched.
+
+        :param dir_path:  The path to the directory.
+        :return:  The watch descriptor, or None if the directory could not be watched.
+        """
+        # If polling #
+        if self._inotify is None:
+            return None
+
+        wd = get_libc().inotify_add_watch(self._inotify, os.fsencode(str(dir_path)), WATCH_MASK)
+        # If the directory could not be watched, such as when the watch limit is reached #
+        if wd < 0:
+            logging.warning('Unable to watch %s with inotify: %s', dir_path,
+                            os.strerror(ctypes.get_errno()))
+            return None
+
+        self._watches[wd] = dir_path
+        return wd
+
+    def _forget(self, dir_path: Path):
+        """
+        Forgets the waiting and handed out files and the watches below a directory that was \
+        removed or moved out.
+
+        :param dir_path:  The path to the directory.
+        :return:  Nothing
+        """
+        # Iterate through the waiting and handed out files below the directory #
+        for files in (self._pending, self._seen):
+            for file in [file for file in files if dir_path in file.parents]:
+                del files[file]
+
+        # Iterate through the watches below the directory #
+        for wd in [wd for wd, path in self._watches.items()
+                   if path == dir_path or dir_path in path.parents]:
+            del self._watches[wd]
+            # Stop watching a directory moved out, a removed one already dropped its watch #
+            get_libc().inotify_rm_watch(self._inotify, wd)
+
+    def _mark(self, file: Path):
+        """
+        Starts or restarts the debounce of a file that was written, unless it is unchanged since \
+        it was handed out.
+
+        :param file:  The path to the file.
+        :return:  Nothing
+        """
+        # If the file is the .keep file for git tracking #
+        if file.name == '.keep':
+            return
+
+        try:
+            file_sig = get_file_sig(file)
+
+        # If the file was removed or is not a regular file #
+        except OSError:
+            self._pending.pop(file, None)
+            return
+
+        # If the file is unchanged since it was handed out #
+        if file_sig == self._seen.get(file):
+            self._pending.pop(file, None)
+            return
+
+        self._pending[file] = [file_sig, time.monotonic()]
+
+    def _pop_settled(self) -> list[Path]:
+        """
+        Removes the files that stayed unchanged for the debounce period. A file that changed \
+        since it was last checked waits out the debounce again. Settled files the walk filter \
+        rejects are not handed out.
+
+        :return:  The paths to the settled files.
+        """
+        curr_time = time.monotonic()
+        settled = []
+
+        # Iterate through the files waiting out the debounce #
+        for file, (file_sig, change_time) in list(self._pending.items()):
+            # If the file changed too recently #
+            if curr_time - change_time < self.debounce:
+                continue
+
+            try:
+                curr_sig = get_file_sig(file)
+
+            # If the file was removed before it settled #
+            except OSError:
+                del self._pending[file]
+                continue
+
+            # If the file is still being written #
+            if curr_sig != file_sig:
+                self._pending[file] = [curr_sig, curr_time]
+                continue
+
+            del self._pending[file]
+            self._seen[file] = file_sig
+            settled.append(file)
+
+        return list(filter_files(settled, self.path, self.walk_filter))
+
+    def _read_events(self, timeout: float):
+        """
+        Waits for inotify events up to the timeout, marking the files closed after writing or \
+        moved in and walking the subdirectories created or moved in. A queue overflow loses \
+        events, so the directory is walked again.
+
+        :param timeout:  The maximum seconds to wait for events.
+        :return:  Nothing
+        """
+        readable, _, _ = select.select([self._inotify], [], [], timeout)
+        # If no events arrived #
+        if not readable:
+            return
+
+        try:
+            data = os.read(self._inotify, EVENT_BUFFER)
+
+        # If the events were already read #
+        except BlockingIOError:
+            return
+
+        offset = 0
+        # Iterate through the events in the buffer #
+        while offset < len(data):
+            wd, mask, _, name_len = EVENT_STRUCT.unpack_from(data, offset)
+            name = data[offset + EVENT_STRUCT.size:offset + EVENT_STRUCT.size + name_len]
+            offset += EVENT_STRUCT.size + name_len
+
+            # If events were dropped, find the missed files by walking the directory #
+            if mask & IN_Q_OVERFLOW:
+                logging.warning('inotify queue of %s overflowed, walking it again', self.path)
+                self._rescan()
+                continue
+
+            # If a watched subdirectory was removed, its watch is gone #
+            if mask & IN_IGNORED and self._watches.get(wd) != self.path:
+                self._watches.pop(wd, None)
+                continue
+
+            # If the watched directory was removed or unmounted, poll from now on #
+            if mask & IN_IGNORED:
+                logging.warning('inotify watch of %s was removed, falling back to polling',
+                                self.path)
+                self.close()
+                self.mode = 'polling'
+                return
+
+            dir_path = self._watches.get(wd)
+            # If the event is for the watched directory itself, or a watch already removed #
+            if dir_path is None or not name.rstrip(b'\0'):
+                continue
+
+            file = dir_path / os.fsdecode(name.rstrip(b'\0'))
+            # If the event is for a subdirectory #
+            if mask & IN_ISDIR:
+                # If the subdirectory was created or moved in, watch it and the files already in
+                # it #
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._rescan(file)
+                # If the subdirectory was removed or moved out #
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._forget(file)
+                continue
+
+            # If the file was removed or moved out #
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self._pending.pop(file, None)
+                self._seen.pop(file, None)
+            # If the file was closed after writing or moved in, or a waiting file was written #
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) or file in self._pending:
+                self._mark(file)
+
+    def _rescan(self, dir_path: Path = None):
+        """
+        Walks the directory with the walk filter, watching each subdirectory walked with inotify \
+        and marking the new and changed files. A walk of the whole directory also forgets the \
+        removed files.
+
+        :param dir_path:  The subdirectory to be walked, the whole directory if not set.
+        :return:  Nothing
+        """
+        # If the directory was removed or unmounted, try again on the next poll #
+        if not self.path.is_dir():
+            logging.warning('Unable to list %s, it is not a directory', self.path)
+            return
+
+        rel_dir = f'{dir_path.relative_to(self.path).as_posix()}/' if dir_path else ''
+        # If the subdirectory is too deep or excluded #
+        if dir_path and (rel_dir.count('/') > self.walk_filter.depth or
+                         not self.walk_filter.allows_dir(rel_dir[:-1])):
+            return
+
+        files = []
+        # Iterate through the files passing the filter, watching the directories as they are
+        # walked #
+        for file in walk_files(dir_path or self.path, self.walk_filter, self._add_watch, rel_dir):
+            files.append(file)
+            # If the file is not already waiting out the debounce, which checks it for changes #
+            if file not in self._pending:
+                self._mark(file)
+
+        # If only a subdirectory was walked #
+        if dir_path:
+            return
+
+        current = set(files)
+        # Iterate through the handed out files, forgetting the removed ones #
+        for file in [file for file in self._seen if file not in current]:
+            del self._seen[file]
+
+    def close(self):
+        """
+        Closes the inotify instance, which removes its watches.
+
+        :return:  Nothing
+        """
+        # If inotify is open #
+        if self._inotify is not None:
+            os.close(self._inotify)
+            self._inotify = None
+            self._watches.clear()
+
+    def watch(self, stop_event: Event = None):
+        """
+        Yields the files that settled as they land in the directory or its subdirectories, \
+        starting with the files already in them, until the stop event is set. With inotify the \
+        directory is only walked at the start and after a queue overflow, otherwise it is walked \
+        every poll interval.
+
+        :param stop_event:  Optional event that ends the watch when set from another thread.
+        :return:  Generator of lists of settled file paths.
+        """
+        stop_event = stop_event or Event()
+        self._rescan()
+        next_poll = time.monotonic() + self.poll_interval
+
+        # While the watch was not stopped #
+        while not stop_event.is_set():
+            curr_time = time.monotonic()
+            # Wait until the next file settles, checking for a stop every tick #
+            timeout = min([WATCH_TICK] + [max(0.0, change_time + self.debounce - curr_time)
+                                          for _, change_time in self._pending.values()])
+
+            # If inotify is open, wait for its events #
+            if self._inotify is not None:
+                self._read_events(timeout)
+            else:
+                stop_event.wait(min(timeout, max(0.0, next_poll - curr_time)))
+                # If the poll interval has passed, walk the directory #
+                if time.monotonic() >= next_poll:
+                    self._rescan()
+                    next_poll = time.monotonic() + self.poll_interval
+
+            settled = self._pop_settled()
+            # If any files settled #
+            if settled:
+                yield settled
+
+
+def get_file_sig(file: Path) -> tuple[int, int]:
+    """
+    Gets the size and modification time of a regular file, raising OSError if it is not one.
+
+    :param file:  The path to the file.
+    :return:  Tuple of the file size and modification time in nanoseconds.
+    """
+    file_stat = file.stat()
+    # If the path is a directory or special file #
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise IsADirectoryError(f'{file} is not a regular file')
+
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+
+@lru_cache(maxsize=None)
+def get_libc() -> ctypes.CDLL:
+    """
+    Loads the C library holding the inotify calls once, raising OSError if it can not be loaded.
+
+    :return:  The C library.
+    """
+    return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+def open_inotify() -> int | None:
+    """
+    Opens an inotify instance, the directories are watched through it afterwards.
+
+    :return:  The inotify file descriptor, or None if inotify is not available.
+    """
+    # If the platform has no inotify #
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        fd = get_libc().inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+
+    # If the C library could not be loaded or has no inotify #
+    except (OSError, AttributeError) as lib_err:
+        logging.warning('inotify is not available, falling back to polling: %s', lib_err)
+        return None
+
+    # If the inotify instance could not be created #
+    if fd < 0:
+        logging.warning('inotify is not available, falling back to polling: %s',
+                        os.strerror(ctypes.get_errno()))
+        return None
+
+    return fd
@@ -0,0 +1,302 @@
+"""
+Streaming discovery of the files to be scanned. The dock is walked recursively one directory entry
+at a time, reusing the type and stat each directory entry already holds, and files are filtered by
+glob, size, symlink policy, and magic bytes before any hashing, so huge nested docks start scanning
+right away in constant memory.
+
+Built-in modules
+"""
+import logging
+import os
+from fnmatch import fnmatch
+from pathlib import Path
+# Custom modules #
+from Modules.scan_priority import get_file_type, MAGIC_LENGTH, MAGIC_SIGNATURES
+from Modules.utils import error_query
+
+
+# Pseudo constants #
+WALK_INCLUDE = os.environ.get('VTOTAL_WALK_INCLUDE', '')
+WALK_EXCLUDE = os.environ.get('VTOTAL_WALK_EXCLUDE', '')
+WALK_MIN_SIZE = os.environ.get('VTOTAL_WALK_MIN_SIZE', 0)
+WALK_MAX_SIZE = os.environ.get('VTOTAL_WALK_MAX_SIZE', 0)
+WALK_DEPTH = os.environ.get('VTOTAL_WALK_DEPTH', 32)
+WALK_SYMLINKS = os.environ.get('VTOTAL_WALK_SYMLINKS', 'files')
+WALK_TYPES = os.environ.get('VTOTAL_WALK_TYPES', '')
+# Symlinks are skipped, followed to files only, or followed to files and directories #
+SYMLINK_POLICIES = ('skip', 'files', 'follow')
+FILE_TYPES = {file_type for _, file_type in MAGIC_SIGNATURES} | {'script'}
+
+
+class WalkFilter:
+    """ Class to decide which directories are walked and which files are scanned. """
+    def __init__(self, include: str = WALK_INCLUDE, exclude: str = WALK_EXCLUDE,
+                 min_size: int = WALK_MIN_SIZE, max_size: int = WALK_MAX_SIZE,
+                 depth: int = WALK_DEPTH, symlinks: str = WALK_SYMLINKS, types: str = WALK_TYPES):
+        """
+        Initialize the filter settings from their setting strings, raising ValueError if any is \
+        malformed.
+
+        :param include:  Comma-separated globs of the files to be scanned, every file if empty.
+        :param exclude:  Comma-separated globs of the files and directories to be skipped.
+        :param min_size:  The size in bytes of the smallest file scanned.
+        :param max_size:  The size in bytes of the largest file scanned, 0 for no limit.
+        :param depth:  The number of directory levels walked below the dock, 0 for only the dock.
+        :param symlinks:  Whether symlinks are skipped, followed to files, or followed to files
+                          and directories.
+        :param types:  Comma-separated file types detected by magic bytes to be scanned, every
+                       file if empty.
+        """
+        self.include = parse_globs(include)
+        self.exclude = parse_globs(exclude)
+
+        # Iterate through the numeric settings, validating each #
+        for setting, value in (('min_size', min_size), ('max_size', max_size), ('depth', depth)):
+            try:
+                value = int(value)
+
+            # If the setting is not a number #
+            except ValueError as parse_err:
+                raise ValueError(f'Invalid walk setting {setting}={value}, expected a '
+                                 'non-negative integer') from parse_err
+
+            # If the setting is negative #
+            if value < 0:
+                raise ValueError(f'Invalid walk setting {setting}={value}, expected a '
+                                 'non-negative integer')
+
+            setattr(self, setting, value)
+
+        # If the symlink policy is not known #
+        if symlinks not in SYMLINK_POLICIES:
+            raise ValueError(f'Invalid walk setting symlinks={symlinks}, expected one of '
+                             f'{", ".join(SYMLINK_POLICIES)}')
+
+        self.symlinks = symlinks
+        self.types = set(parse_globs(types))
+        # If a file type is not known #
+        if self.types - FILE_TYPES:
+            raise ValueError(f'Invalid walk setting types={types}, expected any of '
+                             f'{", ".join(sorted(FILE_TYPES))}')
+
+    def allows_dir(self, rel_path: str) -> bool:
+        """
+        Checks whether a directory is to be walked.
+
+        :param rel_path:  The path of the directory relative to the dock, with / separators.
+        :return:  True if the directory is not excluded, otherwise False.
+        """
+        return not match_globs(self.exclude, rel_path)
+
+    def allows_file(self, file: Path, rel_path: str, file_size: int) -> bool:
+        """
+        Checks whether a file is to be scanned, reading its leading bytes only if a type filter \
+        is set and every other filter passed.
+
+        :param file:  The path to the file.
+        :param rel_path:  The path of the file relative to the dock, with / separators.
+        :param file_size:  The size of the file in bytes.
+        :return:  True if the file passes every filter, otherwise False.
+        """
+        # If the file is not included or is excluded #
+        if (self.include and not match_globs(self.include, rel_path)) or \
+                match_globs(self.exclude, rel_path):
+            return False
+
+        # If the file is outside the size limits #
+        if file_size < self.min_size or (self.max_size and file_size > self.max_size):
+            return False
+
+        # If no type filter is set #
+        if not self.types:
+            return True
+
+        try:
+            with file.open('rb') as in_file:
+                magic = in_file.read(MAGIC_LENGTH)
+
+        # If the file can not be read, it is skipped rather than stopping the walk #
+        except OSError as file_err:
+            logging.warning('Skipping %s, unable to read its type: %s', file, file_err)
+            return False
+
+        return get_file_type(file, magic) in self.types
+
+
+def filter_files(files: list[Path], root: Path, walk_filter: WalkFilter):
+    """
+    Filters files that were found without walking, such as those landing in watch mode, \
+    skipping symlinks if the filter skips them.
+
+    :param files:  The paths to the files.
+    :param root:  The directory the relative paths of the globs start from.
+    :param walk_filter:  The filter applied to the files.
+    :return:  Generator of the file paths that pass the filter.
+    """
+    # Iterate through the files #
+    for file in files:
+        try:
+            # If symlinks are skipped #
+            if walk_filter.symlinks == 'skip' and file.is_symlink():
+                continue
+
+            file_size = file.stat().st_size
+
+        # If the file was removed since it was found #
+        except OSError as file_err:
+            logging.warning('Skipping %s: %s', file, file_err)
+            continue
+
+        # If the file passes the filters #
+        if walk_filter.allows_file(file, file.relative_to(root).as_posix(), file_size):
+            yield file
+
+
+def get_walk_filter(overrides: dict = None) -> WalkFilter:
+    """
+    Gets the walk filter of the environment settings with the passed in overrides applied over \
+    it, raising ValueError if any setting is malformed.
+
+    :param overrides:  Optional dictionary of settings replacing those of the environment, None
+                       values are ignored.
+    :return:  The walk filter.
+    """
+    return WalkFilter(**{setting: value for setting, value in (overrides or {}).items()
+                         if value is not None})
+
+
+def match_globs(globs: list[str], rel_path: str) -> bool:
+    """
+    Checks whether a path matches any of the globs. A glob holding a / is matched against the \
+    whole relative path, otherwise against the name only.
+
+    :param globs:  The glob patterns.
+    :param rel_path:  The path relative to the dock, with / separators.
+    :return:  True if any glob matches, otherwise False.
+    """
+    # If no globs are set #
+    if not globs:
+        return False
+
+    name = rel_path.rsplit('/', 1)[-1]
+    return any(fnmatch(rel_path if '/' in glob else name, glob) for glob in globs)
+
+
+def parse_globs(setting: str) -> list[str]:
+    """
+    Parses a comma-separated list setting.
+
+    :param setting:  The setting string, such as *.exe,*.dll.
+    :return:  The non empty stripped items.
+    """
+    return [item.strip() for item in setting.split(',') if item.strip()]
+
+
+def walk_files(path: Path, walk_filter: WalkFilter = None, on_dir=None, rel_dir: str = ''):
+    """
+    Walks the directory depth first, yielding each file that passes the filter as soon as its \
+    entry is read. Only an open listing per directory level is held, so memory stays constant \
+    however many entries the tree has. Directories that can not be listed are logged and skipped.
+
+    :param path:  The directory to be walked.
+    :param walk_filter:  The filter applied to directories and files, the configured filter if not
+                         set.
+    :param on_dir:  Optional callable passed the path of each directory walked, starting with the
+                    passed in directory, such as to watch it for files landing later.
+    :param rel_dir:  The path of the directory relative to the dock with a trailing /, when only a
+                     subdirectory of the dock is walked.
+    :return:  Generator of file paths.
+    """
+    walk_filter = walk_filter or get_walk_filter()
+    follow_dirs = walk_filter.symlinks == 'follow'
+    # Only stat the files when a size limit is set, the entry type needs no extra call #
+    check_size = walk_filter.min_size or walk_filter.max_size
+    # Directory levels of the dock above the walked directory, counted against the depth limit #
+    base_depth = rel_dir.count('/')
+    try:
+        stack = [(path, rel_dir, os.scandir(path))]
+        # Directories entered through symlinks, by device and inode, so loops are not walked #
+        visited = {(path.stat().st_dev, path.stat().st_ino)} if follow_dirs else set()
+
+    # If error occurs during file operation #
+    except OSError as dir_err:
+        # If a subdirectory was walked, it is skipped like those found while walking #
+        if rel_dir:
+            logging.warning('Skipping %s: %s', path, dir_err)
+            return
+
+        # Lookup, display, and log IO error #
+        error_query(str(path), 'r', dir_err)
+
+    # If the walked directories are reported #
+    if on_dir:
+        on_dir(path)
+
+    try:
+        # While directories are left to be walked #
+        while stack:
+            dir_path, rel_dir, entries = stack[-1]
+            entry = next(entries, None)
+
+            # If the directory listing is done #
+            if entry is None:
+                entries.close()
+                stack.pop()
+                continue
+
+            # If the file is the .keep file for git tracking #
+            if entry.name == '.keep':
+                continue
+
+            rel_path = rel_dir + entry.name
+            try:
+                is_link = entry.is_symlink()
+                # If symlinks are skipped #
+                if is_link and walk_filter.symlinks == 'skip':
+                    continue
+
+                # If the entry is a directory, or a symlink to one that is followed #
+                if entry.is_dir(follow_symlinks=follow_dirs):
+                    # If the directory is too deep or excluded #
+                    if len(stack) + base_depth > walk_filter.depth or \
+                            not walk_filter.allows_dir(rel_path):
+                        continue
+
+                    # If the directory is a symlink, skip it if it was already walked #
+                    if follow_dirs:
+                        dir_stat = entry.stat()
+                        dir_key = (dir_stat.st_dev, dir_stat.st_ino)
+                        # If the directory was already walked, such as a symlink loop #
+                        if dir_key in visited:
+                            continue
+
+                        visited.add(dir_key)
+
+                    stack.append((dir_path / entry.name, f'{rel_path}/',
+                                  os.scandir(entry.path)))
+                    # If the walked directories are reported #
+                    if on_dir:
+                        on_dir(dir_path / entry.name)
+                    continue
+
+                # If the entry is a special file, or a dangling symlink #
+                if not entry.is_file():
+                    continue
+
+                file_size = entry.stat().st_size if check_size else 0
+
+            # If the entry was removed or can not be read, it is skipped rather than stopping the
+            # walk #
+            except OSError as entry_err:
+                logging.warning('Skipping %s: %s', entry.path, entry_err)
+                continue
+
+            file = dir_path / entry.name
+            # If the file passes the filters #
+            if walk_filter.allows_file(file, rel_path, file_size):
+                yield file
+
+    finally:
+        # Close the listings left open when the consumer stops early #
+        for _, _, entries in stack:
+            entries.close()
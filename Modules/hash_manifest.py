@@ -0,0 +1,277 @@
+"""
+Persistent manifest of file digests keyed by path and stat data, so unchanged files are never
+re-read on later runs. In archive mode the member digests of each archive are kept the same way,
+so unchanged archives are never inflated again.
+
+Built-in modules
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from threading import Lock
+# Custom modules #
+from Modules.archive_members import ArchiveMember
+from Modules.utils import get_file_digests, print_err
+
+
+# Pseudo constants #
+MANIFEST_COMMIT_INTERVAL = 100
+MANIFEST_RETENTION = int(os.environ.get('VTOTAL_MANIFEST_RETENTION', 30 * 86400))
+
+
+class HashManifest:
+    """ Class to map file path, size, modification time, and inode to the file digests. """
+    def __init__(self, db_path: Path, retention: int = MANIFEST_RETENTION):
+        """
+        Open the manifest database, create the digest and archive member tables if they do not
+        exist, and remove entries for files that have not been seen within the retention period.
+
+        :param db_path:  Path to the SQLite manifest database file.
+        :param retention:  Number of seconds an entry is kept after its file was last seen.
+        """
+        self.db_path = db_path
+        # Lock to serialize access from the hashing threads #
+        self._lock = Lock()
+        # Number of changes since the last commit #
+        self._changes = 0
+
+        try:
+            # Open the manifest database, allowing use outside the creating thread #
+            self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS digests ('
+                               'path TEXT PRIMARY KEY, '
+                               'size INTEGER NOT NULL, '
+                               'mtime_ns INTEGER NOT NULL, '
+                               'inode INTEGER NOT NULL, '
+                               'md5 TEXT NOT NULL, '
+                               'sha1 TEXT NOT NULL, '
+                               'sha256 TEXT NOT NULL, '
+                               'last_seen REAL NOT NULL)')
+            # Archives expanded in archive mode, their members are kept in hashing order #
+            self._conn.execute('CREATE TABLE IF NOT EXISTS archives ('
+                               'path TEXT PRIMARY KEY, '
+                               'size INTEGER NOT NULL, '
+                               'mtime_ns INTEGER NOT NULL, '
+                               'inode INTEGER NOT NULL, '
+                               'last_seen REAL NOT NULL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS members ('
+                               'path TEXT NOT NULL, '
+                               'member TEXT NOT NULL, '
+                               'md5 TEXT NOT NULL, '
+                               'sha1 TEXT NOT NULL, '
+                               'sha256 TEXT NOT NULL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS members_path ON members (path)')
+            self._conn.execute('DELETE FROM digests WHERE last_seen < ?',
+                               (time.time() - retention,))
+            self._conn.execute('DELETE FROM members WHERE path IN '
+                               '(SELECT path FROM archives WHERE last_seen < ?)',
+                               (time.time() - retention,))
+            self._conn.execute('DELETE FROM archives WHERE last_seen < ?',
+                               (time.time() - retention,))
+            self._conn.commit()
+
+        # If error occurs opening or creating the database #
+        except sqlite3.Error as db_err:
+            manifest_err(db_path, db_err)
+
+    def _count_change(self):
+        """
+        Counts a change to the manifest, committing the changes once enough have accumulated. \
+        Called with the lock held, sqlite3.Error is raised to the caller.
+
+        :return:  Nothing
+        """
+        self._changes += 1
+
+        # If enough changes have accumulated, commit them #
+        if self._changes >= MANIFEST_COMMIT_INTERVAL:
+            self._conn.commit()
+            self._changes = 0
+
+    def close(self):
+        """
+        Commits any pending entries and closes the connection to the manifest database.
+
+        :return:  Nothing
+        """
+        with self._lock:
+            try:
+                self._conn.commit()
+
+            # If error occurs writing to the database #
+            except sqlite3.Error as db_err:
+                manifest_err(self.db_path, db_err)
+
+            self._conn.close()
+
+    def get_digests(self, file_path: Path) -> dict[str, str] | None:
+        """
+        Gets the digests of the passed in file from the manifest if the file is unchanged, \
+        otherwise hashes the file and updates its manifest entry. A file that can not be read is \
+        reported and left out of the manifest.
+
+        :param file_path:  The path to the file to be hashed.
+        :return:  Dictionary mapping each algorithm name to its hex digest, None if not readable.
+        """
+        try:
+            # Get the file stat data the manifest entry is validated against #
+            file_stat = file_path.stat()
+
+        # If error occurs during file operation #
+        except OSError as file_err:
+            # Print error and log #
+            print_err(f'Unable to read {file_path}: {file_err}')
+            logging.warning('Unable to read %s: %s', file_path, file_err)
+            return None
+
+        path_key = str(file_path.resolve())
+        stat_key = (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+        with self._lock:
+            try:
+                row = self._conn.execute('SELECT size, mtime_ns, inode, md5, sha1, sha256 '
+                                         'FROM digests WHERE path = ?', (path_key,)).fetchone()
+
+            # If error occurs querying the database #
+            except sqlite3.Error as db_err:
+                manifest_err(self.db_path, db_err)
+
+        # If the file is unchanged since it was last hashed #
+        if row and tuple(row[:3]) == stat_key:
+            digests = {'md5': row[3], 'sha1': row[4], 'sha256': row[5]}
+        # If the file is new or has changed #
+        else:
+            digests = get_file_digests(file_path)
+            # If the file could not be read, there is nothing to save #
+            if digests is None:
+                return None
+
+        with self._lock:
+            try:
+                # Save the digests with the stat data they were computed for #
+                self._conn.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                   (path_key, *stat_key, digests['md5'], digests['sha1'],
+                                    digests['sha256'], time.time()))
+                self._count_change()
+
+            # If error occurs writing to the database #
+            except sqlite3.Error as db_err:
+                manifest_err(self.db_path, db_err)
+
+        return digests
+
+    def get_members(self, file_path: Path, expand_func) -> list[tuple]:
+        """
+        Gets the member digests of the passed in archive from the manifest if the archive is \
+        unchanged, otherwise expands it and replaces its manifest entries. Files that are not \
+        archives are kept with no members, so their headers are not read again either.
+
+        :param file_path:  The path to the file.
+        :param expand_func:  Callable passed the file path that returns a list of (ArchiveMember,
+                             member digests) tuples, such as expand_archive.
+        :return:  List of (ArchiveMember, member digests) tuples, empty if the file is not an \
+                  archive.
+        """
+        try:
+            # Get the archive stat data the manifest entries are validated against #
+            file_stat = file_path.stat()
+
+        # If the file was removed since it was hashed #
+        except OSError as file_err:
+            logging.warning('Not expanding %s, unable to read it: %s', file_path, file_err)
+            return []
+
+        path_key = str(file_path.resolve())
+        stat_key = (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+        with self._lock:
+            try:
+                row = self._conn.execute('SELECT size, mtime_ns, inode FROM archives '
+                                         'WHERE path = ?', (path_key,)).fetchone()
+
+                # If the archive is unchanged since it was last expanded #
+                if row and tuple(row) == stat_key:
+                    member_rows = self._conn.execute('SELECT member, md5, sha1, sha256 '
+                                                     'FROM members WHERE path = ? ORDER BY rowid',
+                                                     (path_key,)).fetchall()
+                    self._conn.execute('UPDATE archives SET last_seen = ? WHERE path = ?',
+                                       (time.time(), path_key))
+                    self._count_change()
+
+                    return [(make_member(file_path, json.loads(member)),
+                             {'md5': md5, 'sha1': sha1, 'sha256': sha256})
+                            for member, md5, sha1, sha256 in member_rows]
+
+            # If error occurs accessing the database #
+            except sqlite3.Error as db_err:
+                manifest_err(self.db_path, db_err)
+
+        # The archive is new or has changed, expand it outside the lock #
+        members = expand_func(file_path)
+
+        with self._lock:
+            try:
+                # Replace the members with those of the archive as it is now #
+                self._conn.execute('DELETE FROM members WHERE path = ?', (path_key,))
+                self._conn.executemany('INSERT INTO members VALUES (?, ?, ?, ?, ?)',
+                                       [(path_key, json.dumps(get_member_chain(member)),
+                                         digests['md5'], digests['sha1'], digests['sha256'])
+                                        for member, digests in members])
+                self._conn.execute('INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?, ?)',
+                                   (path_key, *stat_key, time.time()))
+                self._count_change()
+
+            # If error occurs writing to the database #
+            except sqlite3.Error as db_err:
+                manifest_err(self.db_path, db_err)
+
+        return members
+
+
+def get_member_chain(member: ArchiveMember) -> list[str]:
+    """
+    Gets the member paths leading from the archive on disk to the passed in member.
+
+    :param member:  The archive member.
+    :return:  The member paths, outermost first, such as ['inner.zip', 'bin/tool.exe'].
+    """
+    chain = []
+    # While the member is inside an archive #
+    while isinstance(member, ArchiveMember):
+        chain.append(member.member)
+        member = member.archive
+
+    return chain[::-1]
+
+
+def make_member(archive: Path, chain: list[str]) -> ArchiveMember:
+    """
+    Builds the member reached from the archive on disk through the passed in member paths.
+
+    :param archive:  The path to the archive on disk.
+    :param chain:  The member paths, outermost first, as from get_member_chain.
+    :return:  The archive member.
+    """
+    member = archive
+    # Iterate through the member paths, nesting each inside the one before #
+    for member_path in chain:
+        member = ArchiveMember(member, member_path)
+
+    return member
+
+
+def manifest_err(db_path: Path, err_obj: sqlite3.Error):
+    """
+    Displays and logs a hash manifest database error, then exits.
+
+    :param db_path:  Path to the manifest database where the error occurred.
+    :param err_obj:  The SQLite error instance.
+    :return:  Nothing
+    """
+    print_err(f'Error occurred accessing hash manifest {db_path} - {err_obj}')
+    logging.exception('Error occurred accessing hash manifest %s: %s', db_path, err_obj)
+    sys.exit(13)
@@ -0,0 +1,123 @@
+"""
+File hashing engine computing multiple digests in a single read pass with large reusable buffers,
+memory mapping, or hashlib.file_digest depending on the selected strategy.
+
+Built-in modules
+"""
+import hashlib
+import mmap
+import os
+from pathlib import Path
+
+
+# Pseudo constants #
+DIGEST_ALGORITHMS = ('md5', 'sha1', 'sha256')
+BUFFER_SIZE = int(os.environ.get('VTOTAL_HASH_BUFFER', 256 * 1024))
+HASH_STRATEGY = os.environ.get('VTOTAL_HASH_STRATEGY', 'auto')
+MMAP_THRESHOLD = 16 * 1024 * 1024
+STRATEGIES = ('auto', 'buffered', 'file_digest', 'mmap')
+
+
+def hash_buffered(in_file, hashers: list, buffer_size: int, file_size: int):
+    """
+    Feeds the file to the hashers through a single reusable buffer, avoiding a new bytes object \
+    per read.
+
+    :param in_file:  The unbuffered binary file object to be hashed.
+    :param hashers:  The hashlib instances to be updated.
+    :param buffer_size:  The maximum number of bytes read per chunk.
+    :param file_size:  The size of the file in bytes, small files get a buffer no larger than the
+                       file since allocating a large buffer costs more than hashing them.
+    :return:  Nothing
+    """
+    buffer = bytearray(max(1, min(buffer_size, file_size)))
+
+    with memoryview(buffer) as buffer_view:
+        # Read into the buffer until the end of the file #
+        while bytes_read := in_file.readinto(buffer):
+            # Iterate through the hashers updating each with the same chunk #
+            for hasher in hashers:
+                hasher.update(buffer_view[:bytes_read])
+
+
+def hash_file(file_path: Path, algorithms: tuple = DIGEST_ALGORITHMS,
+              buffer_size: int = BUFFER_SIZE, strategy: str = HASH_STRATEGY) -> dict[str, str]:
+    """
+    Computes the passed in digests of a file in a single read pass. OSError is raised to the \
+    caller if the file can not be read.
+
+    :param file_path:  The path to the file to be hashed.
+    :param algorithms:  The hashlib algorithm names to be computed.
+    :param buffer_size:  The number of bytes read or mapped per chunk.
+    :param strategy:  The read strategy, one of the STRATEGIES names.
+    :return:  Dictionary mapping each algorithm name to its hex digest.
+    """
+    # If the strategy is unknown #
+    if strategy not in STRATEGIES:
+        raise ValueError(f'Unknown hash strategy {strategy}, expected one of {STRATEGIES}')
+
+    # Open the file without Python level buffering, chunks are read directly into the buffer #
+    with open(file_path, 'rb', buffering=0) as in_file:
+        file_size = os.fstat(in_file.fileno()).st_size
+
+        # If the strategy is selected automatically #
+        if strategy == 'auto':
+            strategy = select_strategy(file_size)
+
+        # If a single digest is wanted and hashlib can read the file itself #
+        if strategy == 'file_digest' and len(algorithms) == 1 and \
+        hasattr(hashlib, 'file_digest'):
+            return {algorithms[0]: hashlib.file_digest(in_file, algorithms[0]).hexdigest()}
+
+        hashers = [hashlib.new(algorithm) for algorithm in algorithms]
+
+        # If memory mapping is selected and the file is not empty (empty files can't be mapped) #
+        if strategy == 'mmap' and file_size:
+            hash_mmap(in_file, hashers, buffer_size)
+        # For buffered reads and fallbacks #
+        else:
+            hash_buffered(in_file, hashers, buffer_size, file_size)
+
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in zip(algorithms, hashers)}
+
+
+def hash_mmap(in_file, hashers: list, buffer_size: int):
+    """
+    Feeds the memory mapped file to the hashers in slices, letting the OS page the file in \
+    without copying it into Python buffers.
+
+    :param in_file:  The binary file object to be hashed.
+    :param hashers:  The hashlib instances to be updated.
+    :param buffer_size:  The number of bytes passed to the hashers per slice.
+    :return:  Nothing
+    """
+    with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        # Hint the OS that the file is read sequentially, where supported #
+        if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+        with memoryview(mapped) as mapped_view:
+            # Iterate through the mapped file in buffer sized slices #
+            for offset in range(0, len(mapped), buffer_size):
+                chunk = mapped_view[offset:offset + buffer_size]
+
+                # Iterate through the hashers updating each with the same slice #
+                for hasher in hashers:
+                    hasher.update(chunk)
+
+                chunk.release()
+
+
+def select_strategy(file_size: int) -> str:
+    """
+    Selects the read strategy for a file, based on the results of Benchmarks/hash_benchmark.py.
+
+    :param file_size:  The size of the file in bytes.
+    :return:  The name of the selected strategy.
+    """
+    # If the file is large, mapping avoids copying every chunk into a Python buffer #
+    if file_size >= MMAP_THRESHOLD:
+        return 'mmap'
+
+    # hashlib.file_digest is never selected, its fixed internal buffer is slower on small files #
+    return 'buffered'
@@ -0,0 +1,371 @@
+"""
+Pool of Virus-Total API keys with per-key quota ledgers, sending each request through the key with
+the most available capacity and cooling down keys the API throttles or rejects.
+
+Built-in modules
+"""
+import hashlib
+import heapq
+import logging
+import os
+import time
+from collections import deque
+from pathlib import Path
+from threading import Event
+# External modules #
+import requests
+# Custom modules #
+from Modules.quota_ledger import import_legacy_count, MINUTE_SECONDS, QuotaLedger
+from Modules.quota_profile import get_daily_quota
+from Modules.rate_limiter import DAILY_LIMIT, MINUTE_LIMIT, RateLimiter
+from Modules.retry_queue import classify_response
+from Modules.scan_metrics import ScanMetrics
+from Modules.utils import batch_query
+from Modules.vt_client import API_BASE, create_session, HTTP_POOL_SIZE, VirusTotalClient
+
+
+# Pseudo constants #
+KEY_COOLDOWNS = {204: MINUTE_SECONDS, 403: 3600}
+MAX_STRIKES = 4
+
+
+class KeyEntry:
+    """ Class to group an API key with its API instance, quota ledger, and rate limiter. """
+    def __init__(self, api_key: str, state_dir: Path, limits: tuple, margin: float = 1.0,
+                 api_base: str = API_BASE, session: requests.Session = None):
+        """
+        Initialize the API instance and open the quota ledger of the key.
+
+        :param api_key:  The Virus Total API key.
+        :param state_dir:  The directory where the key quota ledger is stored.
+        :param limits:  Tuple of (max requests, window seconds) pairs enforced for the key.
+        :param margin:  Extra seconds added to rate limit waits.
+        :param api_base:  The base URL of the API, such as the benchmark stub server.
+        :param session:  The pooled session shared by every key.
+        """
+        # Identify the key in file names and logs without exposing it #
+        self.key_id = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+        self.vt_object = VirusTotalClient(api_key, session, api_base)
+        self.ledger = QuotaLedger(state_dir / f'quota_ledger_{self.key_id}.log')
+        self.limiter = RateLimiter(self.ledger, limits, margin)
+        self.limits = limits
+        self.cooldown_until = 0.0
+        # Number of throttled responses in a row, lengthening each cool down #
+        self.strikes = 0
+
+    def capacity(self) -> int:
+        """
+        Gets the number of requests the key can make right now without exceeding any limit.
+
+        :return:  The smallest number of requests left across the key limits.
+        """
+        # If the key is cooling down #
+        if self.cooldown_until > time.time():
+            return 0
+
+        return min(max_calls - self.ledger.count(period) for max_calls, period in self.limits)
+
+    def wait_time(self) -> float:
+        """
+        Calculates how long until the key can make another request.
+
+        :return:  The number of seconds to wait, 0 if a request can be made now.
+        """
+        return max(self.limiter.wait_time(), self.cooldown_until - time.time(), 0.0)
+
+
+class KeyPool:
+    """ Class to schedule API requests across multiple keys by their available quota. """
+    def __init__(self, api_keys: list[str], state_dir: Path,
+                 limits: tuple = (MINUTE_LIMIT, DAILY_LIMIT), cancel_event: Event = None,
+                 cooldowns: dict = None, margin: float = 1.0, api_base: str = API_BASE,
+                 pool_size: int = HTTP_POOL_SIZE, metrics: ScanMetrics = None):
+        """
+        Create the pooled session and initialize an entry for each API key.
+
+        :param api_keys:  The Virus Total API keys.
+        :param state_dir:  The directory where the key quota ledgers are stored.
+        :param limits:  Tuple of (max requests, window seconds) pairs enforced per key, the one
+                        with the longest window is the daily quota. ValueError is raised if the
+                        limits are not usable.
+        :param cancel_event:  Optional event that interrupts rate limit waits when set.
+        :param cooldowns:  Optional dictionary mapping throttle and reject response codes to the
+                           seconds a key is cooled down, KEY_COOLDOWNS if not set.
+        :param margin:  Extra seconds added to rate limit waits.
+        :param api_base:  The base URL of the API, such as the benchmark stub server.
+        :param pool_size:  The number of keep-alive connections, at least the requests in flight.
+        :param metrics:  Optional metrics of the scan the requests and waits are recorded in.
+        """
+        # The limit with the longest window is the daily quota, checked before anything is opened #
+        self.daily_limit, self.daily_window = get_daily_quota(limits)
+        # Share one pool of keep-alive connections across every key #
+        self.session = create_session(pool_size)
+        self.entries = [KeyEntry(api_key, state_dir, limits, margin, api_base, self.session)
+                        for api_key in api_keys]
+        # If any key is set, count the requests of earlier versions, which used a single key #
+        if self.entries:
+            import_legacy_count(self.entries[0].ledger, state_dir)
+        self.cancel_event = cancel_event
+        self.cooldowns = cooldowns or KEY_COOLDOWNS
+        self.metrics = metrics or ScanMetrics()
+        self.limits = limits
+        self.margin = margin
+
+    def acquire(self, wait_callback=None) -> KeyEntry | None:
+        """
+        Selects the key with the most available capacity, sleeping until one has capacity, and \
+        records the request against it.
+
+        :param wait_callback:  Optional callable passed the number of seconds before each sleep.
+        :return:  The key entry the request is to be sent with, or None if the wait was cancelled.
+        """
+        wait_start = time.perf_counter()
+        while True:
+            entry, wait = self.reserve()
+            # If a key was reserved #
+            if entry:
+                # If the request waited for a key #
+                if time.perf_counter() - wait_start > 0.001:
+                    self.metrics.observe('rate_limit_wait_seconds',
+                                         time.perf_counter() - wait_start)
+                return entry
+
+            # If a callback was passed in, report the upcoming wait #
+            if wait_callback:
+                wait_callback(wait)
+
+            # If a cancel event was passed in, sleep on it so the wait can be interrupted #
+            if self.cancel_event:
+                # If the wait was cancelled #
+                if self.cancel_event.wait(wait):
+                    return None
+            else:
+                time.sleep(wait)
+
+    def close(self):
+        """
+        Closes the quota ledgers of every key and the pooled connections.
+
+        :return:  Nothing
+        """
+        # Iterate through the key entries #
+        for entry in self.entries:
+            entry.ledger.close()
+
+        self.session.close()
+
+    def cooldown(self, entry: KeyEntry, response_code: int):
+        """
+        Takes a key out of rotation after it was throttled or rejected by the API. A key throttled \
+        repeatedly, such as one also used elsewhere, is cooled down twice as long each time, \
+        while throttles of concurrent requests during a cool down do not lengthen it.
+
+        :param entry:  The key entry that received the error response.
+        :param response_code:  The HTTP response code returned by the API.
+        :return:  Nothing
+        """
+        cooldown = self.cooldowns[response_code]
+        # If the key was throttled, back off further on each throttle in a row #
+        if response_code == 204:
+            # If the key is already cooling down after a concurrent request was throttled #
+            if entry.cooldown_until > time.time():
+                return
+
+            cooldown *= 2 ** min(entry.strikes, MAX_STRIKES)
+            entry.strikes += 1
+
+        entry.cooldown_until = time.time() + cooldown
+        logging.warning('API key %s returned %s, cooling down for %s seconds', entry.key_id,
+                        response_code, cooldown)
+
+    def daily_count(self) -> int:
+        """
+        Counts the requests made in the daily quota window across every key.
+
+        :return:  The total number of requests in the daily quota window.
+        """
+        return sum(entry.ledger.count(self.daily_window) for entry in self.entries)
+
+    def daily_remaining(self) -> int:
+        """
+        Counts the requests left in the daily quota window across every key.
+
+        :return:  The total number of requests left today.
+        """
+        return sum(max(0, self.daily_limit - entry.ledger.count(self.daily_window))
+                   for entry in self.entries)
+
+    def drain_time(self, requests: int) -> float:
+        """
+        Estimates how long until the passed in number of requests are sent at the full allowed \
+        rate, replaying the limits of each key over its recorded request times, so the daily \
+        quota freed as the oldest requests leave the 24 hour window is counted.
+
+        :param requests:  The number of requests to be sent.
+        :return:  The number of seconds until the last request can be sent, 0 if none are left.
+        """
+        curr_time = time.time()
+        # Only the most recent requests up to the largest limit can hold up the next one #
+        depth = max(max_calls for max_calls, _ in self.limits)
+        window = max(period for _, period in self.limits)
+        key_stamps, slots = [], []
+
+        # Iterate through the key entries, finding when each can send its next request #
+        for index, entry in enumerate(self.entries):
+            key_stamps.append(deque(entry.ledger.stamps_within(window), maxlen=depth))
+            slots.append((next_slot(key_stamps[index], self.limits,
+                                    max(curr_time, entry.cooldown_until), self.margin), index))
+
+        heapq.heapify(slots)
+        slot = curr_time
+
+        # Assign each request to the key that can send it first #
+        for _ in range(requests):
+            slot, index = heapq.heappop(slots)
+            key_stamps[index].append(slot)
+            heapq.heappush(slots, (next_slot(key_stamps[index], self.limits, slot, self.margin),
+                                   index))
+
+        return max(0.0, slot - curr_time)
+
+    def query(self, file_hashes: list[str], wait_callback=None) -> dict[str, dict] | None:
+        """
+        Sends a batch of hashes through the best available key. If the key is throttled or \
+        rejected, it is cooled down and the batch is resent with another key while any remain.
+
+        :param file_hashes:  The SHA256 digests to be tested with the Virus Total API.
+        :param wait_callback:  Optional callable passed the number of seconds before each sleep.
+        :return:  Dictionary mapping each passed in hash to its response dictionary, or None if \
+                  the wait was cancelled.
+        """
+        while True:
+            entry = self.acquire(wait_callback)
+            # If the wait was cancelled #
+            if entry is None:
+                return None
+
+            with self.metrics.timer('request_seconds', kind='lookup'):
+                responses = batch_query(file_hashes, entry.vt_object)
+
+            # If the responses are not to be resent with another key #
+            if self.settle(entry, responses):
+                return responses
+
+    def reserve(self) -> tuple[KeyEntry | None, float]:
+        """
+        Records a request against the key with the most available capacity without waiting.
+
+        :return:  Tuple of the reserved key entry and 0, or None and the number of seconds until \
+                  a key frees up.
+        """
+        # Get the keys that still have quota left today #
+        usable = [entry for entry in self.entries
+                  if entry.ledger.count(self.daily_window) < self.daily_limit]
+        # If every key used up its daily quota, report how long until the first one frees up #
+        if not usable:
+            return None, self.drain_time(1)
+
+        # Pick the key with the most requests available now #
+        best = max(usable, key=lambda entry: entry.capacity())
+
+        # If the key can not make a request now, report how long until the first key frees up #
+        if best.capacity() <= 0:
+            return None, min(entry.wait_time() for entry in usable)
+
+        best.ledger.record()
+        return best, 0.0
+
+    def settle(self, entry: KeyEntry, responses: dict[str, dict], kind: str = 'lookup') -> bool:
+        """
+        Checks the responses of a request for throttling or rejection of its key, cooling the key \
+        down if so, and counts the request by its outcome.
+
+        :param entry:  The key entry the request was sent with.
+        :param responses:  Dictionary mapping each hash of the request to its response dictionary.
+        :param kind:  The kind of request, lookup or upload.
+        :return:  True if the responses are final, False if the request is to be resent with \
+                  another key.
+        """
+        response = next(iter(responses.values()))
+        self.metrics.count('requests_total', kind=kind, outcome=classify_response(response))
+        response_code = response.get('response_code')
+
+        # If the key was not throttled or rejected #
+        if response_code not in self.cooldowns:
+            entry.strikes = 0
+            return True
+
+        self.cooldown(entry, response_code)
+        # If no other key is out of cool down with quota left, the error is final #
+        return not any(other.capacity() for other in self.entries if other is not entry)
+
+    def submit(self, file_path: Path, file_hash: str, wait_callback=None) -> dict | None:
+        """
+        Uploads a file through the best available key, counted against its limits as any other \
+        request. If the key is throttled or rejected, it is cooled down and the upload is resent \
+        with another key while any remain.
+
+        :param file_path:  The path to the file to be uploaded.
+        :param file_hash:  The SHA256 digest of the file.
+        :param wait_callback:  Optional callable passed the number of seconds before each sleep.
+        :return:  The upload response dictionary, or None if the wait was cancelled.
+        """
+        while True:
+            entry = self.acquire(wait_callback)
+            # If the wait was cancelled #
+            if entry is None:
+                return None
+
+            with self.metrics.timer('request_seconds', kind='upload'):
+                response = entry.vt_object.scan_file(file_path)
+
+            # If the response is not to be resent with another key #
+            if self.settle(entry, {file_hash: response}, 'upload'):
+                return response
+
+
+def get_api_keys() -> list[str]:
+    """
+    Gets the API keys from the comma-separated VTOTAL_API_KEYS environment variable, falling \
+    back to the single VTOTAL_API_KEY variable.
+
+    :return:  The list of API keys, empty if none are set.
+    """
+    api_keys = os.environ.get('VTOTAL_API_KEYS') or os.environ.get('VTOTAL_API_KEY') or ''
+    return [api_key.strip() for api_key in api_keys.split(',') if api_key.strip()]
+
+
+def get_daily_count(api_keys: list[str], state_dir: Path) -> int:
+    """
+    Counts the requests made in the last 24 hours across the passed in keys, without a scan.
+
+    :param api_keys:  The Virus Total API keys.
+    :param state_dir:  The directory where the key quota ledgers are stored.
+    :return:  The total number of requests in the last 24 hours.
+    """
+    key_pool = KeyPool(api_keys, state_dir)
+    daily_count = key_pool.daily_count()
+    key_pool.close()
+
+    return daily_count
+
+
+def next_slot(stamps: deque, limits: tuple, start: float, margin: float) -> float:
+    """
+    Calculates the earliest time a key can send its next request without exceeding any limit.
+
+    :param stamps:  The recent request times of the key, oldest first.
+    :param limits:  Tuple of (max requests, window seconds) pairs enforced for the key.
+    :param start:  The earliest time the request can be sent.
+    :param margin:  Extra seconds added to rate limit waits.
+    :return:  The timestamp the next request can be sent at.
+    """
+    slot = start
+
+    # Iterate through the limits #
+    for max_calls, period in limits:
+        # If the window is full, wait until the request holding the slot leaves it #
+        if len(stamps) >= max_calls:
+            slot = max(slot, stamps[-max_calls] + period + margin)
+
+    return slot
@@ -0,0 +1,267 @@
+"""
+Append-only ledger of API request times, written and synced per request so the quota usage
+survives crashes and interrupts, and answers sliding window usage counts in O(log n).
+
+Built-in modules
+"""
+import csv
+import logging
+import os
+import pickle
+import time
+from bisect import bisect_right, insort
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+# Custom modules #
+from Modules.utils import error_query
+
+
+# Pseudo constants #
+DAY_SECONDS = 86400
+MINUTE_SECONDS = 60
+LEDGER_RETENTION = DAY_SECONDS
+COMPACT_THRESHOLD = 4096
+# Daily count and period start time files written by earlier versions #
+LEGACY_COUNTER = 'counter_data.data'
+LEGACY_TIME = 'last_execution_time.csv'
+
+
+class QuotaLedger:
+    """ Class to record the exact time of each API request in an append-only file. """
+    def __init__(self, ledger_file: Path, retention: int = LEDGER_RETENTION):
+        """
+        Load the request times still within the retention period, compact the file if it holds
+        many expired entries, and open it for appending.
+
+        :param ledger_file:  Path to the ledger file.
+        :param retention:  Number of seconds request times are kept.
+        """
+        self.ledger_file = ledger_file
+        self.retention = retention
+        self._lock = Lock()
+        self._stamps, expired = self._load()
+
+        # If enough expired entries have built up, rewrite the file without them #
+        if expired >= COMPACT_THRESHOLD:
+            self._compact()
+
+        try:
+            # Open the ledger with a raw descriptor so each entry is a single append write #
+            self._fd = os.open(str(ledger_file), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+        # If error occurs during file operation #
+        except OSError as file_err:
+            # Lookup, display, and log IO error #
+            error_query(str(ledger_file), 'a', file_err)
+
+    def _compact(self):
+        """
+        Atomically rewrites the ledger with only the request times within the retention period.
+
+        :return:  Nothing
+        """
+        temp_file = self.ledger_file.with_name(f'{self.ledger_file.name}.tmp')
+        try:
+            # Write to a temp file and swap it in, so an interrupt never loses the ledger #
+            with temp_file.open('w', encoding='utf-8') as out_file:
+                out_file.write(''.join(f'{stamp:.6f}\n' for stamp in self._stamps))
+                out_file.flush()
+                os.fsync(out_file.fileno())
+
+            os.replace(temp_file, self.ledger_file)
+
+        # If error occurs during file operation #
+        except OSError as file_err:
+            # Lookup, display, and log IO error #
+            error_query(str(self.ledger_file), 'w', file_err)
+
+    def _load(self) -> tuple[list[float], int]:
+        """
+        Reads the ledger file, skipping an entry cut short by a crash and terminating it so the
+        next append starts on its own line.
+
+        :return:  The sorted request times within the retention period and the number of expired
+                  entries in the file.
+        """
+        # If no request has been recorded yet #
+        if not self.ledger_file.exists():
+            return [], 0
+
+        try:
+            ledger_data = self.ledger_file.read_text(encoding='utf-8')
+
+            # If the last entry was cut short, terminate it so it stays separate #
+            if ledger_data and not ledger_data.endswith('\n'):
+                with self.ledger_file.open('a', encoding='utf-8') as out_file:
+                    out_file.write('\n')
+
+        # If error occurs during file operation #
+        except OSError as file_err:
+            # Lookup, display, and log IO error #
+            error_query(str(self.ledger_file), 'r', file_err)
+
+        curr_time = time.time()
+        stamps = []
+
+        # Iterate through the ledger entries #
+        for line in ledger_data.splitlines():
+            try:
+                stamp = float(line)
+
+            # If the entry was cut short by a crash #
+            except ValueError:
+                logging.warning('Skipping unreadable quota ledger entry: %r', line)
+                continue
+
+            # If the entry is from the future it was corrupted #
+            if stamp > curr_time + MINUTE_SECONDS:
+                logging.warning('Skipping future quota ledger entry: %r', line)
+                continue
+
+            stamps.append(stamp)
+
+        stamps.sort()
+        expired = bisect_right(stamps, curr_time - self.retention)
+
+        return stamps[expired:], expired
+
+    def close(self):
+        """
+        Closes the ledger file descriptor.
+
+        :return:  Nothing
+        """
+        with self._lock:
+            os.close(self._fd)
+
+    def count(self, period: float) -> int:
+        """
+        Counts the recorded requests within the passed in number of seconds.
+
+        :param period:  The number of seconds to look back from the current time.
+        :return:  The number of requests made within the period.
+        """
+        with self._lock:
+            return len(self._stamps) - bisect_right(self._stamps, time.time() - period)
+
+    def record(self, stamp: float | None = None):
+        """
+        Appends a request time to the ledger and syncs it to disk before returning.
+
+        :param stamp:  The request timestamp, the current time if not passed in.
+        :return:  Nothing
+        """
+        # If no timestamp was passed in #
+        if stamp is None:
+            stamp = time.time()
+
+        with self._lock:
+            try:
+                # Write the entry in one append so it can not interleave with other writers #
+                os.write(self._fd, f'{stamp:.6f}\n'.encode('utf-8'))
+                os.fsync(self._fd)
+
+            # If error occurs during file operation #
+            except OSError as file_err:
+                # Lookup, display, and log IO error #
+                error_query(str(self.ledger_file), 'a', file_err)
+
+            # Drop the times that have fallen out of the retention period #
+            del self._stamps[:bisect_right(self._stamps, time.time() - self.retention)]
+            # Insert in order, as imported legacy times can be older than the recorded ones #
+            insort(self._stamps, stamp)
+
+    def stamp_within(self, period: float, index: int) -> float | None:
+        """
+        Gets the request time at the passed in position among the requests within the period.
+
+        :param period:  The number of seconds to look back from the current time.
+        :param index:  The position of the request from the oldest in the period.
+        :return:  The request timestamp, or None if there are not enough requests in the period.
+        """
+        with self._lock:
+            position = bisect_right(self._stamps, time.time() - period) + index
+
+            # If there are fewer requests in the period than the position #
+            if position >= len(self._stamps):
+                return None
+
+            return self._stamps[position]
+
+    def stamps_within(self, period: float) -> list[float]:
+        """
+        Gets the request times within the passed in number of seconds, oldest first.
+
+        :param period:  The number of seconds to look back from the current time.
+        :return:  The sorted request timestamps within the period.
+        """
+        with self._lock:
+            return self._stamps[bisect_right(self._stamps, time.time() - period):]
+
+
+def get_legacy_start(time_file: Path) -> float:
+    """
+    Gets the start of the 24 hour period stored by earlier versions as the month, day, and hour \
+    of its first request, in the last year.
+
+    :param time_file:  Path to the csv file holding the period start time.
+    :return:  The period start timestamp, the current time if it can not be read.
+    """
+    try:
+        with time_file.open('r', encoding='utf-8', newline='') as in_file:
+            month, day, hour = (int(value) for value in next(csv.reader(in_file))[:3])
+
+        curr_time = datetime.now()
+        start_time = datetime(curr_time.year, month, day, hour)
+        # If the period started in the previous year #
+        if start_time > curr_time:
+            start_time = start_time.replace(year=curr_time.year - 1)
+
+    # If the file is missing or malformed, count the requests as made now to stay within quota #
+    except (OSError, StopIteration, ValueError) as read_err:
+        logging.warning('Unable to read the period start of %s, counting its requests from now: '
+                        '%s', time_file, read_err)
+        return time.time()
+
+    return start_time.timestamp()
+
+
+def import_legacy_count(ledger: QuotaLedger, state_dir: Path):
+    """
+    Imports the daily request count stored by earlier versions into the ledger once, as requests \
+    made at the start of its 24 hour period, then renames the counter file so it is not imported \
+    again. Requests whose period already ended are not imported.
+
+    :param ledger:  The quota ledger of the key the earlier versions used.
+    :param state_dir:  The directory holding the counter and period start time files.
+    :return:  Nothing
+    """
+    counter_file = state_dir / LEGACY_COUNTER
+    # If there is no counter left to import #
+    if not counter_file.exists():
+        return
+
+    try:
+        with counter_file.open('rb') as in_file:
+            daily_count = int(pickle.load(in_file))
+
+        # Rename the counter first, so a crash while importing never imports it twice #
+        counter_file.rename(counter_file.with_name(f'{LEGACY_COUNTER}.imported'))
+
+    # If the counter can not be read, it is left in place for the next run #
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError) as read_err:
+        logging.warning('Unable to import the request count of %s: %s', counter_file, read_err)
+        return
+
+    start_time = get_legacy_start(state_dir / LEGACY_TIME)
+    # If the period of the counted requests already ended #
+    if start_time <= time.time() - ledger.retention:
+        return
+
+    # Record each counted request at the start of the period #
+    for _ in range(daily_count):
+        ledger.record(start_time)
+
+    logging.info('Imported %s requests from %s into %s', daily_count, counter_file,
+                 ledger.ledger_file)
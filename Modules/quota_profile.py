@@ -0,0 +1,114 @@
+"""
+Quota profiles of the Virus-Total API tiers, grouping the per minute and daily request limits with
+the hashes sent per request and the requests kept in flight, so premium keys are not held to the
+public API limits.
+
+Built-in modules
+"""
+import os
+# Custom modules #
+from Modules.quota_ledger import DAY_SECONDS, LEDGER_RETENTION, MINUTE_SECONDS
+from Modules.rate_limiter import DAILY_LIMIT, MINUTE_LIMIT
+from Modules.utils import BATCH_SIZE
+
+
+# Pseudo constants #
+QUOTA_PROFILE = os.environ.get('VTOTAL_QUOTA_PROFILE', 'public')
+QUOTA_SETTINGS = ('minute_limit', 'daily_limit', 'batch_size', 'concurrency')
+# Settings of each profile, in the order of QUOTA_SETTINGS #
+QUOTA_PROFILES = {
+    'public': (MINUTE_LIMIT[0], DAILY_LIMIT[0], BATCH_SIZE, 1),
+    'premium': (300, 100000, 25, 16)
+}
+# Settings overridden by VTOTAL_MINUTE_LIMIT, VTOTAL_DAILY_LIMIT, VTOTAL_BATCH_SIZE, and
+# VTOTAL_CONCURRENCY, applied over the selected profile #
+QUOTA_OVERRIDES = {setting: os.environ[f'VTOTAL_{setting.upper()}'] for setting in QUOTA_SETTINGS
+                   if os.environ.get(f'VTOTAL_{setting.upper()}')}
+
+
+class QuotaProfile:
+    """ Class to group the request limits and concurrency of an API tier. """
+    def __init__(self, name: str, minute_limit: int, daily_limit: int, batch_size: int,
+                 concurrency: int):
+        """
+        Initialize the profile settings, raising ValueError if any is not a positive integer.
+
+        :param name:  The name of the profile.
+        :param minute_limit:  The number of requests a key may make per minute.
+        :param daily_limit:  The number of requests a key may make per 24 hours.
+        :param batch_size:  The maximum number of hashes sent in one request.
+        :param concurrency:  The number of requests kept in flight, 1 to send them one at a time.
+        """
+        self.name = name
+
+        # Iterate through the settings, validating each #
+        for setting, value in zip(QUOTA_SETTINGS,
+                                  (minute_limit, daily_limit, batch_size, concurrency)):
+            try:
+                value = int(value)
+
+            # If the setting is not a number #
+            except ValueError as parse_err:
+                raise ValueError(f'Invalid quota setting {setting}={value}, expected a positive '
+                                 'integer') from parse_err
+
+            # If the setting is not positive #
+            if value < 1:
+                raise ValueError(f'Invalid quota setting {setting}={value}, expected a positive '
+                                 'integer')
+
+            setattr(self, setting, value)
+
+        # The (max requests, window seconds) pairs enforced per key #
+        self.limits = ((self.minute_limit, MINUTE_SECONDS), (self.daily_limit, DAY_SECONDS))
+
+
+def get_daily_quota(limits: tuple) -> tuple:
+    """
+    Gets the daily quota of the passed in limits, which is the limit with the longest window, \
+    raising ValueError if no limit is set or a limit is not usable.
+
+    :param limits:  Tuple of (max requests, window seconds) pairs enforced per key.
+    :return:  The (max requests, window seconds) pair of the longest window.
+    """
+    # If no limit is set #
+    if not limits:
+        raise ValueError('Invalid quota limits, expected at least one (max requests, window '
+                         'seconds) pair')
+
+    # Iterate through the limits, validating each #
+    for max_calls, period in limits:
+        # If the limit does not allow any request or has no window #
+        if max_calls < 1 or period <= 0:
+            raise ValueError(f'Invalid quota limit ({max_calls}, {period}), expected a positive '
+                             'number of requests and window seconds')
+
+        # If the ledger drops request times before the window ends #
+        if period > LEDGER_RETENTION:
+            raise ValueError(f'Invalid quota limit ({max_calls}, {period}), the window is longer '
+                             f'than the {LEDGER_RETENTION} seconds the quota ledger keeps')
+
+    return max(limits, key=lambda limit: limit[1])
+
+
+def get_quota_profile(name: str = QUOTA_PROFILE, overrides: dict = None) -> QuotaProfile:
+    """
+    Gets the named quota profile with the settings of the environment and passed in overrides \
+    applied over it, raising ValueError if the profile is unknown.
+
+    :param name:  The name of the profile, such as public or premium.
+    :param overrides:  Optional dictionary of settings replacing those of the profile and the
+                       environment, None values are ignored.
+    :return:  The quota profile.
+    """
+    # If the profile is not known #
+    if name not in QUOTA_PROFILES:
+        raise ValueError(f'Unknown quota profile {name}, expected one of '
+                         f'{", ".join(QUOTA_PROFILES)}')
+
+    settings = dict(zip(QUOTA_SETTINGS, QUOTA_PROFILES[name]))
+    settings.update(QUOTA_OVERRIDES)
+    settings.update({setting: value for setting, value in (overrides or {}).items()
+                     if value is not None})
+
+    return QuotaProfile(name, **settings)
@@ -0,0 +1,52 @@
+"""
+Sliding window rate limiter over the request times recorded in the quota ledger, so the next
+request only waits as long as the API limits require, even across program runs.
+
+Built-in modules
+"""
+import time
+# Custom modules #
+from Modules.quota_ledger import DAY_SECONDS, MINUTE_SECONDS, QuotaLedger
+
+
+# Pseudo constants #
+MINUTE_LIMIT = (4, MINUTE_SECONDS)
+DAILY_LIMIT = (500, DAY_SECONDS)
+
+
+class RateLimiter:
+    """ Class to enforce request limits over sliding time windows using recorded timestamps. """
+    def __init__(self, ledger: QuotaLedger, limits: tuple = (MINUTE_LIMIT,), margin: float = 1.0):
+        """
+        Initialize the limiter over the passed in request ledger.
+
+        :param ledger:  The quota ledger where request times are recorded.
+        :param limits:  Tuple of (max requests, window seconds) pairs to be enforced.
+        :param margin:  Extra seconds added to waits to absorb clock differences with the API.
+        """
+        self.ledger = ledger
+        self.limits = limits
+        self.margin = margin
+
+    def wait_time(self) -> float:
+        """
+        Calculates how long to wait before another request fits within every limit.
+
+        :return:  The number of seconds to wait, 0 if a request can be made now.
+        """
+        wait = 0.0
+
+        # Iterate through the configured limits #
+        for max_calls, period in self.limits:
+            window_count = self.ledger.count(period)
+
+            # If the window is full, wait until the request holding the slot expires #
+            if window_count >= max_calls:
+                oldest = self.ledger.stamp_within(period, window_count - max_calls)
+                # If the request expired between the count and the lookup #
+                if oldest is None:
+                    continue
+
+                wait = max(wait, oldest + period - time.time() + self.margin)
+
+        return wait
@@ -0,0 +1,219 @@
+"""
+Persistent local cache of Virus-Total file reports keyed by SHA256 digest, used to avoid spending
+the daily API quota on files that were already looked up recently.
+
+Built-in modules
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from threading import Lock
+# Custom modules #
+from Modules.utils import print_err
+
+
+# Pseudo constants #
+CACHE_TTL = int(os.environ.get('VTOTAL_CACHE_TTL', 3 * 86400))
+CACHE_MISS_TTL = int(os.environ.get('VTOTAL_CACHE_MISS_TTL', 4 * 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get('VTOTAL_CACHE_MAX_ENTRIES', 50000))
+# Number of cache hits whose access times are held before they are written #
+ACCESS_FLUSH_BATCH = 1000
+
+
+class ReportCache:
+    """ Class to store and retrieve Virus-Total reports in a local SQLite database. """
+    def __init__(self, db_path: Path, ttl: int = CACHE_TTL, miss_ttl: int = CACHE_MISS_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        """
+        Open the cache database and create the report table if it does not exist.
+
+        :param db_path:  Path to the SQLite cache database file.
+        :param ttl:  Number of seconds a report for a known file stays valid.
+        :param miss_ttl:  Number of seconds a "not found" report stays valid.
+        :param max_entries:  Maximum number of reports kept before the least recently used are
+                             evicted.
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_entries = max_entries
+        # Lock to serialize access when the connection is shared between threads #
+        self._lock = Lock()
+        # Access times of the cache hits not written yet, mapped by SHA256 digest #
+        self._accessed = {}
+
+        try:
+            # Open the cache database, allowing use outside the creating thread #
+            self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS reports ('
+                               'sha256 TEXT PRIMARY KEY, '
+                               'report TEXT NOT NULL, '
+                               'response_code INTEGER NOT NULL, '
+                               'fetched REAL NOT NULL, '
+                               'expires REAL NOT NULL, '
+                               'last_access REAL NOT NULL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS reports_access '
+                               'ON reports (last_access)')
+            # Index the expiry so evicting expired reports does not scan every stored report #
+            self._conn.execute('CREATE INDEX IF NOT EXISTS reports_expires ON reports (expires)')
+            self._conn.commit()
+
+        # If error occurs opening or creating the database #
+        except sqlite3.Error as db_err:
+            cache_err(db_path, db_err)
+
+    def _flush_access(self):
+        """
+        Writes the held access times of the cache hits without committing them. Called with the \
+        lock held, sqlite3.Error is raised to the caller.
+
+        :return:  Nothing
+        """
+        # If no hits are held #
+        if not self._accessed:
+            return
+
+        self._conn.executemany('UPDATE reports SET last_access = ? WHERE sha256 = ?',
+                               [(access_time, file_hash)
+                                for file_hash, access_time in self._accessed.items()])
+        self._accessed.clear()
+
+    def close(self):
+        """
+        Writes the held access times, then closes the connection to the cache database.
+
+        :return:  Nothing
+        """
+        with self._lock:
+            try:
+                self._flush_access()
+                self._conn.commit()
+
+            # If error occurs writing to the database #
+            except sqlite3.Error as db_err:
+                cache_err(self.db_path, db_err)
+
+            self._conn.close()
+
+    def get(self, file_hash: str) -> dict | None:
+        """
+        Retrieves the cached report for the passed in hash if it exists and has not expired. The \
+        access time of a hit is held and written with the next stored reports, a full batch of \
+        hits, or on close, rather than a write per hit.
+
+        :param file_hash:  The SHA256 digest of the file to look up.
+        :return:  The cached response dictionary if present and fresh, otherwise None.
+        """
+        curr_time = time.time()
+
+        with self._lock:
+            try:
+                row = self._conn.execute('SELECT report FROM reports WHERE sha256 = ? AND '
+                                         'expires > ?', (file_hash, curr_time)).fetchone()
+                # If a fresh report was found #
+                if row:
+                    # Hold the access time to keep recently used reports from eviction #
+                    self._accessed[file_hash] = curr_time
+
+                    # If a full batch of access times is held, write them #
+                    if len(self._accessed) >= ACCESS_FLUSH_BATCH:
+                        self._flush_access()
+                        self._conn.commit()
+
+            # If error occurs querying the database #
+            except sqlite3.Error as db_err:
+                cache_err(self.db_path, db_err)
+
+        # If there was no fresh report #
+        if not row:
+            return None
+
+        return json.loads(row[0])
+
+    def store(self, file_hash: str, response: dict):
+        """
+        Stores a successful API response in the cache, then evicts expired and excess reports.
+
+        :param file_hash:  The SHA256 digest of the file the response belongs to.
+        :param response:  The response dictionary returned from the API.
+        :return:  Nothing
+        """
+        self.store_many({file_hash: response})
+
+    def store_many(self, responses: dict[str, dict]):
+        """
+        Stores the successful API responses of a request in the cache in a single transaction \
+        with the held access times, then evicts expired and excess reports.
+
+        :param responses:  Dictionary mapping each SHA256 digest to its response dictionary.
+        :return:  Nothing
+        """
+        curr_time = time.time()
+        rows = []
+
+        # Iterate through the responses #
+        for file_hash, response in responses.items():
+            # Only successful responses are cached, errors have to be handled every time #
+            if response.get('response_code') != 200:
+                continue
+
+            # If Virus-Total has never seen the file, use the shorter TTL #
+            if is_not_found(response):
+                expires = curr_time + self.miss_ttl
+            # If the file has a report #
+            else:
+                expires = curr_time + self.ttl
+
+            rows.append((file_hash, json.dumps(response), response['response_code'], curr_time,
+                         expires, curr_time))
+
+        # If no response was successful #
+        if not rows:
+            return
+
+        with self._lock:
+            try:
+                self._conn.executemany('INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?)',
+                                       rows)
+                # Write the access times first, so recently used reports are not evicted #
+                self._flush_access()
+                # Delete expired reports #
+                self._conn.execute('DELETE FROM reports WHERE expires <= ?', (curr_time,))
+                # Delete the least recently used reports past the maximum #
+                self._conn.execute('DELETE FROM reports WHERE sha256 IN (SELECT sha256 FROM '
+                                   'reports ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                                   (self.max_entries,))
+                self._conn.commit()
+
+            # If error occurs writing to the database #
+            except sqlite3.Error as db_err:
+                cache_err(self.db_path, db_err)
+
+
+def cache_err(db_path: Path, err_obj: sqlite3.Error):
+    """
+    Displays and logs a report cache database error, then exits.
+
+    :param db_path:  Path to the cache database where the error occurred.
+    :param err_obj:  The SQLite error instance.
+    :return:  Nothing
+    """
+    print_err(f'Error occurred accessing report cache {db_path} - {err_obj}')
+    logging.exception('Error occurred accessing report cache %s: %s', db_path, err_obj)
+    sys.exit(12)
+
+
+def is_not_found(response: dict) -> bool:
+    """
+    Checks whether a successful response states the file is unknown to Virus-Total.
+
+    :param response:  The response dictionary returned from the API.
+    :return:  True if the report says the file was not found, otherwise False.
+    """
+    results = response.get('results')
+    # If the results are a report dict with a not found response code #
+    return isinstance(results, dict) and results.get('response_code') == 0
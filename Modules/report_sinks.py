@@ -0,0 +1,283 @@
+"""
+Output sinks the report writer thread passes each report to. The default sink appends every report
+of a run as one compressed JSON line to a single rotating file, the per-file text reports of
+earlier versions are kept as an optional sink.
+
+Built-in modules
+"""
+import gzip
+import io
+import json
+import logging
+import os
+import time
+from pathlib import Path
+# External modules #
+try:
+    import zstandard
+# If the optional zstd package is not installed #
+except ImportError:
+    zstandard = None
+# Custom modules #
+from Modules.archive_members import ArchiveMember
+
+
+# Pseudo constants #
+COMPRESSIONS = ('gzip', 'zstd', 'none')
+REPORT_COMPRESSION = os.environ.get('VTOTAL_REPORT_COMPRESSION', 'gzip')
+REPORT_FLUSH_BATCH = int(os.environ.get('VTOTAL_REPORT_FLUSH_BATCH', 64))
+REPORT_ROTATE_BYTES = int(os.environ.get('VTOTAL_REPORT_ROTATE_BYTES', 64 * 1024 * 1024))
+REPORT_SINKS = os.environ.get('VTOTAL_REPORT_SINKS', 'jsonl')
+SINK_NAMES = ('jsonl', 'text')
+SUFFIXES = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst', 'none': '.jsonl'}
+
+
+class JsonlReportSink:
+    """ Class to append the reports of a run as JSON lines to a compressed, rotating file. """
+    def __init__(self, report_dir: Path, time_obj: object, compression: str = REPORT_COMPRESSION,
+                 rotate_bytes: int = REPORT_ROTATE_BYTES, flush_batch: int = REPORT_FLUSH_BATCH):
+        """
+        Initialize the report buffer and select the first report file that is not full.
+
+        :param report_dir:  The directory where the report files are written.
+        :param time_obj:  The program execution time tracking instance.
+        :param compression:  The compression of the report files, one of the COMPRESSIONS names.
+        :param rotate_bytes:  The size in bytes a report file is rotated at.
+        :param flush_batch:  The number of reports buffered before they are written.
+        """
+        # If the compression is unknown #
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown report compression {compression}, expected one of '
+                             f'{COMPRESSIONS}')
+
+        # If zstd was selected without the optional package #
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError('zstd report compression requires the zstandard package')
+
+        self.report_dir = report_dir
+        self.compression = compression
+        self.rotate_bytes = rotate_bytes
+        self.flush_batch = flush_batch
+        self._prefix = f'VTotal_Reports_{time_obj.month}-{time_obj.day}-{time_obj.hour}'
+        self._part = 0
+        self._lines = []
+        self.path = self._part_path()
+
+        # Skip the parts of earlier runs in the same hour that are already full #
+        while self.path.exists() and self.path.stat().st_size >= rotate_bytes:
+            self._part += 1
+            self.path = self._part_path()
+
+    def _part_path(self) -> Path:
+        """
+        Formats the path of the current report file part.
+
+        :return:  The path to the report file part.
+        """
+        return self.report_dir / f'{self._prefix}_{self._part:03d}{SUFFIXES[self.compression]}'
+
+    def close(self):
+        """
+        Writes the buffered reports.
+
+        :return:  Nothing
+        """
+        self.flush()
+
+    def flush(self):
+        """
+        Compresses the buffered reports into one frame appended to the report file, then rotates \
+        the file if it reached the rotation size. OSError is raised to the caller.
+
+        :return:  Nothing
+        """
+        # If no reports are buffered #
+        if not self._lines:
+            return
+
+        data = ''.join(self._lines).encode('utf-8')
+        self._lines.clear()
+
+        # Compress the batch as a single member, concatenated members read back as one stream #
+        if self.compression == 'gzip':
+            data = gzip.compress(data)
+        elif self.compression == 'zstd':
+            data = zstandard.ZstdCompressor().compress(data)
+
+        # Append the batch with one sequential write #
+        with self.path.open('ab') as out_file:
+            out_file.write(data)
+            out_size = out_file.tell()
+
+        # If the report file reached the rotation size #
+        if out_size >= self.rotate_bytes:
+            self._part += 1
+            self.path = self._part_path()
+
+    def write(self, file: Path, digests: dict, response: dict):
+        """
+        Buffers the report of the passed in file as a JSON line, writing the buffer once it holds \
+        a full batch.
+
+        :param file:  The path to the scanned file the response belongs to.
+        :param digests:  Dictionary mapping each algorithm name to the file hex digest.
+        :param response:  The response dictionary returned from the API.
+        :return:  Nothing
+        """
+        record = {'file': file.name, 'path': str(file), **digests, 'time': time.time(),
+                  'response': response}
+        # If the file is a member of an archive, link the report back to the archive #
+        if isinstance(file, ArchiveMember):
+            record['archive'] = str(file.archive)
+
+        self._lines.append(json.dumps(record, separators=(',', ':')) + '\n')
+
+        # If a full batch is buffered #
+        if len(self._lines) >= self.flush_batch:
+            self.flush()
+
+
+class TextReportSink:
+    """ Class to write each report to an indented text file named after the scanned file. """
+    def __init__(self, report_dir: Path, time_obj: object):
+        """
+        Initialize the report directory and time used in the report file names.
+
+        :param report_dir:  The directory where the report files are written.
+        :param time_obj:  The program execution time tracking instance.
+        """
+        self.report_dir = report_dir
+        self.time_obj = time_obj
+        self.path = report_dir
+
+    def close(self):
+        """
+        Nothing is buffered, every report is written when received.
+
+        :return:  Nothing
+        """
+
+    def write(self, file: Path, digests: dict, response: dict):
+        """
+        Appends the report of the passed in file to its report file. OSError is raised to the \
+        caller.
+
+        :param file:  The path to the scanned file the response belongs to.
+        :param digests:  Dictionary mapping each algorithm name to the file hex digest.
+        :param response:  The response dictionary returned from the API.
+        :return:  Nothing
+        """
+        # Format output report path for current file #
+        self.path = self.report_dir / (f'{file.name}_{self.time_obj.month}-'
+                                       f'{self.time_obj.day}-{self.time_obj.hour}.txt')
+
+        # Open report file in append mode #
+        with self.path.open('a', encoding='utf-8') as out_file:
+            # Write the name of the current file to report file #
+            out_file.write(f'File - {file.name}:\n{(9 + len(file.name)) * "*"}\n')
+            # If the file is a member of an archive, write the archive it was read from #
+            if isinstance(file, ArchiveMember):
+                out_file.write(f'Archive - {file.archive}\n')
+            # Write the file digests for correlation with other tools #
+            out_file.write(''.join(f'{algorithm.upper()} - {digest}\n'
+                                   for algorithm, digest in digests.items()))
+            # Write json results to output report file #
+            json.dump(response, out_file, sort_keys=False, indent=4)
+            out_file.write('\n\n')
+
+
+def find_report(report_dir: Path, sha256: str) -> dict | None:
+    """
+    Finds the latest report of the passed in digest in the JSON lines report files, newest file \
+    first. Only used when a report is no longer in the report cache, as every file is read in \
+    full until a match is found. Report files that can not be read are logged and skipped.
+
+    :param report_dir:  The directory where the report files are written.
+    :param sha256:  The SHA256 digest of the file the report belongs to.
+    :return:  The response dictionary of the report, or None if no report file holds it.
+    """
+    try:
+        report_files = sorted(report_dir.glob('VTotal_Reports_*.jsonl*'),
+                              key=lambda report_file: report_file.stat().st_mtime, reverse=True)
+
+    # If a report file was removed while listing #
+    except OSError as file_err:
+        logging.warning('Unable to list the report files in %s: %s', report_dir, file_err)
+        return None
+
+    # Iterate through the report files, newest first #
+    for report_file in report_files:
+        response = None
+        try:
+            # Iterate through the records, the last match in a file is the latest #
+            for record in read_reports(report_file):
+                # If the record is a report of the digest #
+                if record.get('sha256') == sha256:
+                    response = record['response']
+
+        # If the file can not be read, was cut short, or needs the zstandard package #
+        except (OSError, EOFError, ValueError) as read_err:
+            logging.warning('Skipping report file %s: %s', report_file, read_err)
+
+        # If the file held a report of the digest #
+        if response is not None:
+            return response
+
+    return None
+
+
+def get_report_sinks(report_dir: Path, time_obj: object, sink_names: str = REPORT_SINKS) -> list:
+    """
+    Creates the report sinks named in the comma-separated VTOTAL_REPORT_SINKS setting.
+
+    :param report_dir:  The directory where the report files are written.
+    :param time_obj:  The program execution time tracking instance.
+    :param sink_names:  Comma-separated names of the sinks, from the SINK_NAMES names.
+    :return:  The list of report sink instances.
+    """
+    sinks = []
+
+    # Iterate through the configured sink names #
+    for sink_name in (name.strip() for name in sink_names.split(',') if name.strip()):
+        # If the sink is the compressed JSON lines file #
+        if sink_name == 'jsonl':
+            sinks.append(JsonlReportSink(report_dir, time_obj))
+        # If the sink is the per-file text reports #
+        elif sink_name == 'text':
+            sinks.append(TextReportSink(report_dir, time_obj))
+        # If the sink is unknown #
+        else:
+            raise ValueError(f'Unknown report sink {sink_name}, expected one of {SINK_NAMES}')
+
+    return sinks
+
+
+def read_reports(report_file: Path):
+    """
+    Reads the report records of a JSON lines report file in one sequential pass, decompressing \
+    it based on its suffix. OSError is raised to the caller if the file can not be read.
+
+    :param report_file:  The path to the report file.
+    :return:  Generator of report record dictionaries.
+    """
+    # If the report file is gzip compressed #
+    if report_file.suffix == '.gz':
+        in_file = gzip.open(report_file, 'rt', encoding='utf-8')
+    # If the report file is zstd compressed #
+    elif report_file.suffix == '.zst':
+        # If the optional zstd package is not installed #
+        if zstandard is None:
+            raise ValueError('Reading zstd reports requires the zstandard package')
+
+        # Read across the frames appended by each flushed batch #
+        reader = zstandard.ZstdDecompressor().stream_reader(report_file.open('rb'),
+                                                            read_across_frames=True)
+        in_file = io.TextIOWrapper(reader, encoding='utf-8')
+    # If the report file is not compressed #
+    else:
+        in_file = report_file.open('r', encoding='utf-8')
+
+    with in_file:
+        # Iterate through the report lines #
+        for line in in_file:
+            yield json.loads(line)
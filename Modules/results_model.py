@@ -0,0 +1,266 @@
+# pylint: disable=E0611,I1101
+"""
+Table model of scan results for the GUI, holding one small row per file and loading the full
+reports only when a row is opened, so tens of thousands of results stay cheap to display.
+
+Built-in modules
+"""
+import json
+import sqlite3
+import time
+from pathlib import Path
+# External modules #
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+# Custom modules #
+from Modules.report_cache import is_not_found
+from Modules.report_sinks import find_report
+from Modules.scan_engine import ScanResult
+
+
+# Pseudo constants #
+COLUMNS = ('File', 'SHA256', 'Detections', 'Status')
+FETCH_BATCH = 1000
+
+
+class ResultsModel(QAbstractTableModel):
+    """ Class to present scan results to a Qt view, newest first, with reports loaded on demand. """
+    def __init__(self, report_loader, report_dir: Path = None, parent=None):
+        """
+        Initialize the visible rows and the rows waiting to be fetched by the view.
+
+        :param report_loader:  Callable passed a SHA256 digest, returning its report dictionary or
+                               None if it is no longer available.
+        :param report_dir:  Optional directory of the JSON lines report files, searched for the
+                            reports the report loader no longer has.
+        :param parent:  The optional parent Qt object.
+        """
+        super().__init__(parent)
+        self.report_loader = report_loader
+        self.report_dir = report_dir
+        # Rows of the results of this session as (file name, sha256, detections, status) tuples,
+        # appended as they arrive and shown newest first above the history #
+        self._live = []
+        # History rows handed to the view, newest first #
+        self._history = []
+        # Loaded history rows the view has not scrolled to yet #
+        self._pending = []
+
+    def _row(self, row: int) -> tuple:
+        """
+        Gets the row shown at the passed in position of the view.
+
+        :param row:  The row number in the table.
+        :return:  The (file name, sha256, detections, status) row.
+        """
+        # If the row is a result of this session, the newest is at the top #
+        if row < len(self._live):
+            return self._live[-1 - row]
+
+        return self._history[row - len(self._live)]
+
+    def add_history(self, rows: list[tuple]):
+        """
+        Queues historical result rows, which are handed to the view in batches as it scrolls.
+
+        :param rows:  The result rows to be added after the current rows.
+        :return:  Nothing
+        """
+        self._pending.extend(rows)
+
+        # If the view has no rows yet, give it the first batch #
+        if not self.rowCount():
+            self.fetchMore(QModelIndex())
+
+    def add_result(self, result: ScanResult):
+        """
+        Inserts the result of a scanned file at the top of the table, above the earlier results \
+        of the session and the history.
+
+        :param result:  The result of the scanned file.
+        :return:  Nothing
+        """
+        results = result.response.get('results')
+        # If the results are not a report dict #
+        if not isinstance(results, dict):
+            results = {}
+
+        # If the file could not be scanned #
+        if result.error:
+            row = (result.file.name, result.digests.get('sha256', '-'), '-', 'Failed')
+        else:
+            row = make_row(result.file.name, result.digests['sha256'], results.get('positives'),
+                           results.get('total'), is_not_found(result.response), result.cached)
+
+        # The row is appended, it is shown at the top as the live rows are shown in reverse #
+        self.beginInsertRows(QModelIndex(), 0, 0)
+        self._live.append(row)
+        self.endInsertRows()
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        """
+        Reports to the view whether history rows are waiting to be fetched.
+
+        :param parent:  The parent index, always invalid for a table.
+        :return:  True if rows are waiting, otherwise False.
+        """
+        return not parent.isValid() and bool(self._pending)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        """
+        Gets the number of columns in the table.
+
+        :param parent:  The parent index, always invalid for a table.
+        :return:  The number of columns.
+        """
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        """
+        Gets the data of a cell for the passed in role.
+
+        :param index:  The index of the cell.
+        :param role:  The Qt item data role requested by the view.
+        :return:  The cell data, or None if the role is not handled.
+        """
+        # If the index is outside the table #
+        if not index.isValid():
+            return None
+
+        # If the cell text is requested #
+        if role == Qt.DisplayRole:
+            return self._row(index.row())[index.column()]
+
+        # If the detection ratio alignment is requested #
+        if role == Qt.TextAlignmentRole and index.column() == COLUMNS.index('Detections'):
+            return Qt.AlignCenter
+
+        return None
+
+    def fetchMore(self, parent: QModelIndex):
+        """
+        Moves the next batch of waiting history rows into the view.
+
+        :param parent:  The parent index, always invalid for a table.
+        :return:  Nothing
+        """
+        # If no rows are waiting #
+        if parent.isValid() or not self._pending:
+            return
+
+        batch = self._pending[:FETCH_BATCH]
+        del self._pending[:FETCH_BATCH]
+
+        row_count = self.rowCount()
+        self.beginInsertRows(QModelIndex(), row_count, row_count + len(batch) - 1)
+        self._history.extend(batch)
+        self.endInsertRows()
+
+    def headerData(self, section: int, orientation: int, role: int = Qt.DisplayRole):
+        """
+        Gets the column titles of the table.
+
+        :param section:  The column or row number.
+        :param orientation:  Whether the horizontal or vertical header is requested.
+        :param role:  The Qt item data role requested by the view.
+        :return:  The column title, or None if the role is not handled.
+        """
+        # If a column title is requested #
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+
+        return None
+
+    def report(self, row: int) -> str:
+        """
+        Loads the full report of the passed in row, only when it is opened. A report that is no \
+        longer in the report loader, such as one that expired from the report cache, is searched \
+        for in the report files.
+
+        :param row:  The row number in the table.
+        :return:  The report formatted as indented JSON, or a message if it is unavailable.
+        """
+        _, sha256, _, status = self._row(row)
+        # If the file could not be scanned, it has no report #
+        if status == 'Failed':
+            return 'File could not be scanned, check the log for the error and scan it again'
+
+        response = self.report_loader(sha256)
+        # If the report is no longer loaded, fall back to the report files #
+        if response is None and self.report_dir is not None:
+            response = find_report(self.report_dir, sha256)
+
+        # If the report is no longer available #
+        if response is None:
+            return 'Report is no longer in the local cache or report files, scan the file again ' \
+                   'to refresh it'
+
+        return json.dumps(response, indent=4)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        """
+        Gets the number of rows handed to the view.
+
+        :param parent:  The parent index, always invalid for a table.
+        :return:  The number of rows.
+        """
+        return 0 if parent.isValid() else len(self._live) + len(self._history)
+
+
+def load_history(path: Path) -> list[tuple]:
+    """
+    Loads the results of previously scanned files by joining the hash manifest with the cached \
+    reports. Only the detection counts are read from the reports, the full reports are loaded \
+    when opened. sqlite3.Error is raised to the caller if the databases can not be read.
+
+    :param path:  The directory containing the hash manifest and report cache databases.
+    :return:  The result rows, most recently seen files first.
+    """
+    manifest_db, cache_db = path / 'hash_manifest.db', path / 'report_cache.db'
+    # If no scan has been run yet #
+    if not manifest_db.exists() or not cache_db.exists():
+        return []
+
+    # Open the databases read only, they are written by the scan #
+    conn = sqlite3.connect(f'{manifest_db.as_uri()}?mode=ro', uri=True)
+    try:
+        conn.execute('ATTACH DATABASE ? AS cache', (f'{cache_db.as_uri()}?mode=ro',))
+        cursor = conn.execute("SELECT d.path, d.sha256, "
+                              "json_extract(r.report, '$.results.positives'), "
+                              "json_extract(r.report, '$.results.total'), "
+                              "json_extract(r.report, '$.results.response_code') "
+                              "FROM digests d JOIN cache.reports r ON r.sha256 = d.sha256 "
+                              "WHERE r.expires > ? ORDER BY d.last_seen DESC", (time.time(),))
+
+        return [make_row(Path(file_path).name, sha256, positives, total, results_code == 0, True)
+                for file_path, sha256, positives, total, results_code in cursor]
+    finally:
+        conn.close()
+
+
+def make_row(file_name: str, sha256: str, positives: int | None, total: int | None,
+             not_found: bool, cached: bool) -> tuple:
+    """
+    Formats the values of a result into a table row.
+
+    :param file_name:  The name of the scanned file.
+    :param sha256:  The SHA256 digest of the file.
+    :param positives:  The number of engines that detected the file.
+    :param total:  The number of engines that scanned the file.
+    :param not_found:  Whether the file is unknown to Virus-Total.
+    :param cached:  Whether the result was retrieved from the report cache.
+    :return:  The (file name, sha256, detections, status) row.
+    """
+    # If Virus-Total has never seen the file #
+    if not_found:
+        detections, status = '-', 'Not found'
+    # If the file has a report #
+    else:
+        # If the report has no engine counts #
+        detections = '-' if total is None else f'{positives}/{total}'
+        status = 'Detected' if positives else 'Clean'
+
+    # If the result did not spend an API query #
+    if cached:
+        status += ' (cached)'
+
+    return file_name, sha256, detections, status
@@ -0,0 +1,119 @@
+"""
+Retry scheduling for batches that were throttled or hit a transient error, so a failed request
+delays only the affected files instead of stopping the scan.
+
+Built-in modules
+"""
+import heapq
+import itertools
+import os
+import random
+import time
+
+
+# Pseudo constants #
+RETRY_LIMIT = int(os.environ.get('VTOTAL_RETRY_LIMIT', 5))
+RETRY_BASE = float(os.environ.get('VTOTAL_RETRY_BASE', 2.0))
+RETRY_CAP = float(os.environ.get('VTOTAL_RETRY_CAP', 300.0))
+# Response outcomes #
+OK, THROTTLED, REJECTED, INVALID, TRANSIENT = 'ok', 'throttled', 'rejected', 'invalid', 'transient'
+
+
+class RetryQueue:
+    """ Class to hold batches waiting to be resent, ordered by the time each becomes ready. """
+    def __init__(self, limit: int = RETRY_LIMIT, base: float = RETRY_BASE, cap: float = RETRY_CAP):
+        """
+        Initialize the empty retry heap and backoff settings.
+
+        :param limit:  The number of times a batch is retried after transient errors.
+        :param base:  The seconds of the first backoff, doubled on each retry.
+        :param cap:  The maximum seconds of a backoff.
+        """
+        self.limit = limit
+        self.base = base
+        self.cap = cap
+        # Heap of (ready time, insertion order, batch, attempt) tuples #
+        self._heap = []
+        self._order = itertools.count()
+
+    def __len__(self) -> int:
+        """
+        Gets the number of batches waiting to be resent.
+
+        :return:  The number of waiting batches.
+        """
+        return len(self._heap)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Calculates the exponential backoff with full jitter for the passed in retry, so batches \
+        failed by the same outage do not all retry at once.
+
+        :param attempt:  The number of times the batch has been retried.
+        :return:  The number of seconds to wait before the retry.
+        """
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def pop_ready(self, lead: float = 0.0) -> tuple:
+        """
+        Removes the batch that has waited out its delay the longest.
+
+        :param lead:  The seconds before its ready time a batch may be taken early.
+        :return:  Tuple of the batch and its attempt number, or (None, 0) if none are ready.
+        """
+        # If no batch is ready yet #
+        if not self._heap or self._heap[0][0] > time.time() + lead:
+            return None, 0
+
+        _, _, batch, attempt = heapq.heappop(self._heap)
+        return batch, attempt
+
+    def push(self, batch: list, attempt: int, delay: float = 0.0):
+        """
+        Queues a batch to be resent once the passed in delay has passed.
+
+        :param batch:  List of (file digests, list of file paths) tuples to be resent.
+        :param attempt:  The number of times the batch has been retried.
+        :param delay:  The number of seconds before the batch is ready.
+        :return:  Nothing
+        """
+        heapq.heappush(self._heap, (time.time() + delay, next(self._order), batch, attempt))
+
+    def wait_time(self) -> float:
+        """
+        Calculates how long until the next batch is ready.
+
+        :return:  The number of seconds to wait, 0 if a batch is ready or none are waiting.
+        """
+        # If no batches are waiting #
+        if not self._heap:
+            return 0.0
+
+        return max(0.0, self._heap[0][0] - time.time())
+
+
+def classify_response(response: dict) -> str:
+    """
+    Classifies an API response by how the scan should handle it.
+
+    :param response:  The response dictionary returned from the API.
+    :return:  OK for a report, THROTTLED for 204, REJECTED for 403, INVALID for 400, or \
+              TRANSIENT for network errors and unexpected codes.
+    """
+    response_code = response.get('response_code')
+
+    # If the report was returned #
+    if response_code == 200:
+        return OK
+    # If the per minute limit was hit #
+    if response_code == 204:
+        return THROTTLED
+    # If the key was rejected #
+    if response_code == 403:
+        return REJECTED
+    # If the request was malformed #
+    if response_code == 400:
+        return INVALID
+
+    # A missing code is a network error, server errors and unknown codes may pass #
+    return TRANSIENT
@@ -0,0 +1,998 @@
+"""
+Headless scan engine shared by the CLI and GUI. Scanning yields a result per file and reports
+batches, waits, and quota usage through optional callbacks, with no terminal or Qt dependencies,
+so it can also be embedded in batch jobs. Requests are sent one at a time, or kept in flight on an
+asyncio event loop when the quota profile allows concurrent requests. In submit mode, unknown files
+are uploaded and their analyses polled between the other requests. In carry over mode, the backlog
+left when the daily quota runs out waits for the quota to free up instead of stopping the scan.
+In archive mode, the members of archives are hashed and looked up along with the archives.
+
+Built-in modules
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from threading import Event
+# Custom modules #
+from Modules.archive_members import ARCHIVE_SCAN, ArchiveLimits, expand_archive, \
+    get_archive_limits, is_archive
+from Modules.hash_manifest import HashManifest
+from Modules.key_pool import KeyEntry, KeyPool
+from Modules.quota_profile import get_quota_profile, QuotaProfile
+from Modules.report_cache import ReportCache
+from Modules.report_sinks import get_report_sinks
+from Modules.retry_queue import classify_response, INVALID, OK, REJECTED, RetryQueue, \
+                                THROTTLED, TRANSIENT
+from Modules.scan_journal import JOURNAL_NAME, ScanJournal
+from Modules.scan_metrics import METRICS_DIR, ScanMetrics
+from Modules.scan_pipeline import get_uncached_batches, hash_files, ReportWriter
+from Modules.scan_priority import order_by_priority, PRIORITY_WINDOW, PriorityRules
+from Modules.submit_queue import is_upload_queued, SUBMIT_UNKNOWN, SubmitQueue, TOO_LARGE
+from Modules.utils import batch_query
+from Modules.vt_client import HTTP_POOL_SIZE
+
+
+# Pseudo constants #
+CARRY_OVER = os.environ.get('VTOTAL_CARRY_OVER', '').lower() in ('1', 'true', 'yes')
+RESPONSE_ERRORS = {
+    204: ('Max API Error: API calls per minute maxed out, wait for the limit to reset and try '
+          'again', 8),
+    400: ('Request Error: Invalid API request detected, check request formatting', 9),
+    403: ('Forbidden Error: Unable to access API, confirm key exists and is valid', 10)
+}
+UNKNOWN_RESPONSE = ('Unknown response code occurred', 11)
+UNREADABLE_FILE = 'Unable to read the file, check the log for the error'
+NO_API_KEY = ('No API key set, set VTOTAL_API_KEY or VTOTAL_API_KEYS before running', 14)
+# Seconds between checks for a cancel from another thread during asyncio waits #
+CANCEL_POLL = 0.25
+# Rate limit waits shorter than this are not reported in asyncio mode, where they are frequent #
+WAIT_NOTICE = 1.0
+# Quota waits shorter than this are reported as rate limit waits, such as while the quota of the
+# previous day frees up one request at a time #
+CARRY_NOTICE = 60.0
+
+
+class ScanError(Exception):
+    """ Class for errors that stop a scan, carrying the matching program exit code. """
+    def __init__(self, message: str, exit_code: int):
+        """
+        Initialize the error message and exit code.
+
+        :param message:  The error message to be displayed.
+        :param exit_code:  The program exit code of the error.
+        """
+        super().__init__(message)
+        self.exit_code = exit_code
+
+
+class ScanResult:
+    """ Class to group the outcome of a scanned file. """
+    def __init__(self, file: Path, digests: dict, response: dict, cached: bool,
+                 error: str = None):
+        """
+        Initialize the scanned file, its digests, and its response.
+
+        :param file:  The path to the scanned file.
+        :param digests:  Dictionary mapping each algorithm name to the file hex digest.
+        :param response:  The response dictionary of the file.
+        :param cached:  Whether the response was retrieved from the report cache.
+        :param error:  The error message if the file could not be scanned, otherwise None.
+        """
+        self.file = file
+        self.digests = digests
+        self.response = response
+        self.cached = cached
+        self.error = error
+
+
+class ScanEngine:
+    """ Class to scan files with the Virus Total API, yielding a result per file. """
+    def __init__(self, api_keys: list[str], state_dir: Path, time_obj: object,
+                 on_batch=None, on_daily_count=None, on_quota_exhausted=None, on_wait=None,
+                 on_retry=None, pool_options: dict = None, retry_options: dict = None,
+                 priority_rules: PriorityRules = None, resume: bool = False,
+                 quota_profile: QuotaProfile = None, submit: bool = SUBMIT_UNKNOWN,
+                 submit_options: dict = None, on_submit=None, carry_over: bool = CARRY_OVER,
+                 on_carry_over=None, metrics_dir: Path = None, archives: bool = ARCHIVE_SCAN,
+                 archive_limits: ArchiveLimits = None):
+        """
+        Initialize the scan settings, event callbacks, and cancel event.
+
+        :param api_keys:  The Virus Total API keys requests are spread across.
+        :param state_dir:  The directory holding the quota ledgers, databases, and reports.
+        :param time_obj:  The program execution time tracking instance.
+        :param on_batch:  Optional callable passed the files of each batch before it is sent.
+        :param on_daily_count:  Optional callable passed the number of API calls made within the
+                                last 24 hours after each request.
+        :param on_quota_exhausted:  Optional callable called when every key has used its daily
+                                    quota, before the scan stops if not carrying over.
+        :param on_wait:  Optional callable passed the number of seconds before each rate limit
+                         wait.
+        :param on_retry:  Optional callable passed the files of a batch, the seconds before it is
+                          resent, and the reason when it is requeued.
+        :param pool_options:  Optional keyword arguments for the key pool, such as the scaled
+                              limits and cooldowns used by the benchmarks.
+        :param retry_options:  Optional keyword arguments for the retry queue, such as the scaled
+                               backoff used by the benchmarks.
+        :param priority_rules:  Optional rules each window of files is ordered by, the rules
+                                configured by the VTOTAL_PRIORITY_* settings if not set.
+        :param resume:  Whether to continue the previous run from its journal if it stopped
+                        before every file was scanned.
+        :param quota_profile:  Optional request limits and concurrency of the API tier, the profile
+                               configured by the VTOTAL_QUOTA_PROFILE setting if not set.
+        :param submit:  Whether to upload the files unknown to Virus-Total and poll for their
+                        analysis, the VTOTAL_SUBMIT setting if not set.
+        :param submit_options:  Optional keyword arguments for the submit queue, such as the scaled
+                                poll backoff used by the benchmarks.
+        :param on_submit:  Optional callable passed the files of each upload before it is sent.
+        :param carry_over:  Whether to wait for the daily quota to free up when every key has used
+                            it, scanning the backlog unattended, the VTOTAL_CARRY_OVER setting if
+                            not set.
+        :param on_carry_over:  Optional callable passed the seconds until the quota frees up, the
+                               estimated seconds until the backlog is scanned, and the number of
+                               files left when the backlog is carried over.
+        :param metrics_dir:  Optional directory the metrics of each run are exported to, the
+                             VTOTAL_METRICS_DIR setting or the state directory if not set.
+        :param archives:  Whether to hash and look up the members of archives along with the
+                          archives, the VTOTAL_ARCHIVES setting if not set.
+        :param archive_limits:  Optional zip bomb guards of each archive expanded, the limits
+                                configured by the VTOTAL_ARCHIVE_* settings if not set.
+        """
+        self.api_keys = api_keys
+        self.state_dir = state_dir
+        self.time_obj = time_obj
+        self.on_batch = on_batch
+        self.on_daily_count = on_daily_count
+        self.on_quota_exhausted = on_quota_exhausted
+        self.on_wait = on_wait
+        self.on_retry = on_retry
+        self.pool_options = pool_options or {}
+        self.retry_options = retry_options or {}
+        self.priority_rules = priority_rules
+        self.resume = resume
+        self.quota_profile = quota_profile or get_quota_profile()
+        self.submit = submit
+        self.submit_options = submit_options or {}
+        self.on_submit = on_submit
+        self.carry_over = carry_over
+        self.on_carry_over = on_carry_over
+        self.metrics_dir = metrics_dir or (Path(METRICS_DIR) if METRICS_DIR else state_dir)
+        self.archives = archives
+        self.archive_limits = archive_limits or get_archive_limits()
+        # Metrics of the current or last run #
+        self.metrics = ScanMetrics()
+        self.cancel_event = Event()
+
+    async def _acquire_async(self, key_pool: KeyPool, pending: set) -> KeyEntry | None:
+        """
+        Reserves a request on the key with the most available capacity, waiting without blocking \
+        the requests in flight until one has capacity. The wait ends early if the scan is \
+        cancelled from another thread or a request in flight raised an error that stops it.
+
+        :param key_pool:  The API key pool.
+        :param pending:  The set of request tasks in flight.
+        :return:  The key entry the request is to be sent with, or None if the wait ended early.
+        """
+        wait_start = time.perf_counter()
+        while True:
+            entry, wait = key_pool.reserve()
+            # If a key was reserved #
+            if entry:
+                # If the request waited for a key #
+                if time.perf_counter() - wait_start > 0.001:
+                    self.metrics.observe('rate_limit_wait_seconds',
+                                         time.perf_counter() - wait_start)
+                return entry
+
+            # If the wait is long enough to be worth reporting #
+            if wait >= WAIT_NOTICE:
+                notify(self.on_wait, wait)
+
+            wake_time = time.monotonic() + wait
+            # While the wait is not over #
+            while (remaining := wake_time - time.monotonic()) > 0:
+                # If the scan was cancelled or a request raised an error that stops it #
+                if self.cancel_event.is_set() or \
+                        any(task.done() and task.exception() for task in pending):
+                    return None
+
+                running = {task for task in pending if not task.done()}
+                # Wake when a request finishes, or after a short slice to check for a cancel #
+                if running:
+                    await asyncio.wait(running, timeout=min(remaining, CANCEL_POLL),
+                                       return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(min(remaining, CANCEL_POLL))
+
+    def _carry_over(self, key_pool: KeyPool, journal: ScanJournal,
+                    submit_queue: SubmitQueue | None) -> float:
+        """
+        Finds when a key has daily quota again from the recorded request times and estimates \
+        when the backlog is scanned, assuming each file queued so far spends a share of a batch \
+        request and each waiting upload a request of its own. Short waits are reported as rate \
+        limit waits, since the quota used at the full rate frees up one request at a time.
+
+        :param key_pool:  The API key pool.
+        :param journal:  The checkpoint journal of the scan, holding the backlog.
+        :param submit_queue:  The queue of uploads and analysis polls, or None if not submitting.
+        :return:  The timestamp the deferred requests are resent at.
+        """
+        wait = key_pool.drain_time(1)
+        # If the quota frees up soon #
+        if wait < CARRY_NOTICE:
+            notify(self.on_wait, wait)
+            return time.time() + wait
+
+        files_left = len(journal.pending)
+        requests = math.ceil(files_left / self.quota_profile.batch_size) + \
+            (len(submit_queue.uploads) if submit_queue is not None else 0)
+        eta = key_pool.drain_time(requests)
+
+        logging.warning('Daily quota of every key is used, carrying %s file(s) over for %.0f '
+                        'seconds, backlog estimated to be scanned in %.0f seconds', files_left,
+                        wait, eta)
+        notify(self.on_carry_over, wait, eta, files_left)
+        return time.time() + wait
+
+    async def _dispatch_async(self, key_pool: KeyPool, report_cache: object,
+                              report_writer: ReportWriter, journal: ScanJournal, batches,
+                              retry_queue: RetryQueue, submit_queue: SubmitQueue | None,
+                              executor: ThreadPoolExecutor, results: asyncio.Queue) -> bool:
+        """
+        Sends the uncached batches, ready retries, uploads, and analysis polls as request tasks, \
+        keeping up to the profile concurrency in flight under the rate limits, and queues every \
+        result. None is queued when the dispatch stops, before any error that stopped it is raised.
+
+        :param key_pool:  The API key pool.
+        :param report_cache:  The local report cache instance.
+        :param report_writer:  The background report writer instance.
+        :param journal:  The checkpoint journal of the scan.
+        :param batches:  Generator of (batch, cached report) tuples from get_uncached_batches.
+        :param retry_queue:  The queue of batches waiting to be resent.
+        :param submit_queue:  The queue of uploads and analysis polls, or None if not submitting.
+        :param executor:  The thread pool running the blocking requests, hashing, and syncs.
+        :param results:  The queue the ScanResult instances are put on.
+        :return:  True if every file was scanned without failures, otherwise False.
+        """
+        loop = asyncio.get_running_loop()
+        # The request tasks in flight #
+        pending = set()
+        failed, complete, batches_done = 0, False, False
+        # Time the deferred requests are resent at while carrying the backlog over #
+        resume_time = None
+        try:
+            # While the scan was not cancelled #
+            while not self.cancel_event.is_set():
+                failed += collect_finished(pending)
+                # Resend a waiting batch first once its delay has passed #
+                batch, attempt = retry_queue.pop_ready()
+                upload = False
+                # If no retry is ready, take a ready analysis poll or upload of an unknown file #
+                if batch is None and submit_queue is not None:
+                    batch, attempt, upload = submit_queue.pop_ready()
+
+                # If nothing is ready to be resent, take the next cached report or uncached batch #
+                if batch is None:
+                    next_item = None
+                    # If files are left, hash and batch them in the executor so the requests in
+                    # flight keep running #
+                    if not batches_done:
+                        next_item = await loop.run_in_executor(executor, next, batches, None)
+                        batches_done = next_item is None
+
+                    # If every file was hashed and batched #
+                    if next_item is None:
+                        # If no requests are in flight or waiting to be sent, the scan is done #
+                        if not pending and not retry_queue and not submit_queue:
+                            complete = not failed
+                            break
+
+                        # Wait for a request to finish or a retry, upload, or poll to be ready #
+                        wait = min([CANCEL_POLL] + [queue.wait_time() for queue in
+                                                    (retry_queue, submit_queue) if queue])
+                        if pending:
+                            await asyncio.wait(pending, timeout=wait,
+                                               return_when=asyncio.FIRST_COMPLETED)
+                        else:
+                            await asyncio.sleep(wait)
+                        continue
+
+                    batch, cached_report = next_item
+                    # If the file could not be read, it fails alone and is left for a resumed run #
+                    if cached_report and cached_report[1] is None:
+                        results.put_nowait(ScanResult(cached_report[0], {}, {}, False,
+                                                      UNREADABLE_FILE))
+                        failed += 1
+                        continue
+
+                    # If the report was cached, no API query is needed #
+                    if cached_report:
+                        result = handle_response(*cached_report, report_writer, cached=True)
+                        journal.record(result.file, result.digests, result.response, False)
+                        results.put_nowait(result)
+                        continue
+
+                # If every key has used its maximum API calls in the last 24 hours #
+                if not key_pool.daily_remaining():
+                    # If the backlog is not carried over, the scan stops #
+                    if not self.carry_over:
+                        notify(self.on_quota_exhausted)
+                        break
+
+                    # If the quota just ran out, find when it frees up #
+                    if resume_time is None:
+                        resume_time = self._carry_over(key_pool, journal, submit_queue)
+
+                    # Defer the request until a key has daily quota again #
+                    (submit_queue.uploads if upload else retry_queue).push(
+                        batch, attempt, max(0.0, resume_time - time.time()))
+                    continue
+
+                resume_time = None
+
+                # If the maximum requests are in flight, wait for one to finish #
+                if len(pending) >= self.quota_profile.concurrency:
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    failed += collect_finished(pending)
+
+                # Reserve a request on the key with the most capacity, waiting if all keys are at
+                # their per minute limit #
+                entry = await self._acquire_async(key_pool, pending)
+                # If the wait was cancelled or a request raised an error #
+                if entry is None:
+                    break
+
+                notify(self.on_submit if upload else self.on_batch, batch_files(batch))
+                pending.add(loop.create_task(
+                    self._request_async(batch, attempt, upload, entry, key_pool, report_cache,
+                                        report_writer, journal, retry_queue, submit_queue,
+                                        executor, results)))
+
+            # Let the requests in flight finish, so the quota they spent is not wasted #
+            if pending:
+                await asyncio.wait(pending)
+                failed += collect_finished(pending)
+                complete = complete and not failed
+
+            return complete
+        finally:
+            # Signal the consumer that no more results follow #
+            results.put_nowait(None)
+
+    def _handle_batch(self, batch: list, attempt: int, responses: dict, report_cache: object,
+                      report_writer: ReportWriter, retry_queue: RetryQueue,
+                      submit_queue: SubmitQueue | None):
+        """
+        Handles the responses of a sent batch. Reports are cached and yielded, throttled batches \
+        are requeued to wait for a key, transient errors are retried with backoff, and a rejected \
+        batch is resent one hash at a time, so only the affected files fail. ScanError is raised \
+        if every key was rejected. When submitting, unknown files and running analyses are \
+        deferred to the submit queue instead of being reported.
+
+        :param batch:  List of (file digests, list of file paths) tuples that was sent.
+        :param attempt:  The number of times the batch has been retried.
+        :param responses:  Dictionary mapping each hash in the batch to its response dictionary.
+        :param report_cache:  The local report cache instance.
+        :param report_writer:  The background report writer instance.
+        :param retry_queue:  The queue of batches waiting to be resent.
+        :param submit_queue:  The queue of uploads and analysis polls, or None if not submitting.
+        :return:  Generator of ScanResult instances.
+        """
+        # Error responses are shared by every hash in the batch #
+        response = responses[batch[0][0]['sha256']]
+        outcome = classify_response(response)
+
+        # If the reports were returned #
+        if outcome == OK:
+            reported = []
+            # Iterate through the unique digests in the batch #
+            for digests, dup_files in batch:
+                file_response = responses[digests['sha256']]
+                # If submitting, upload unknown files and poll running analyses again later #
+                if submit_queue is not None:
+                    file_response = submit_queue.check(digests, dup_files, file_response)
+                    # If the files were deferred #
+                    if file_response is None:
+                        continue
+
+                reported.append((digests, dup_files, file_response))
+
+            # Save the reported responses in the cache for later runs, in one transaction #
+            report_cache.store_many({digests['sha256']: file_response
+                                     for digests, _, file_response in reported})
+
+            # Iterate through the reported digests #
+            for digests, dup_files, file_response in reported:
+                # Iterate through the files sharing the digest, reusing the single response #
+                for file in dup_files:
+                    yield handle_response(file, digests, file_response, report_writer)
+            return
+
+        # If every key was rejected, no request can succeed #
+        if outcome == REJECTED:
+            raise ScanError(*RESPONSE_ERRORS[403])
+
+        # If every key was throttled, requeue the batch to wait for a key to cool down #
+        if outcome == THROTTLED:
+            retry_queue.push(batch, attempt)
+            notify(self.on_retry, batch_files(batch), 0.0, outcome)
+            return
+
+        # If a batch was invalid, resend each hash alone to find the files causing it #
+        if outcome == INVALID and len(batch) > 1:
+            # Iterate through the unique digests in the batch #
+            for item in batch:
+                retry_queue.push([item], attempt)
+
+            notify(self.on_retry, batch_files(batch), 0.0, outcome)
+            return
+
+        # If a transient error can still be retried #
+        if outcome == TRANSIENT and attempt < retry_queue.limit:
+            delay = retry_queue.backoff(attempt)
+            retry_queue.push(batch, attempt + 1, delay)
+            notify(self.on_retry, batch_files(batch), delay, outcome)
+            return
+
+        # Otherwise fail only the files of the batch #
+        message = RESPONSE_ERRORS.get(response.get('response_code'), UNKNOWN_RESPONSE)[0]
+        # If the request did not get a response, show the network error #
+        if 'response_code' not in response:
+            message = f'Request failed after {attempt + 1} attempts: {response.get("error")}'
+
+        # Iterate through the unique digests in the batch #
+        for digests, dup_files in batch:
+            # Iterate through the files sharing the digest #
+            for file in dup_files:
+                logging.error('Scan of %s failed: %s', file, message)
+                yield ScanResult(file, digests, response, False, message)
+
+    def _handle_upload(self, batch: list, attempt: int, response: dict, report_cache: object,
+                       report_writer: ReportWriter, submit_queue: SubmitQueue):
+        """
+        Handles the response of an upload. A file queued for analysis is polled for its report, \
+        throttled and transient failures are resent with backoff, and a file whose upload failed \
+        is reported with its unknown file report. ScanError is raised if every key was rejected.
+
+        :param batch:  List holding the (file digests, list of file paths) tuple of the upload.
+        :param attempt:  The number of times the upload has been retried.
+        :param response:  The upload response dictionary.
+        :param report_cache:  The local report cache instance.
+        :param report_writer:  The background report writer instance.
+        :param submit_queue:  The queue of uploads and analysis polls.
+        :return:  Generator of ScanResult instances.
+        """
+        outcome = classify_response(response)
+        digests, dup_files = batch[0]
+
+        # If the file was queued for analysis, poll for its report #
+        if outcome == OK and is_upload_queued(response):
+            submit_queue.poll(batch)
+            return
+
+        # If every key was rejected, no request can succeed #
+        if outcome == REJECTED:
+            raise ScanError(*RESPONSE_ERRORS[403])
+
+        # If every key was throttled, requeue the upload to wait for a key to cool down #
+        if outcome == THROTTLED:
+            submit_queue.uploads.push(batch, attempt)
+            notify(self.on_retry, batch_files(batch), 0.0, outcome)
+            return
+
+        # If a transient error can still be retried, unless the file is over the API size limit #
+        if outcome == TRANSIENT and response.get('response_code') != TOO_LARGE and \
+                attempt < submit_queue.uploads.limit:
+            delay = submit_queue.uploads.backoff(attempt)
+            submit_queue.uploads.push(batch, attempt + 1, delay)
+            notify(self.on_retry, batch_files(batch), delay, outcome)
+            return
+
+        # Otherwise report the files with the unknown file report #
+        logging.error('Upload of %s failed: %s', dup_files[0],
+                      response.get('error') or response.get('results') or response)
+        unknown = submit_queue.forget(digests['sha256'])
+        report_cache.store(digests['sha256'], unknown)
+
+        # Iterate through the files sharing the digest #
+        for file in dup_files:
+            yield handle_response(file, digests, unknown, report_writer)
+
+    def _plan_files(self, files, journal: ScanJournal, resumed: deque):
+        """
+        Streams the files to be scanned a window at a time, so a walked dock starts scanning \
+        before it is listed whole. The backlog the stopped run did not reach follows the passed \
+        in files when resuming.
+
+        :param files:  Iterable of the paths to the files to be scanned.
+        :param journal:  The checkpoint journal of the scan.
+        :param resumed:  The queue the results of the files the resumed run completed are put on.
+        :return:  Generator of file paths in the order they are to be hashed.
+        """
+        # Backlog of the stopped run, left with the files not passed in once they are streamed #
+        backlog = set(journal.pending)
+        files = iter(files)
+
+        # While files are left, take the next window #
+        while window := list(islice(files, PRIORITY_WINDOW)):
+            # If resuming, drop the passed in files from the backlog #
+            if backlog:
+                backlog.difference_update(str(file.resolve()) for file in window)
+
+            yield from self._plan_window(window, journal, resumed)
+
+        # Add the backlog the stopped run did not reach, such as files that landed in watch mode #
+        yield from self._plan_window([Path(path) for path in sorted(backlog)
+                                      if Path(path).is_file()], journal, resumed)
+
+    def _plan_window(self, window: list[Path], journal: ScanJournal, resumed: deque) -> list[Path]:
+        """
+        Sets aside the files of a window the resumed run completed, records the rest as the \
+        backlog, and orders them so the most important spend the quota first. In archive mode, \
+        completed archives are scanned again, since the journal does not tell whether each of \
+        their members was completed, and the completed members are served by the report cache.
+
+        :param window:  The paths to the files in the window.
+        :param journal:  The checkpoint journal of the scan.
+        :param resumed:  The queue the results of the files the resumed run completed are put on.
+        :return:  The paths to the files left to be scanned, in the order they are to be hashed.
+        """
+        remaining = []
+        # Iterate through the files, setting aside those the resumed run completed #
+        for file in window:
+            completed = journal.get(file)
+            # If the file was completed and is unchanged, reuse its journaled result #
+            if completed and not (self.archives and is_archive(file)):
+                resumed.append(ScanResult(file, *completed, cached=True))
+            else:
+                remaining.append(file)
+
+        # Record the backlog, so a stopped scan can be resumed with the files it did not reach #
+        journal.enqueue(remaining)
+        # The files left when the daily quota runs out are the first scanned on the next run #
+        return order_by_priority(remaining, self.priority_rules)
+
+    async def _request_async(self, batch: list, attempt: int, upload: bool, entry: KeyEntry,
+                             key_pool: KeyPool, report_cache: object, report_writer: ReportWriter,
+                             journal: ScanJournal, retry_queue: RetryQueue,
+                             submit_queue: SubmitQueue | None, executor: ThreadPoolExecutor,
+                             results: asyncio.Queue) -> int:
+        """
+        Sends a batch or upload through the reserved key in the executor, then queues its \
+        results. If the key was throttled or rejected while other keys are usable, the request is \
+        requeued to be resent with another key.
+
+        :param batch:  List of (file digests, list of file paths) tuples to be sent.
+        :param attempt:  The number of times the batch has been retried.
+        :param upload:  Whether the batch is the file of an upload rather than hashes to look up.
+        :param entry:  The key entry reserved for the request.
+        :param key_pool:  The API key pool.
+        :param report_cache:  The local report cache instance.
+        :param report_writer:  The background report writer instance.
+        :param journal:  The checkpoint journal of the scan.
+        :param retry_queue:  The queue of batches waiting to be resent.
+        :param submit_queue:  The queue of uploads and analysis polls, or None if not submitting.
+        :param executor:  The thread pool running the blocking requests and syncs.
+        :param results:  The queue the ScanResult instances are put on.
+        :return:  The number of files that failed.
+        """
+        loop = asyncio.get_running_loop()
+        kind = 'upload' if upload else 'lookup'
+        with self.metrics.timer('request_seconds', kind=kind):
+            # If the request is an upload, stream the file, otherwise look up the batch of hashes #
+            if upload:
+                response = await loop.run_in_executor(executor, entry.vt_object.scan_file,
+                                                      batch[0][1][0])
+                responses = {batch[0][0]['sha256']: response}
+            else:
+                responses = await loop.run_in_executor(executor, batch_query,
+                                                       [digests['sha256'] for digests, _ in batch],
+                                                       entry.vt_object)
+
+        # If the key was throttled or rejected and another key can take the request #
+        if not key_pool.settle(entry, responses, kind):
+            (submit_queue.uploads if upload else retry_queue).push(batch, attempt)
+            notify(self.on_retry, batch_files(batch), 0.0, THROTTLED)
+            return 0
+
+        notify(self.on_daily_count, key_pool.daily_count())
+        # If the request is an upload #
+        if upload:
+            batch_results = self._handle_upload(batch, attempt, response, report_cache,
+                                                report_writer, submit_queue)
+        else:
+            batch_results = self._handle_batch(batch, attempt, responses, report_cache,
+                                               report_writer, retry_queue, submit_queue)
+
+        failed = 0
+        # Iterate through the results of the request #
+        for result in batch_results:
+            # If the file could not be scanned, leave it for a resumed run #
+            if result.error:
+                failed += 1
+            else:
+                journal.record(result.file, result.digests, result.response, True)
+
+            results.put_nowait(result)
+
+        # Make the completed files of the request durable without blocking other requests #
+        await loop.run_in_executor(executor, journal.sync)
+        return failed
+
+    def _scan_async(self, key_pool: KeyPool, report_cache: object, report_writer: ReportWriter,
+                    journal: ScanJournal, batches, retry_queue: RetryQueue,
+                    submit_queue: SubmitQueue | None):
+        """
+        Runs the request dispatch on an asyncio event loop driven by the consumer, yielding each \
+        result as it arrives. The blocking requests, hashing, and journal syncs run in a thread \
+        pool sized to the profile concurrency, so the loop saturates the allowed request rate on \
+        a single core. Requests in flight are cancelled if the consumer stops early.
+
+        :param key_pool:  The API key pool.
+        :param report_cache:  The local report cache instance.
+        :param report_writer:  The background report writer instance.
+        :param journal:  The checkpoint journal of the scan.
+        :param batches:  Generator of (batch, cached report) tuples from get_uncached_batches.
+        :param retry_queue:  The queue of batches waiting to be resent.
+        :param submit_queue:  The queue of uploads and analysis polls, or None if not submitting.
+        :return:  Generator of ScanResult instances, returning True if every file was scanned \
+                  without failures.
+        """
+        loop = asyncio.new_event_loop()
+        # One thread per request in flight, plus one for hashing and batching ahead #
+        executor = ThreadPoolExecutor(max_workers=self.quota_profile.concurrency + 1)
+        results = asyncio.Queue()
+        dispatch = loop.create_task(self._dispatch_async(key_pool, report_cache, report_writer,
+                                                         journal, batches, retry_queue,
+                                                         submit_queue, executor, results))
+        try:
+            while True:
+                # Run the event loop until the next result is ready #
+                result = loop.run_until_complete(results.get())
+                # If the dispatch stopped, return its outcome or raise its error #
+                if result is None:
+                    return loop.run_until_complete(dispatch)
+
+                yield result
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            # If the consumer stopped early, cancel the requests in flight #
+            if tasks:
+                # Iterate through the unfinished tasks, cancelling them #
+                for task in tasks:
+                    task.cancel()
+
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+            # Wait for the threads, so the batch generator is idle before it is closed #
+            executor.shutdown(wait=True, cancel_futures=True)
+            loop.close()
+
+    def _scan_serial(self, key_pool: KeyPool, report_cache: object, report_writer: ReportWriter,
+                     journal: ScanJournal, batches, retry_queue: RetryQueue,
+                     submit_queue: SubmitQueue | None):
+        """
+        Sends the uncached batches, ready retries, uploads, and analysis polls one request at a \
+        time, yielding each result as it arrives.
+
+        :param key_pool:  The API key pool.
+        :param report_cache:  The local report cache instance.
+        :param report_writer:  The background report writer instance.
+        :param journal:  The checkpoint journal of the scan.
+        :param batches:  Generator of (batch, cached report) tuples from get_uncached_batches.
+        :param retry_queue:  The queue of batches waiting to be resent.
+        :param submit_queue:  The queue of uploads and analysis polls, or None if not submitting.
+        :return:  Generator of ScanResult instances, returning True if every file was scanned \
+                  without failures.
+        """
+        failed = 0
+        # Time the deferred requests are resent at while carrying the backlog over #
+        resume_time = None
+
+        # While the scan was not cancelled #
+        while not self.cancel_event.is_set():
+            # Resend a waiting batch first once its delay has passed #
+            batch, attempt = retry_queue.pop_ready()
+            upload = False
+            # If no retry is ready, take a ready analysis poll or upload of an unknown file #
+            if batch is None and submit_queue is not None:
+                batch, attempt, upload = submit_queue.pop_ready()
+
+            # If nothing is ready to be resent, take the next cached report or uncached batch #
+            if batch is None:
+                next_item = next(batches, None)
+                # If every file was hashed and batched #
+                if next_item is None:
+                    # If no batches, uploads, or polls are waiting, the scan is done #
+                    if not retry_queue and not submit_queue:
+                        return not failed
+
+                    # Wait for the next retry, upload, or poll, the wait ends if the scan is
+                    # cancelled #
+                    self.cancel_event.wait(min(queue.wait_time() for queue in
+                                               (retry_queue, submit_queue) if queue))
+                    continue
+
+                batch, cached_report = next_item
+                # If the file could not be read, it fails alone and is left for a resumed run #
+                if cached_report and cached_report[1] is None:
+                    failed += 1
+                    yield ScanResult(cached_report[0], {}, {}, False, UNREADABLE_FILE)
+                    continue
+
+                # If the report was cached, no API query is needed #
+                if cached_report:
+                    result = handle_response(*cached_report, report_writer, cached=True)
+                    journal.record(result.file, result.digests, result.response, False)
+                    yield result
+                    continue
+
+            # If every key has used its maximum API calls in the last 24 hours #
+            if not key_pool.daily_remaining():
+                # If the backlog is not carried over, the scan stops #
+                if not self.carry_over:
+                    notify(self.on_quota_exhausted)
+                    break
+
+                # If the quota just ran out, find when it frees up #
+                if resume_time is None:
+                    resume_time = self._carry_over(key_pool, journal, submit_queue)
+
+                # Defer the request until a key has daily quota again #
+                (submit_queue.uploads if upload else retry_queue).push(
+                    batch, attempt, max(0.0, resume_time - time.time()))
+                continue
+
+            resume_time = None
+
+            # If the request is an upload of an unknown file #
+            if upload:
+                notify(self.on_submit, batch_files(batch))
+                # Stream the file through the key with the most capacity, waiting if all keys are
+                # at their per minute limit #
+                response = key_pool.submit(batch[0][1][0], batch[0][0]['sha256'], self.on_wait)
+                # If the wait was cancelled #
+                if response is None:
+                    break
+
+                batch_results = self._handle_upload(batch, attempt, response, report_cache,
+                                                    report_writer, submit_queue)
+            else:
+                notify(self.on_batch, batch_files(batch))
+                # Send the batch of hashes through the key with the most capacity, waiting if all
+                # keys are at their per minute limit, return the split per hash responses #
+                responses = key_pool.query([digests['sha256'] for digests, _ in batch],
+                                           self.on_wait)
+                # If the wait was cancelled #
+                if responses is None:
+                    break
+
+                batch_results = self._handle_batch(batch, attempt, responses, report_cache,
+                                                   report_writer, retry_queue, submit_queue)
+
+            notify(self.on_daily_count, key_pool.daily_count())
+            # Iterate through the results of the request #
+            for result in batch_results:
+                # If the file could not be scanned, leave it for a resumed run #
+                if result.error:
+                    failed += 1
+                else:
+                    journal.record(result.file, result.digests, result.response, True)
+
+                yield result
+
+            # Make the completed files of the request durable #
+            journal.sync()
+
+        return False
+
+    def cancel(self):
+        """
+        Requests the scan to stop after the current request, interrupting rate limit waits. May \
+        be called from any thread.
+
+        :return:  Nothing
+        """
+        self.cancel_event.set()
+
+    def scan(self, files):
+        """
+        Scans the passed in files, yielding a result per file as cached reports are found and API \
+        responses arrive. The quota, cache, manifest, and report state is saved however the scan \
+        stops, including when the consumer stops iterating early. Each completed file is written \
+        to the scan journal, so a resumed scan yields the files the stopped run completed without \
+        hashing or querying them again. Throttled and failed requests are resent without stopping \
+        the scan, ScanError is raised if every key is rejected. Requests are kept in flight on an \
+        asyncio event loop when the quota profile concurrency is above 1. In submit mode, unknown \
+        files are uploaded and yielded once their analysis finishes or stops being polled. In \
+        carry over mode, the requests left when the daily quota runs out wait for it to free up. \
+        A resumed scan also scans the backlog the stopped run did not reach. The files are read \
+        as the scan goes, so a streamed dock starts scanning right away, and ordered by priority \
+        a window at a time. The stage timings and counts of the run are exported to the metrics \
+        directory however the scan stops. In archive mode, the members of each archive are hashed \
+        from its decompression stream and yielded as ArchiveMember results after the archive.
+
+        :param files:  Iterable of the paths to the files to be scanned, such as from walk_files.
+        :return:  Generator of ScanResult instances.
+        """
+        # If no API key is set #
+        if not self.api_keys:
+            raise ScanError(*NO_API_KEY)
+
+        # Enforce the profile limits with a connection per request in flight, unless overridden #
+        pool_options = {'limits': self.quota_profile.limits,
+                        'pool_size': max(HTTP_POOL_SIZE, self.quota_profile.concurrency),
+                        **self.pool_options}
+        # Collect the stage timings and counts of the run #
+        self.metrics = ScanMetrics()
+        # Open the API key pool with the quota ledger of each key, waits end when cancelled #
+        key_pool = KeyPool(self.api_keys, self.state_dir, cancel_event=self.cancel_event,
+                           metrics=self.metrics, **pool_options)
+        # Open the local report cache to avoid spending queries on recently seen files #
+        report_cache = ReportCache(self.state_dir / 'report_cache.db')
+        # Open the hash manifest to skip re-reading files unchanged since the last run #
+        hash_manifest = HashManifest(self.state_dir / 'hash_manifest.db')
+        # Start the background report writer thread over the configured report sinks #
+        report_writer = ReportWriter(get_report_sinks(self.state_dir, self.time_obj),
+                                     metrics=self.metrics)
+        # Open the checkpoint journal, loading the completed files and backlog of the stopped run if
+        # resuming #
+        journal = ScanJournal(self.state_dir / JOURNAL_NAME, self.resume)
+        # Results of the files the resumed run completed, set aside as the files are planned #
+        resumed = deque()
+        # Stream the files a window at a time, recording the backlog and ordering it by priority #
+        planned_files = self._plan_files(files, journal, resumed)
+        # In archive mode, hash the members of each archive from its decompression stream, unless
+        # the manifest holds those of the unchanged archive #
+        member_func = self.metrics.timed('archive_seconds', partial(
+            hash_manifest.get_members,
+            expand_func=partial(expand_archive, limits=self.archive_limits))) \
+            if self.archives else None
+        # Hash files in the background and batch the uncached digests into requests #
+        hashed_files = hash_files(planned_files,
+                                  self.metrics.timed('hash_seconds', hash_manifest.get_digests),
+                                  member_func=member_func)
+        batches = get_uncached_batches(hashed_files, report_cache, self.quota_profile.batch_size)
+        # Batches waiting to be resent after throttling or a transient error #
+        retry_queue = RetryQueue(**self.retry_options)
+        # Unknown files waiting to be uploaded and analyses waiting to be polled, if submitting #
+        submit_queue = SubmitQueue(**{'batch_size': self.quota_profile.batch_size,
+                                      'retry_options': self.retry_options,
+                                      **self.submit_options}) if self.submit else None
+        # Send requests concurrently if the profile allows, otherwise one at a time #
+        run_scan = self._scan_async if self.quota_profile.concurrency > 1 else self._scan_serial
+        # Set once every file was scanned without failures, so the run is not resumed #
+        complete = False
+        try:
+            complete = yield from merge_resumed(run_scan(key_pool, report_cache, report_writer,
+                                                         journal, batches, retry_queue,
+                                                         submit_queue), resumed, self.metrics)
+        finally:
+            # Stop hashing ahead and wait for the remaining reports to be written #
+            batches.close()
+            hashed_files.close()
+            planned_files.close()
+            report_writer.close()
+            hash_manifest.close()
+            report_cache.close()
+            journal.close(complete)
+            notify(self.on_daily_count, key_pool.daily_count())
+            key_pool.close()
+            self.metrics.export(self.metrics_dir)
+
+
+def batch_files(batch: list) -> list[Path]:
+    """
+    Gets the paths of every file in a batch, including the duplicates sharing a digest.
+
+    :param batch:  List of (file digests, list of file paths) tuples.
+    :return:  The file paths in the batch.
+    """
+    return [file for _, dup_files in batch for file in dup_files]
+
+
+def collect_finished(pending: set) -> int:
+    """
+    Removes the finished request tasks from the passed in set, re-raising any error they raised.
+
+    :param pending:  The set of request tasks in flight.
+    :return:  The number of files that failed in the finished requests.
+    """
+    finished = {task for task in pending if task.done()}
+    pending -= finished
+    # Retrieve the error of every finished task, so none is reported as never retrieved #
+    errors = [task.exception() for task in finished if task.exception()]
+
+    # If a request raised an error that stops the scan #
+    if errors:
+        raise errors[0]
+
+    return sum(task.result() for task in finished)
+
+
+def handle_response(file: Path, digests: dict, response: dict, report_writer: ReportWriter,
+                    cached: bool = False) -> ScanResult:
+    """
+    Queues the API response for the passed in file to be written to the report sinks, raising \
+    ScanError on error codes.
+
+    :param file:  The path to the scanned file the response belongs to.
+    :param digests:  Dictionary mapping each algorithm name to the file hex digest.
+    :param response:  The response dictionary returned from the API.
+    :param report_writer:  The background report writer instance.
+    :param cached:  Whether the response was retrieved from the report cache.
+    :return:  The result of the scanned file.
+    """
+    # If the response is not successful #
+    if response.get('response_code') != 200:
+        raise ScanError(*RESPONSE_ERRORS.get(response.get('response_code'), UNKNOWN_RESPONSE))
+
+    # Queue json results to be written to the report sinks #
+    report_writer.submit(file, digests, response)
+
+    return ScanResult(file, digests, response, cached)
+
+
+def count_result(metrics: ScanMetrics, result: ScanResult) -> ScanResult:
+    """
+    Counts a result in the files scanned by whether it failed, was cached, or was queried.
+
+    :param metrics:  The metrics of the scan.
+    :param result:  The result of the scanned file.
+    :return:  The passed in result.
+    """
+    metrics.count('files_total', result='failed' if result.error else
+                  'cached' if result.cached else 'queried')
+    return result
+
+
+def merge_resumed(results, resumed: deque, metrics: ScanMetrics):
+    """
+    Yields the results of the files the resumed run completed as they are set aside, between \
+    the results of the scan, counting each in the metrics.
+
+    :param results:  Generator of the ScanResult instances of the scan.
+    :param resumed:  The queue of the results of the files the resumed run completed.
+    :param metrics:  The metrics of the scan.
+    :return:  Generator of ScanResult instances, returning the return value of the scan results.
+    """
+    try:
+        while True:
+            # Yield the resumed results set aside so far #
+            while resumed:
+                yield count_result(metrics, resumed.popleft())
+
+            try:
+                result = next(results)
+
+            # If the scan is done, yield the resumed results set aside at its end #
+            except StopIteration as scan_done:
+                while resumed:
+                    yield count_result(metrics, resumed.popleft())
+
+                return scan_done.value
+
+            yield count_result(metrics, result)
+    finally:
+        # Stop the scan if the consumer stopped early #
+        results.close()
+
+
+def notify(callback, *args):
+    """
+    Calls the passed in event callback if one was set.
+
+    :param callback:  The event callback, or None.
+    :param args:  The arguments passed to the callback.
+    :return:  Nothing
+    """
+    # If a callback was set #
+    if callback:
+        callback(*args)
@@ -0,0 +1,241 @@
+"""
+Checkpoint journal of a scan run, recording the backlog of files queued to be scanned and each
+completed file with its digests, response, and whether it spent a query as soon as it finishes, so
+an interrupted run can be resumed from where it stopped without hashing or querying the completed
+files again, and with the queued files it did not reach.
+
+Built-in modules
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+# Custom modules #
+from Modules.utils import error_query
+
+
+# Pseudo constants #
+JOURNAL_NAME = 'scan_journal.jsonl'
+
+
+class ScanJournal:
+    """ Class to append the completed files of a scan run to a JSON lines journal. """
+    def __init__(self, journal_file: Path, resume: bool = False):
+        """
+        Load the completed files and backlog of the interrupted run when resuming, otherwise \
+        start a new journal, and open it for appending.
+
+        :param journal_file:  Path to the journal file.
+        :param resume:  Whether to continue the previous run if it did not complete.
+        """
+        self.journal_file = journal_file
+        # Completed files of the resumed run, keyed by resolved path #
+        self.done = {}
+        # Resolved paths of the queued files not completed yet, the backlog of the run #
+        self.pending = set()
+        # Number of completed files that spent an API query in this session #
+        self.queried = 0
+
+        # If resuming, load the files the previous run completed and the backlog it left #
+        if resume:
+            self.done, queued, complete = load_journal(journal_file)
+            self.pending = queued - self.done.keys()
+            # If the previous run completed, there is nothing to resume #
+            if complete:
+                self.done, self.pending, resume = {}, set(), False
+
+        self.resumed = resume
+        # Append to the interrupted run, or truncate the journal for a new run #
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | (0 if resume else os.O_TRUNC)
+        try:
+            self._fd = os.open(str(journal_file), flags, 0o600)
+
+        # If error occurs during file operation #
+        except OSError as file_err:
+            # Lookup, display, and log IO error #
+            error_query(str(journal_file), 'a' if resume else 'w', file_err)
+
+        # If resuming, end a record cut short by a crash so the resume record stays separate #
+        if resume:
+            self._write(None)
+
+        self._write({'event': 'resume' if resume else 'start', 'time': time.time()})
+
+    def _write(self, record: dict):
+        """
+        Appends a record to the journal in a single write.
+
+        :param record:  The record to be written as a JSON line, or None for an empty line.
+        :return:  Nothing
+        """
+        line = '' if record is None else json.dumps(record, separators=(',', ':'))
+        try:
+            os.write(self._fd, (line + '\n').encode('utf-8'))
+
+        # If error occurs during file operation #
+        except OSError as file_err:
+            # Lookup, display, and log IO error #
+            error_query(str(self.journal_file), 'a', file_err)
+
+    def close(self, complete: bool):
+        """
+        Records how the run ended, syncs the journal to disk, and closes it.
+
+        :param complete:  Whether every file was scanned, otherwise the run can be resumed.
+        :return:  Nothing
+        """
+        self._write({'event': 'end', 'time': time.time(),
+                     'status': 'complete' if complete else 'stopped', 'queried': self.queried})
+        self.sync()
+        os.close(self._fd)
+
+    def enqueue(self, files: list[Path]):
+        """
+        Adds the files not already queued to the backlog of the run.
+
+        :param files:  The paths to the files to be scanned.
+        :return:  Nothing
+        """
+        paths = [path for path in dict.fromkeys(str(file.resolve()) for file in files)
+                 if path not in self.pending]
+        # If every file is already queued #
+        if not paths:
+            return
+
+        self.pending.update(paths)
+        self._write({'event': 'queue', 'paths': paths})
+
+    def get(self, file: Path) -> tuple[dict, dict] | None:
+        """
+        Gets the result of a file the resumed run completed, if the file is unchanged since. A \
+        file that can no longer be read is treated as not completed, so it fails alone when hashed.
+
+        :param file:  The path to the file.
+        :return:  Tuple of the file digests and response dictionaries, or None if the file was \
+                  not completed, has changed, or can not be read.
+        """
+        # If no run is resumed, skip resolving the path #
+        if not self.done:
+            return None
+
+        entry = self.done.get(str(file.resolve()))
+        # If the file was not completed #
+        if entry is None:
+            return None
+
+        try:
+            file_stat = file.stat()
+
+        # If the file was removed or can not be read, scan it again rather than stopping the scan #
+        except OSError as file_err:
+            logging.warning('Unable to check completed file %s: %s', file, file_err)
+            return None
+
+        # If the file changed since it was completed #
+        if (file_stat.st_size, file_stat.st_mtime_ns) != (entry['size'], entry['mtime_ns']):
+            return None
+
+        return entry['digests'], entry['response']
+
+    def record(self, file: Path, digests: dict, response: dict, queried: bool):
+        """
+        Appends a completed file to the journal. The write reaches the OS right away, sync is \
+        called once per request to make it durable. A file that can no longer be read is not \
+        journaled and stays in the backlog of a resumed run.
+
+        :param file:  The path to the completed file.
+        :param digests:  Dictionary mapping each algorithm name to the file hex digest.
+        :param response:  The response dictionary of the file.
+        :param queried:  Whether the file spent an API query, rather than a cached report.
+        :return:  Nothing
+        """
+        try:
+            file_stat = file.stat()
+
+        # If the file was removed or can not be read, skip it rather than stopping the scan #
+        except OSError as file_err:
+            logging.warning('Unable to journal completed file %s: %s', file, file_err)
+            return
+
+        path = str(file.resolve())
+        self._write({'event': 'file', 'path': path, 'size': file_stat.st_size,
+                     'mtime_ns': file_stat.st_mtime_ns, 'digests': digests, 'response': response,
+                     'queried': queried})
+        self.pending.discard(path)
+        self.queried += queried
+
+    def sync(self):
+        """
+        Syncs the journal records written so far to disk.
+
+        :return:  Nothing
+        """
+        try:
+            os.fsync(self._fd)
+
+        # If error occurs during file operation #
+        except OSError as file_err:
+            # Lookup, display, and log IO error #
+            error_query(str(self.journal_file), 'a', file_err)
+
+
+def is_resumable(journal_file: Path) -> bool:
+    """
+    Checks whether the last run in the journal stopped before every file was scanned.
+
+    :param journal_file:  Path to the journal file.
+    :return:  True if the run can be resumed, otherwise False.
+    """
+    done, queued, complete = load_journal(journal_file)
+    return not complete and bool(done or queued)
+
+
+def load_journal(journal_file: Path) -> tuple[dict, set, bool]:
+    """
+    Reads the records of the last run in the journal, skipping a record cut short by a crash.
+
+    :param journal_file:  Path to the journal file.
+    :return:  Tuple of the completed file records keyed by path, the set of queued file paths, \
+              and whether the run completed.
+    """
+    # If no run has been journaled #
+    if not journal_file.exists():
+        return {}, set(), True
+
+    done, queued, complete = {}, set(), False
+    try:
+        with journal_file.open('r', encoding='utf-8') as in_file:
+            # Iterate through the journal records #
+            for line in in_file:
+                # If the line is the separator written when resuming #
+                if not line.strip():
+                    continue
+
+                try:
+                    record = json.loads(line)
+
+                # If the record was cut short by a crash #
+                except ValueError:
+                    logging.warning('Skipping unreadable scan journal record: %r', line)
+                    continue
+
+                # If a new run was started, the earlier runs are no longer resumable #
+                if record['event'] == 'start':
+                    done, queued, complete = {}, set(), False
+                # If files were added to the backlog #
+                elif record['event'] == 'queue':
+                    queued.update(record['paths'])
+                # If a file was completed #
+                elif record['event'] == 'file':
+                    done[record['path']] = record
+                # If the run ended, or was resumed after it stopped #
+                else:
+                    complete = record.get('status') == 'complete'
+
+    # If error occurs during file operation #
+    except OSError as file_err:
+        # Lookup, display, and log IO error #
+        error_query(str(journal_file), 'r', file_err)
+
+    return done, queued, complete
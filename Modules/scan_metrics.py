@@ -0,0 +1,325 @@
+"""
+Instrumentation of a scan run, counting events and timing the hashing, API request, rate limit wait,
+and report writing stages in latency histograms. At the end of each run the metrics are exported as
+a Prometheus textfile for the node exporter textfile collector and as a JSON summary.
+
+Built-in modules
+"""
+import cProfile
+import json
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+# Custom modules #
+from Modules.utils import error_query
+
+
+# Pseudo constants #
+METRICS_DIR = os.environ.get('VTOTAL_METRICS_DIR', '')
+METRICS_PREFIX = 'vtotal_'
+METRICS_NAME = 'VTotal_Metrics'
+# Upper bounds in seconds of the latency histogram buckets, from a cached hash to a quota wait #
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                   60.0, 300.0, 3600.0)
+METRIC_HELP = {
+    'files_total': ('counter', 'Files scanned, by whether the report was cached, queried, or '
+                               'failed.'),
+    'requests_total': ('counter', 'API requests sent, by kind and response outcome.'),
+    'reports_total': ('counter', 'Reports written to the report sinks.'),
+    'hash_seconds': ('histogram', 'Seconds hashing each file, or reading its manifest digests.'),
+    'archive_seconds': ('histogram', 'Seconds hashing the members of each file in archive mode.'),
+    'request_seconds': ('histogram', 'Seconds waiting on each API request.'),
+    'rate_limit_wait_seconds': ('histogram', 'Seconds each wait for a key with quota lasted.'),
+    'report_write_seconds': ('histogram', 'Seconds writing each report to the report sinks.'),
+    'run_seconds': ('gauge', 'Seconds the last run took.'),
+    'files_per_minute': ('gauge', 'Files scanned per minute in the last run.'),
+    'run_end_timestamp_seconds': ('gauge', 'Unix time the last run ended.')
+}
+PROFILE_LINES = 40
+
+
+class LatencyHistogram:
+    """ Class to count observed durations in cumulative buckets, as Prometheus histograms do. """
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        """
+        Initialize the empty bucket counts.
+
+        :param buckets:  The ascending upper bounds of the buckets in seconds.
+        """
+        self.buckets = buckets
+        # Observations per bucket, the last counting those above every bound #
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        """
+        Adds a duration to the bucket it falls in.
+
+        :param seconds:  The observed duration.
+        :return:  Nothing
+        """
+        index = next((index for index, bound in enumerate(self.buckets) if seconds <= bound),
+                     len(self.buckets))
+        self.counts[index] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, fraction: float) -> float:
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in.
+
+        :param fraction:  The quantile between 0 and 1, such as 0.95.
+        :return:  The bucket bound in seconds, None if above every bound, or 0 if empty.
+        """
+        rank, seen = fraction * self.count, 0
+        # Iterate through the bucket counts until the rank is reached #
+        for bound, bucket_count in zip(self.buckets + (None,), self.counts):
+            seen += bucket_count
+            # If the quantile falls in the bucket #
+            if seen and seen >= rank:
+                return bound
+
+        return 0.0
+
+
+class ScanMetrics:
+    """ Class to collect the counters, histograms, and gauges of a scan run across threads. """
+    def __init__(self):
+        """
+        Initialize the empty metrics and the run start time.
+        """
+        self._lock = Lock()
+        # Metric values keyed by (name, labels), labels being a tuple of (label, value) pairs #
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.start_time = time.monotonic()
+
+    def count(self, name: str, amount: float = 1, **labels):
+        """
+        Adds to a counter.
+
+        :param name:  The counter name, such as files_total.
+        :param amount:  The amount added.
+        :param labels:  Labels telling apart the series of the counter.
+        :return:  Nothing
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def export(self, metrics_dir: Path):
+        """
+        Sets the run gauges and writes the Prometheus textfile and JSON summary, each replaced \
+        atomically so a collector never reads a partial file.
+
+        :param metrics_dir:  The directory the metrics files are written to.
+        :return:  Nothing
+        """
+        with self._lock:
+            files = sum(value for (name, _), value in self.counters.items()
+                        if name == 'files_total')
+
+        run_seconds = time.monotonic() - self.start_time
+        self.set_gauge('run_seconds', run_seconds)
+        self.set_gauge('files_per_minute', files / run_seconds * 60 if run_seconds else 0.0)
+        self.set_gauge('run_end_timestamp_seconds', time.time())
+
+        write_atomic(metrics_dir / f'{METRICS_NAME}.prom', self.to_prometheus())
+        write_atomic(metrics_dir / f'{METRICS_NAME}.json',
+                     json.dumps(self.summary(), indent=2) + '\n')
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        Adds a duration to a latency histogram.
+
+        :param name:  The histogram name, such as hash_seconds.
+        :param seconds:  The observed duration.
+        :param labels:  Labels telling apart the series of the histogram.
+        :return:  Nothing
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            # If the series was not observed yet #
+            if key not in self.histograms:
+                self.histograms[key] = LatencyHistogram()
+
+            self.histograms[key].observe(seconds)
+
+    def set_gauge(self, name: str, value: float):
+        """
+        Sets a gauge.
+
+        :param name:  The gauge name, such as files_per_minute.
+        :param value:  The gauge value.
+        :return:  Nothing
+        """
+        with self._lock:
+            self.gauges[(name, ())] = value
+
+    def summary(self) -> dict:
+        """
+        Summarizes the metrics, with the count, total, mean, and 50th, 95th, and 99th \
+        percentile bucket bounds of each histogram.
+
+        :return:  Dictionary of the counters, histograms, and gauges keyed by series name.
+        """
+        with self._lock:
+            return {
+                'counters': {series_name(*key): value for key, value in self.counters.items()},
+                'histograms': {series_name(*key): {
+                    'count': hist.count, 'total': round(hist.total, 6),
+                    'mean': round(hist.total / hist.count, 6) if hist.count else 0.0,
+                    'p50': hist.quantile(0.5), 'p95': hist.quantile(0.95),
+                    'p99': hist.quantile(0.99)} for key, hist in self.histograms.items()},
+                'gauges': {series_name(*key): value for key, value in self.gauges.items()}
+            }
+
+    def timed(self, name: str, func):
+        """
+        Wraps a callable so each call is timed into a latency histogram.
+
+        :param name:  The histogram name.
+        :param func:  The callable to be timed.
+        :return:  The wrapping callable.
+        """
+        def timed_call(*args, **kwargs):
+            with self.timer(name):
+                return func(*args, **kwargs)
+
+        return timed_call
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Times the enclosed block into a latency histogram, including when it raises.
+
+        :param name:  The histogram name.
+        :param labels:  Labels telling apart the series of the histogram.
+        :return:  Context manager timing the block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_prometheus(self) -> str:
+        """
+        Formats the metrics in the Prometheus text exposition format.
+
+        :return:  The metrics text, with HELP and TYPE lines for each metric.
+        """
+        lines = []
+        with self._lock:
+            series = sorted([*self.counters.items(), *self.histograms.items(),
+                             *self.gauges.items()], key=lambda item: item[0])
+
+        described = set()
+        # Iterate through the series grouped by metric name #
+        for (name, labels), value in series:
+            metric = METRICS_PREFIX + name
+            # If the metric was not described yet #
+            if name not in described:
+                metric_type, help_text = METRIC_HELP.get(name, ('untyped', name))
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {metric_type}']
+                described.add(name)
+
+            # If the series is a counter or gauge #
+            if not isinstance(value, LatencyHistogram):
+                lines.append(f'{metric}{format_labels(labels)} {value}')
+                continue
+
+            cumulative = 0
+            # Iterate through the buckets, each counting the observations at or below its bound #
+            for bound, bucket_count in zip(value.buckets + (float('inf'),), value.counts):
+                cumulative += bucket_count
+                bound_label = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{format_labels(labels + (("le", bound_label),))} '
+                             f'{cumulative}')
+
+            lines += [f'{metric}_sum{format_labels(labels)} {value.total}',
+                      f'{metric}_count{format_labels(labels)} {value.count}']
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: tuple) -> str:
+    """
+    Formats the labels of a series as Prometheus does.
+
+    :param labels:  Tuple of (label, value) pairs.
+    :return:  The labels in braces, or an empty string if there are none.
+    """
+    # If the series has no labels #
+    if not labels:
+        return ''
+
+    return '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+
+@contextmanager
+def profile_run(profile_file: Path | None):
+    """
+    Profiles the enclosed block with cProfile if a profile file is passed in, saving the stats \
+    and a text summary of the slowest calls next to it however the block exits. Only the calling \
+    thread is profiled, the worker threads are covered by the stage metrics.
+
+    :param profile_file:  The path the profile stats are saved to, or None to not profile.
+    :return:  Context manager profiling the block.
+    """
+    # If profiling is off #
+    if profile_file is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        try:
+            profiler.dump_stats(str(profile_file))
+            with profile_file.with_suffix('.txt').open('w', encoding='utf-8') as out_file:
+                stats = pstats.Stats(profiler, stream=out_file)
+                stats.sort_stats('cumulative').print_stats(PROFILE_LINES)
+
+        # If error occurs during file operation #
+        except OSError as file_err:
+            # Lookup, display, and log IO error #
+            error_query(str(profile_file), 'w', file_err)
+
+
+def series_name(name: str, labels: tuple) -> str:
+    """
+    Names a series by its metric name and labels, as used in the JSON summary.
+
+    :param name:  The metric name.
+    :param labels:  Tuple of (label, value) pairs.
+    :return:  The series name, such as requests_total{kind="lookup",outcome="ok"}.
+    """
+    return name + format_labels(labels)
+
+
+def write_atomic(out_path: Path, text: str):
+    """
+    Writes a file through a temp file swapped in, so readers never see a partial file.
+
+    :param out_path:  The path of the file to be written.
+    :param text:  The file contents.
+    :return:  Nothing
+    """
+    temp_file = out_path.with_name(f'{out_path.name}.tmp')
+    try:
+        temp_file.write_text(text, encoding='utf-8')
+        os.replace(temp_file, out_path)
+
+    # If error occurs during file operation #
+    except OSError as file_err:
+        # Lookup, display, and log IO error #
+        error_query(str(out_path), 'w', file_err)
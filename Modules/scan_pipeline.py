@@ -0,0 +1,216 @@
+"""
+Pipeline stages that keep file hashing and report writing off the API request critical path, so
+hashing upcoming files overlaps with rate limit waits and report output.
+
+Built-in modules
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+# Custom modules #
+from Modules.scan_metrics import ScanMetrics
+from Modules.utils import BATCH_SIZE, error_query, get_file_digests
+
+
+# Pseudo constants #
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+HASH_LOOKAHEAD = 16
+WRITE_QUEUE_SIZE = 64
+
+
+class ReportWriter:
+    """ Class to write reports to the output sinks in a background thread, off the hot path. """
+    def __init__(self, sinks: list, queue_size: int = WRITE_QUEUE_SIZE,
+                 metrics: ScanMetrics = None):
+        """
+        Initialize the bounded report queue and start the writer thread.
+
+        :param sinks:  The report sinks every report is written to.
+        :param queue_size:  The maximum number of reports waiting to be written.
+        :param metrics:  Optional metrics of the scan the report writes are recorded in.
+        """
+        self.sinks = sinks
+        self.metrics = metrics or ScanMetrics()
+        self._queue = Queue(maxsize=queue_size)
+        # The report path and error of the first failed write #
+        self._error = None
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _check_error(self):
+        """
+        Raises a write error from the writer thread in the calling thread.
+
+        :return:  Nothing
+        """
+        # If the writer thread failed to write a report #
+        if self._error:
+            report_file, file_err = self._error
+            # Lookup, display, and log IO error #
+            error_query(str(report_file), 'a', file_err)
+
+    def _run(self):
+        """
+        Writes queued reports to the sinks until the stop sentinel is received, then closes the \
+        sinks so buffered reports are written.
+
+        :return:  Nothing
+        """
+        while True:
+            item = self._queue.get()
+            # If the stop sentinel was received #
+            if item is None:
+                break
+
+            # If a previous write failed, discard the remaining reports #
+            if self._error:
+                continue
+
+            with self.metrics.timer('report_write_seconds'):
+                self._write_sinks(lambda sink: sink.write(*item))
+
+            self.metrics.count('reports_total')
+
+        self._write_sinks(lambda sink: sink.close())
+
+    def _write_sinks(self, sink_call):
+        """
+        Calls the passed in write operation on every sink, saving the first error.
+
+        :param sink_call:  Callable passed each sink.
+        :return:  Nothing
+        """
+        # Iterate through the report sinks #
+        for sink in self.sinks:
+            try:
+                sink_call(sink)
+
+            # If error occurs writing to report output file #
+            except OSError as file_err:
+                # If it is the first error, save it for the scanning thread #
+                if not self._error:
+                    self._error = (sink.path, file_err)
+
+    def close(self):
+        """
+        Waits for the queued reports to be written and stops the writer thread.
+
+        :return:  Nothing
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._check_error()
+
+    def submit(self, file: Path, digests: dict, response: dict):
+        """
+        Queues the response of the passed in file to be written to the report sinks.
+
+        :param file:  The path to the scanned file the response belongs to.
+        :param digests:  Dictionary mapping each algorithm name to the file hex digest.
+        :param response:  The response dictionary returned from the API.
+        :return:  Nothing
+        """
+        self._check_error()
+        self._queue.put((file, digests, response))
+
+
+def get_uncached_batches(hashed_files, report_cache: object, batch_size: int = BATCH_SIZE):
+    """
+    Checks hashed files against the report cache, yielding each cached report as it is found and \
+    the uncached unique digests in full batches, with a final partial batch when files run out. \
+    Files with identical content are grouped under one digest so it is queried once, and copies \
+    found after their digest was answered are served by the report cache. Files that could not \
+    be read are yielded like a cached report with no digests or response, so they fail alone.
+
+    :param hashed_files:  Iterable of (file path, file digests) tuples.
+    :param report_cache:  The local report cache instance.
+    :param batch_size:  The maximum number of unique digests per batch.
+    :return:  Generator of (batch, cached report) tuples, holding either a batch list of (file
+              digests, list of file paths) tuples to be queried with no cached report, or an
+              empty batch with a cached (file path, file digests, response) report.
+    """
+    # Unique digests waiting to be sent, mapped to their digests and matching files #
+    batch = {}
+
+    # Iterate through the files as their digests become available #
+    for file, digests in hashed_files:
+        # If the file could not be read, pass it on as a failure #
+        if digests is None:
+            yield [], (file, None, None)
+            continue
+
+        # If the digest is already in the batch, share its query #
+        if digests['sha256'] in batch:
+            batch[digests['sha256']][1].append(file)
+            continue
+
+        response = report_cache.get(digests['sha256'])
+
+        # If the report was cached, no API query is needed #
+        if response is not None:
+            yield [], (file, digests, response)
+            continue
+
+        batch[digests['sha256']] = (digests, [file])
+        # If the batch is full #
+        if len(batch) == batch_size:
+            yield list(batch.values()), None
+            batch = {}
+
+    # If there are leftover files for a partial batch #
+    if batch:
+        yield list(batch.values()), None
+
+
+def hash_files(files: list[Path], hash_func=get_file_digests, workers: int = HASH_WORKERS,
+                lookahead: int = HASH_LOOKAHEAD, member_func=None):
+    """
+    Hashes files in a background thread pool ahead of the consumer, yielding the results in the \
+    original file order. At most lookahead files are hashed ahead, keeping memory bounded. If a \
+    member function is passed in, the members it hashes inside each file, such as those of an \
+    archive, are yielded right after the file.
+
+    :param files:  The file paths to be hashed.
+    :param hash_func:  Callable passed a file path that returns the file digests dictionary, or
+                       None if the file could not be read.
+    :param workers:  The number of hashing threads.
+    :param lookahead:  The maximum number of files hashed ahead of the consumer.
+    :param member_func:  Optional callable passed a file path that returns a list of (member,
+                         member digests) tuples of the files inside it.
+    :return:  Generator of (file path, file digests) tuples, the digests are None if the file
+              could not be read.
+    """
+    def hash_job(file: Path) -> tuple:
+        # Hash the file and the members inside it in the same worker #
+        digests = hash_func(file)
+        return digests, member_func(file) if member_func and digests is not None else []
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    file_iter = iter(files)
+    pending = deque()
+
+    try:
+        # Start hashing the first group of files #
+        for file in islice(file_iter, lookahead):
+            pending.append((file, executor.submit(hash_job, file)))
+
+        while pending:
+            file, future = pending.popleft()
+            # Wait for the digests, re-raising any error from the worker thread #
+            digests, members = future.result()
+
+            next_file = next(file_iter, None)
+            # If there are files left, keep the lookahead full #
+            if next_file is not None:
+                pending.append((next_file, executor.submit(hash_job, next_file)))
+
+            yield file, digests
+            yield from members
+
+    finally:
+        # Cancel any hashing not needed when the consumer stops early #
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,183 @@
+"""
+Priority ordering of the files to be scanned, so a scarce daily quota is spent on the files most
+likely to matter first. Files are scored by their magic bytes, modification time, size, and source
+folder, and the files left when the quota runs out are the first scanned on the next run.
+
+Built-in modules
+"""
+import logging
+import os
+import time
+from collections import Counter
+from pathlib import Path
+# Custom modules #
+from Modules.utils import print_err
+
+
+# Pseudo constants #
+PRIORITY_MAGIC = os.environ.get('VTOTAL_PRIORITY_MAGIC', 'pe=100,elf=100,macho=100,script=80,'
+                                                         'office=60,pdf=40,archive=30')
+PRIORITY_FOLDERS = os.environ.get('VTOTAL_PRIORITY_FOLDERS', '')
+PRIORITY_SIZE = os.environ.get('VTOTAL_PRIORITY_SIZE', '1024-33554432=20')
+PRIORITY_RECENT = float(os.environ.get('VTOTAL_PRIORITY_RECENT', 50))
+PRIORITY_HALF_LIFE = float(os.environ.get('VTOTAL_PRIORITY_HALF_LIFE', 7))
+# Files ordered together, so a streamed dock starts scanning without being listed whole first #
+PRIORITY_WINDOW = int(os.environ.get('VTOTAL_PRIORITY_WINDOW', 4096))
+DAY_SECONDS = 86400
+MAGIC_LENGTH = 8
+# Leading bytes of each file type, checked in order #
+MAGIC_SIGNATURES = (
+    (b'MZ', 'pe'),
+    (b'\x7fELF', 'elf'),
+    (b'\xcf\xfa\xed\xfe', 'macho'),
+    (b'\xce\xfa\xed\xfe', 'macho'),
+    (b'\xca\xfe\xba\xbe', 'macho'),
+    (b'#!', 'script'),
+    (b'\xd0\xcf\x11\xe0', 'office'),
+    (b'%PDF', 'pdf'),
+    (b'PK\x03\x04', 'archive'),
+    (b'Rar!', 'archive'),
+    (b'7z\xbc\xaf', 'archive'),
+    (b'\x1f\x8b', 'archive')
+)
+# Script types without a shebang are recognized by suffix #
+SCRIPT_SUFFIXES = {'.bat', '.cmd', '.hta', '.js', '.jse', '.ps1', '.py', '.sh', '.vbe', '.vbs',
+                   '.wsf'}
+
+
+class PriorityRules:
+    """ Class to score files by the configured priority rules, higher scores are scanned first. """
+    def __init__(self, magic_weights: str = PRIORITY_MAGIC, folder_weights: str = PRIORITY_FOLDERS,
+                 size_range: str = PRIORITY_SIZE, recent_weight: float = PRIORITY_RECENT,
+                 half_life: float = PRIORITY_HALF_LIFE):
+        """
+        Initialize the rule weights from their setting strings.
+
+        :param magic_weights:  Comma-separated type=weight pairs for the file types detected by
+                               magic bytes.
+        :param folder_weights:  Comma-separated name=weight pairs for the folders a file is in.
+        :param size_range:  The min-max=weight byte range of files worth scanning first, 0-0=0 to
+                            turn the size rule off.
+        :param recent_weight:  The score of a file modified just now, halved every half life.
+        :param half_life:  The number of days the recent weight takes to halve.
+        """
+        self.magic_weights = parse_weights(magic_weights)
+        self.folder_weights = {name.lower(): weight
+                               for name, weight in parse_weights(folder_weights).items()}
+        self.recent_weight = recent_weight
+        self.half_life = half_life
+
+        try:
+            size_bounds, size_weight = size_range.rsplit('=', 1)
+            self.size_min, self.size_max = (int(bound) for bound in size_bounds.split('-'))
+            self.size_weight = float(size_weight)
+
+        # If the size range is malformed #
+        except ValueError as parse_err:
+            raise ValueError(f'Invalid priority size range {size_range}, expected '
+                             'min-max=weight') from parse_err
+
+    def score(self, file: Path, file_stat: os.stat_result, magic: bytes) -> float:
+        """
+        Scores the passed in file by summing the weights of the rules it matches.
+
+        :param file:  The path to the file to be scored.
+        :param file_stat:  The stat result of the file.
+        :param magic:  The leading bytes of the file.
+        :return:  The priority score of the file.
+        """
+        score = self.magic_weights.get(get_file_type(file, magic), 0.0)
+
+        # Add the recency weight, halving with each half life since the file was modified #
+        age_days = max(0.0, time.time() - file_stat.st_mtime) / DAY_SECONDS
+        score += self.recent_weight * 0.5 ** (age_days / self.half_life)
+
+        # If the file is in the preferred size range #
+        if self.size_min <= file_stat.st_size <= self.size_max:
+            score += self.size_weight
+
+        # Add the weight of the highest weighted folder the file is in #
+        score += max((self.folder_weights.get(folder.lower(), 0.0)
+                      for folder in file.parent.parts), default=0.0)
+
+        return score
+
+
+def get_file_type(file: Path, magic: bytes) -> str | None:
+    """
+    Detects the type of a file from its leading bytes, falling back to its suffix for scripts.
+
+    :param file:  The path to the file.
+    :param magic:  The leading bytes of the file.
+    :return:  The file type name, or None if it is not recognized.
+    """
+    # Iterate through the known signatures #
+    for signature, file_type in MAGIC_SIGNATURES:
+        # If the file starts with the signature #
+        if magic.startswith(signature):
+            return file_type
+
+    # If the file is a script without a shebang #
+    if file.suffix.lower() in SCRIPT_SUFFIXES:
+        return 'script'
+
+    return None
+
+
+def order_by_priority(files: list[Path], rules: PriorityRules = None) -> list[Path]:
+    """
+    Orders files by their priority score, highest first. Files with equal whole number scores \
+    are ordered by size, unique sizes first and same sized files grouped, so possible duplicates \
+    are still hashed and batched next to each other. Files that were removed \
+    or can not be read are reported and left out, so the rest of the scan carries on.
+
+    :param files:  The file paths to be ordered.
+    :param rules:  The priority rules files are scored by, the configured rules if not set.
+    :return:  The file paths in the order they are to be scanned.
+    """
+    rules = rules or PriorityRules()
+    scored = []
+
+    # Iterate through the files reading the stat and leading bytes of each #
+    for file in files:
+        try:
+            with file.open('rb') as in_file:
+                file_stat = os.fstat(in_file.fileno())
+                magic = in_file.read(MAGIC_LENGTH)
+
+        # If the file was removed or can not be read, skip it rather than stopping the scan #
+        except OSError as file_err:
+            # Print error and log #
+            print_err(f'Skipping {file}, unable to read it: {file_err}')
+            logging.warning('Skipping %s, unable to read it: %s', file, file_err)
+            continue
+
+        scored.append((rules.score(file, file_stat, magic), file_stat.st_size, file))
+
+    size_counts = Counter(size for _, size, _ in scored)
+    scored.sort(key=lambda item: (-round(item[0]), size_counts[item[1]] > 1, item[1]))
+
+    return [file for _, _, file in scored]
+
+
+def parse_weights(setting: str) -> dict[str, float]:
+    """
+    Parses a comma-separated name=weight setting.
+
+    :param setting:  The setting string, such as pe=100,script=80.
+    :return:  Dictionary mapping each name to its weight.
+    """
+    weights = {}
+
+    # Iterate through the non empty pairs #
+    for pair in (pair.strip() for pair in setting.split(',') if pair.strip()):
+        name, _, weight = pair.partition('=')
+        try:
+            weights[name.strip()] = float(weight)
+
+        # If the weight is missing or not a number #
+        except ValueError as parse_err:
+            raise ValueError(f'Invalid priority weight {pair}, expected name=weight') \
+                from parse_err
+
+    return weights
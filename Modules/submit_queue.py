@@ -0,0 +1,215 @@
+"""
+Submission of the files unknown to Virus-Total. Unknown files within the upload size limit are
+queued to be uploaded, then their analysis is polled with exponential backoff until it finishes, so
+the finished reports reach the same report output as the rest of the scan.
+
+Built-in modules
+"""
+import logging
+import os
+from pathlib import Path
+# Custom modules #
+from Modules.archive_members import ArchiveMember
+from Modules.report_cache import is_not_found
+from Modules.retry_queue import RetryQueue
+from Modules.utils import BATCH_SIZE
+
+
+# Pseudo constants #
+SUBMIT_UNKNOWN = os.environ.get('VTOTAL_SUBMIT', '').lower() in ('1', 'true', 'yes')
+# The v2 file/scan endpoint rejects uploads over 32MB #
+SUBMIT_MAX_SIZE = int(os.environ.get('VTOTAL_SUBMIT_MAX_SIZE', 32 * 1024 * 1024))
+POLL_LIMIT = int(os.environ.get('VTOTAL_POLL_LIMIT', 8))
+POLL_BASE = float(os.environ.get('VTOTAL_POLL_BASE', 60.0))
+POLL_CAP = float(os.environ.get('VTOTAL_POLL_CAP', 900.0))
+# Report response code of a file queued for analysis #
+QUEUED = -2
+# Response code of an upload over the size limit, which is not retried #
+TOO_LARGE = 413
+
+
+class SubmitQueue:
+    """ Class to hold the unknown files waiting to be uploaded and the analyses being polled. """
+    def __init__(self, max_size: int = SUBMIT_MAX_SIZE, poll_limit: int = POLL_LIMIT,
+                 poll_base: float = POLL_BASE, poll_cap: float = POLL_CAP,
+                 batch_size: int = BATCH_SIZE, retry_options: dict = None):
+        """
+        Initialize the empty upload and poll queues and the submit settings.
+
+        :param max_size:  The size in bytes of the largest file uploaded.
+        :param poll_limit:  The number of times an analysis is polled before the file is reported
+                            as unknown.
+        :param poll_base:  The seconds before the first poll, doubled on each poll.
+        :param poll_cap:  The maximum seconds between polls.
+        :param batch_size:  The maximum number of ready polls sent in one report request.
+        :param retry_options:  Optional keyword arguments for the upload retry queue, such as the
+                               scaled backoff used by the benchmarks.
+        """
+        self.max_size = max_size
+        self.poll_limit = poll_limit
+        self.poll_base = poll_base
+        self.poll_cap = poll_cap
+        self.batch_size = batch_size
+        # Uploads waiting to be sent or resent after throttling or a transient error #
+        self.uploads = RetryQueue(**(retry_options or {}))
+        # Analyses waiting to be polled, ordered by the time each poll is due #
+        self.polls = RetryQueue()
+        # Unknown file report and number of polls of each submitted file, keyed by SHA256 #
+        self.submitted = {}
+
+    def __len__(self) -> int:
+        """
+        Gets the number of uploads and analysis polls waiting to be sent.
+
+        :return:  The number of waiting uploads and polls.
+        """
+        return len(self.uploads) + len(self.polls)
+
+    def _is_uploadable(self, file: Path) -> bool:
+        """
+        Checks whether a file is within the upload size limit and on disk, archive members are \
+        never extracted to be uploaded.
+
+        :param file:  The path to the file.
+        :return:  True if the file can be uploaded, otherwise False.
+        """
+        # If the file is a member of an archive #
+        if isinstance(file, ArchiveMember):
+            logging.info('Not submitting %s, archive members are not extracted to be uploaded',
+                         file)
+            return False
+
+        try:
+            file_size = file.stat().st_size
+
+        # If the file can no longer be read, it is reported as unknown #
+        except OSError as file_err:
+            logging.warning('Not submitting %s, unable to read it: %s', file, file_err)
+            return False
+
+        # If the file is empty or over the size limit #
+        if not 0 < file_size <= self.max_size:
+            logging.info('Not submitting %s, its size of %s bytes is outside the upload limit of '
+                         '%s bytes', file, file_size, self.max_size)
+            return False
+
+        return True
+
+    def check(self, digests: dict, dup_files: list[Path], response: dict) -> dict | None:
+        """
+        Checks the report of a file, queueing the file to be uploaded if it is unknown, or to be \
+        polled again if it was submitted and its analysis is still running.
+
+        :param digests:  Dictionary mapping each algorithm name to the file hex digest.
+        :param dup_files:  The paths to the files sharing the digest.
+        :param response:  The report response dictionary of the file.
+        :return:  The response to be reported for the files, or None if they were deferred.
+        """
+        file_hash = digests['sha256']
+
+        # If the file was submitted, the report is a poll of its analysis #
+        if file_hash in self.submitted:
+            # If the analysis finished #
+            if not is_analysis_pending(response):
+                del self.submitted[file_hash]
+                return response
+
+            # If the analysis did not finish within the poll limit, report the file as unknown #
+            if self.submitted[file_hash][1] >= self.poll_limit:
+                logging.warning('Analysis of %s did not finish after %s polls, reporting it as '
+                                'unknown', dup_files[0], self.poll_limit)
+                return self.forget(file_hash)
+
+            self.poll([(digests, dup_files)])
+            return None
+
+        # If the file is unknown and can be uploaded #
+        if is_not_found(response) and self._is_uploadable(dup_files[0]):
+            self.submitted[file_hash] = [response, 0]
+            self.uploads.push([(digests, dup_files)], 0)
+            return None
+
+        return response
+
+    def forget(self, file_hash: str) -> dict:
+        """
+        Stops tracking a submitted file whose upload failed or whose analysis did not finish.
+
+        :param file_hash:  The SHA256 digest of the file.
+        :return:  The unknown file report of the file, to be reported in place of the analysis.
+        """
+        return self.submitted.pop(file_hash)[0]
+
+    def poll(self, batch: list):
+        """
+        Queues the next poll of a submitted file analysis, each waiting twice as long as the last \
+        up to the cap, since most analyses finish within minutes while some take much longer.
+
+        :param batch:  List holding the (file digests, list of file paths) tuple of the file.
+        :return:  Nothing
+        """
+        entry = self.submitted[batch[0][0]['sha256']]
+        delay = min(self.poll_cap, self.poll_base * 2 ** entry[1])
+        entry[1] += 1
+        # The poll count is kept per file, the attempt counts only retries of a failed poll #
+        self.polls.push(batch, 0, delay)
+
+    def pop_ready(self) -> tuple:
+        """
+        Removes the analysis polls or upload that are ready, polls first so finished analyses \
+        are collected before more files are uploaded. Polls due soon are merged into the ready \
+        poll up to the batch size, so polling many files spends as few requests as looking them \
+        up did.
+
+        :return:  Tuple of the batch, its attempt number, and whether it is an upload, or \
+                  (None, 0, False) if none are ready.
+        """
+        batch, _ = self.polls.pop_ready()
+        # If no poll is ready, take a ready upload #
+        if batch is None:
+            batch, attempt = self.uploads.pop_ready()
+            return batch, attempt, batch is not None
+
+        # While the batch has room, merge in the polls due within half the first poll delay #
+        while len(batch) < self.batch_size:
+            ready_batch, _ = self.polls.pop_ready(self.poll_base / 2)
+            # If no other poll is ready #
+            if ready_batch is None:
+                break
+
+            batch += ready_batch
+
+        return batch, 0, False
+
+    def wait_time(self) -> float:
+        """
+        Calculates how long until the next upload or analysis poll is ready.
+
+        :return:  The number of seconds to wait, 0 if one is ready or none are waiting.
+        """
+        return min((queue.wait_time() for queue in (self.uploads, self.polls) if queue),
+                   default=0.0)
+
+
+def is_analysis_pending(response: dict) -> bool:
+    """
+    Checks whether a successful response of a submitted file states its analysis is not finished.
+
+    :param response:  The response dictionary returned from the API.
+    :return:  True if the file is still queued or not yet registered, otherwise False.
+    """
+    results = response.get('results')
+    # If the results are a report dict with a queued or not found response code #
+    return isinstance(results, dict) and results.get('response_code') in (QUEUED, 0)
+
+
+def is_upload_queued(response: dict) -> bool:
+    """
+    Checks whether a successful upload response states the file was queued for analysis.
+
+    :param response:  The response dictionary returned from the API.
+    :return:  True if the analysis was queued, otherwise False.
+    """
+    results = response.get('results')
+    # If the results are a scan dict with the queued response code #
+    return isinstance(results, dict) and results.get('response_code') == 1
@@ -1,58 +1,56 @@
 # pylint: disable=W0106,I1101
 """ Built-in modules """
-import csv
 import errno
-import hashlib
 import logging
 import os
-import pickle
 import sys
-from datetime import datetime
 from pathlib import Path
 # External Modules #
 import PyQt5.QtWidgets as Qtw
-from virus_total_apis import ApiError
+# Custom modules #
+from Modules.hashing import hash_file
+from Modules.vt_client import ApiError
 
 
-def counter_data_input(input_file: Path) -> int:
+# Pseudo constants #
+BATCH_SIZE = 4
+
+
+def batch_query(file_hashes: list[str], vt_instance: object) -> dict[str, dict]:
     """
-    Reads total number of API queries from data file.
+    Send a group of file hashes to the Virus Total API as a single batch request, then split the \
+    combined response into per-hash response dictionaries in the single request format.
 
-    :param input_file:  The data file to read the stored data.
-    :return:  The data read from the data file (daily API query count).
+    :param file_hashes:  The SHA256 digests to be tested with the Virus Total API.
+    :param vt_instance:  The initialized Virus Total instance.
+    :return:  Dictionary mapping each passed in hash to its response dictionary.
     """
-    try:
-        # Read from counter data file in bytes mode #
-        with input_file.open('rb') as in_file:
-            # Load the int API counter #
-            stored_counter = pickle.load(in_file)
+    # If only one hash, send a regular request #
+    if len(file_hashes) == 1:
+        return {file_hashes[0]: query_hash(file_hashes[0], vt_instance)}
 
-    # If error occurs during file operation #
-    except OSError as file_err:
-        # Lookup, display, and log IO error #
-        error_query(str(input_file), 'rb', file_err)
+    # Send the comma-separated hash list in one request #
+    response = query_hash(', '.join(file_hashes), vt_instance)
+    results = response.get('results')
 
-    return stored_counter
+    # If the request failed, every hash in the batch shares the error response #
+    if response.get('response_code') != 200 or not isinstance(results, list):
+        return {file_hash: response for file_hash in file_hashes}
 
+    # Index the reports by the resource they were requested with #
+    reports = {report.get('resource', '').lower(): report for report in results}
+    split_responses = {}
 
-def counter_data_output(output_file: Path, day_count: int):
-    """
-    Stores total number of API queries in data file.
+    for index, file_hash in enumerate(file_hashes):
+        report = reports.get(file_hash.lower())
+        # If the resource was not echoed back, use the report in the same request position #
+        if report is None and index < len(results):
+            report = results[index]
 
-    :param output_file:  The data file where the number of daily API calls will be stored.
-    :param day_count:  The current number of API calls withing the last 24-hour period.
-    :return:  Nothing
-    """
-    try:
-        # Write to counter data file in bytes mode #
-        with output_file.open('wb') as out_file:
-            # Save API int counter to data file #
-            pickle.dump(day_count, out_file)
+        split_responses[file_hash] = {'results': report,
+                                      'response_code': response['response_code']}
 
-    # If error occurs during file operation #
-    except OSError as file_err:
-        # Lookup, display, and log IO error #
-        error_query(str(output_file), 'wb', file_err)
+    return split_responses
 
 
 def error_query(err_path: str, err_mode: str, err_obj):
@@ -95,6 +93,26 @@ def error_query(err_path: str, err_mode: str, err_obj):
         sys.exit(5)
 
 
+def get_file_digests(file_path: Path) -> dict[str, str] | None:
+    """
+    Compute the MD5, SHA1, and SHA256 digests of the passed in file in a single read pass. A \
+    file that can not be read is reported and fails alone rather than stopping the scan.
+
+    :param file_path:  The path to the file to be hashed.
+    :return:  Dictionary mapping each algorithm name to its hex digest, None if not readable.
+    """
+    try:
+        # Hash the file with every digest algorithm #
+        return hash_file(file_path)
+
+    # If error occurs during file operation #
+    except OSError as file_err:
+        # Print error and log #
+        print_err(f'Unable to read {file_path}: {file_err}')
+        logging.warning('Unable to read %s: %s', file_path, file_err)
+        return None
+
+
 def get_files(path: Path) -> list[Path]:
     """
     Iterate through files in path and add to list if not the .keep file or not a directory.
@@ -106,96 +124,15 @@ def get_files(path: Path) -> list[Path]:
 
     # Append items in path to the file list if they are not .keep or a directory #
     for file in os.scandir(path):
-        # Format file path to current iteration #
-        curr_file = path / file.name
-
-        # If the current file is not .keep for git tracking or not a directory #
-        if not file.name == '.keep' and not curr_file.is_dir():
+        # If the current file is not .keep for git tracking or not a directory, reusing the type
+        # the directory entry already holds #
+        if not file.name == '.keep' and not file.is_dir():
             # Append the current file path instance to file list #
-            file_list.append(curr_file)
+            file_list.append(path / file.name)
 
     return file_list
 
 
-def hash_send(file_path: Path, vt_instance: object) -> dict:
-    """
-    Encode passed in file as bytes, perform SHA512 hash, and send hash to Virus Total API. Return \
-    the result dictionary.
-
-    :param file_path:  The path to the file to be hashed and tested with the Virus Total API.
-    :param vt_instance:  The initialized Virus Total instance.
-    :return:  The result dictionary of API call.
-    """
-    # Initialize SHA256 algorithm instance #
-    sha_hash = hashlib.sha256()
-
-    try:
-        with file_path.open('rb') as in_file:
-            # Read the data and hash by 4096 byte chunks #
-            for byte_chunk in iter(lambda: in_file.read(4096), b''):
-                sha_hash.update(byte_chunk)
-
-    # If error occurs during file operation #
-    except OSError as file_err:
-        # Lookup, display, and log IO error #
-        error_query(str(file_path), 'rb', file_err)
-
-    try:
-        # Get a Virus-Total report of the hashed file #
-        response = vt_instance.get_file_report(sha_hash.hexdigest())
-
-    # If error occurs interacting with Virus-Total API #
-    except ApiError as api_err:
-        print_err(f'API error occurred - {api_err}')
-        logging.exception('Error occurred accessing API: %s', api_err)
-        sys.exit(7)
-
-    return response
-
-
-def load_data(count_file: Path, exec_time_file: Path, time_inst: object) -> tuple:
-    """
-    Checks if exist program data exists. If so, the data loaded from the files and checked to see \
-    if the 24-hour period for the 500 daily API calls is past. If it is past the 24-hour period \
-    the data files will be deleted to keep track of the new 24 period.
-
-    :param count_file:  Path to the data file containing the current daily API count.
-    :param exec_time_file:  Path to the csv file containing program execution time.
-    :param time_inst:  Time instance containing current and previous execution time data.
-    :return:  Tuple with the start execution time of period and total daily API call count if \
-              successful, otherwise None values.
-    """
-    # If the counter data file does not exist #
-    if not count_file.exists():
-        daily_count = 0
-    # If the data file exists #
-    else:
-        # Load the counter data from the data file #
-        daily_count = counter_data_input(count_file)
-
-    # If the last execution time file exists #
-    if exec_time_file.exists():
-        # Read old execution time from csv file #
-        prev_month, prev_day, prev_hour = time_csv_input(exec_time_file)
-
-        # If the last execution occurred in the same month and
-        # maximum queries have been recorded on data file #
-        if prev_month == time_inst.month and daily_count == 500:
-            # If the on the same day or the next day within less-than 24 hours #
-            if prev_day == time_inst.day or (prev_day == time_inst.day + 1
-            and ((prev_hour + 24) % 24 >= time_inst.hour)):
-                pass
-            # If the data files are no longer needed #
-            else:
-                # Delete the counter and execution time files #
-                count_file.unlink()
-                exec_time_file.unlink()
-
-        return daily_count, prev_month, prev_day, prev_hour
-
-    return daily_count, None, None, None
-
-
 def print_err(msg: str):
     """
     Displays error message via standard error.
@@ -221,106 +158,29 @@ def qt_err(err_obj):
     msg.exec_()
 
 
-def store_data(counter_file: Path, total_count: int, execution_time_file: Path, time_inst: object):
+def query_hash(file_hash: str, vt_instance: object) -> dict:
     """
-    Stores the API daily API counter data and execution time if first call within a 24-hour period.
+    Send file hash to Virus Total API and return the result dictionary.
 
-    :param counter_file:  Counter data file name.
-    :param total_count:  Current number of daily API calls in last 24 hours.
-    :param execution_time_file:  Path to csv file where execution time data is stored.
-    :param time_inst:  Time instance containing current and previous execution time data.
-    :return:  Nothing
-    """
-    # Save daily allowed total counter to data file #
-    counter_data_output(counter_file, total_count)
-
-    # If the last execution time file exists #
-    if execution_time_file.exists():
-        if time_inst.old_month and time_inst.old_day and time_inst.old_hour:
-            # If the on the same day or the next day within less-than 24 hours #
-            if time_inst.old_day == time_inst.day or (time_inst.old_day == time_inst.day + 1
-            and ((time_inst.old_hour + 24) % 24 >= time_inst.hour)):
-                pass
-            # If the 24-hour period is over #
-            else:
-                # Save the execution time to csv #
-                time_csv_output(execution_time_file)
-    else:
-        # Save the execution time to csv #
-        time_csv_output(execution_time_file)
-
-
-def time_csv_input(input_csv: Path) -> tuple:
-    """
-    Reads the time data stored in csv file.
-
-    :param input_csv:  The data csv file to read the stored execution time.
-    :return:  The stored execution time in csv file (month, day, hour).
+    :param file_hash:  The SHA256 digest of the file to be tested with the Virus Total API.
+    :param vt_instance:  The initialized Virus Total instance.
+    :return:  The result dictionary of API call, with only an error message if the request \
+              failed so it can be retried.
     """
-    headers = ['month', 'day', 'hour']
     try:
-        # Read the file storing last execution time #
-        with input_csv.open('r', encoding='utf-8', newline='') as in_file:
-            # Read the last execution data #
-            csv_data = csv.DictReader(in_file, fieldnames=headers)
-
-            # Get last execution time in dict format #
-            for row in csv_data:
-                month = row['month']
-                day = row['day']
-                hour = row['hour']
-                break
-
-    # If error occurs during file operation #
-    except OSError as file_err:
-        # Lookup, display, and log IO error #
-        error_query(str(input_csv), 'r', file_err)
-
-    try:
-        # Ensure input CSV data is int #
-        ret_month, ret_day, ret_hour = int(month), int(day), int(hour)
-
-    # If value is not integer #
-    except ValueError as val_err:
-        # Print error and log #
-        print_err(f'Value: Error occurred retrieving CSV execution time values - {val_err}')
-        logging.exception('Value error occurred converting read csv time data: %s', val_err)
-        sys.exit(6)
-
-    return ret_month, ret_day, ret_hour
-
-
-def time_csv_output(output_csv: Path):
-    """
-    Stores execution time and data in cvs file.
-
-    :param output_csv:  The data csv file to store execution time output.
-    :return:  Nothing
-    """
-    # Get the current time #
-    finish_time = datetime.now()
-    # Store time in list #
-    time_dict = [finish_time.month, finish_time.day, finish_time.hour]
+        # Get a Virus-Total report of the hashed file #
+        response = vt_instance.get_file_report(file_hash)
 
-    try:
-        # Write the current hour and minute to time CSV file #
-        with output_csv.open('w', encoding='utf-8', newline='') as out_file:
-            # Create CSV dict writer object #
-            csv_writer = csv.writer(out_file)
-            # Populate the data in fields #
-            csv_writer.writerow(time_dict)
+    # If error occurs interacting with Virus-Total API #
+    except ApiError as api_err:
+        logging.exception('Error occurred accessing API: %s', api_err)
+        return {'error': f'API error occurred - {api_err}'}
 
-    # If error occurs during file operation #
-    except OSError as file_err:
-        # Lookup, display, and log IO error #
-        error_query(str(output_csv), 'w', file_err)
+    return response
 
 
 class TimeTracker:
-    """ Class to group the stored and current execution times. """
-    old_month = None
-    old_day = None
-    old_hour = None
+    """ Class to group the current execution time used in report file names. """
     month = None
     day = None
     hour = None
@@ -0,0 +1,231 @@
+"""
+Thin Virus-Total v2 API client over a persistent, pooled requests session, so lookups reuse open
+keep-alive connections instead of paying a new TCP and TLS handshake per request. Responses keep
+the dictionary format of the virus_total_apis package the client replaces. Uploads are streamed as
+multipart bodies a block at a time, so large samples are never held in memory whole.
+
+Built-in modules
+"""
+import io
+import os
+import uuid
+from pathlib import Path
+# External modules #
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Pseudo constants #
+API_BASE = os.environ.get('VTOTAL_API_BASE', 'https://www.virustotal.com/vtapi/v2/')
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('VTOTAL_HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(os.environ.get('VTOTAL_HTTP_READ_TIMEOUT', 60))
+HTTP_POOL_SIZE = int(os.environ.get('VTOTAL_HTTP_POOL_SIZE', 10))
+HTTP_PROXY = os.environ.get('VTOTAL_HTTP_PROXY')
+# Error messages of the response codes, matching the virus_total_apis package where it had one #
+RESPONSE_MESSAGES = {
+    204: 'You exceeded the public API request rate limit (4 requests of any nature per minute)',
+    400: 'package sent is either malformed or not within the past 24 hours.',
+    403: 'You tried to perform calls to functions for which you require a Private API key.',
+    404: 'File not found.',
+    413: 'The uploaded file is larger than the API accepts.'
+}
+
+
+class ApiError(Exception):
+    """ Class for errors in how the API client is used, such as a missing API key. """
+
+
+class MultipartFile:
+    """ Class to stream a file as a multipart/form-data body, reading a block as each is sent. """
+    def __init__(self, file_path: Path, field: str = 'file'):
+        """
+        Open the file and build the multipart part headers around it, raising OSError if the \
+        file can not be opened.
+
+        :param file_path:  The path to the file to be sent.
+        :param field:  The name of the form field holding the file.
+        """
+        boundary = uuid.uuid4().hex
+        # Quotes and line breaks in the name would end the part header early #
+        file_name = file_path.name.replace('"', '%22').replace('\r', '').replace('\n', '')
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; '
+                f'filename="{file_name}"\r\nContent-Type: application/octet-stream\r\n\r\n')
+        tail = f'\r\n--{boundary}--\r\n'
+
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        self._file = file_path.open('rb')
+        # File bytes left to send, capped to the size when opened so the body matches its length #
+        self._file_left = os.fstat(self._file.fileno()).st_size
+        self._length = len(head.encode('utf-8')) + self._file_left + len(tail)
+        # The parts of the body in the order they are sent #
+        self._parts = [io.BytesIO(head.encode('utf-8')), self._file,
+                       io.BytesIO(tail.encode('utf-8'))]
+
+    def __len__(self) -> int:
+        """
+        Gets the total length of the body, sent as its Content-Length.
+
+        :return:  The number of bytes in the body.
+        """
+        return self._length
+
+    def close(self):
+        """
+        Closes the streamed file.
+
+        :return:  Nothing
+        """
+        self._file.close()
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Reads the next block of the body across the part boundaries.
+
+        :param size:  The maximum number of bytes to read, -1 for the rest of the body.
+        :return:  The read bytes, empty once the whole body was read.
+        """
+        chunks = []
+        wanted = self._length if size < 0 else size
+
+        # While more bytes are wanted and parts are left #
+        while wanted and self._parts:
+            part = self._parts[0]
+            # If the part is the file, do not read past its size when opened #
+            if part is self._file:
+                chunk = part.read(min(wanted, self._file_left))
+                self._file_left -= len(chunk)
+                done = not chunk or not self._file_left
+            else:
+                chunk = part.read(wanted)
+                done = not chunk
+
+            # If the part was read whole, move on to the next #
+            if done:
+                self._parts.pop(0)
+
+            chunks.append(chunk)
+            wanted -= len(chunk)
+
+        return b''.join(chunks)
+
+
+class VirusTotalClient:
+    """ Class to send Virus-Total API requests for a key through a shared pooled session. """
+    def __init__(self, api_key: str, session: requests.Session = None, base: str = API_BASE,
+                 timeout: tuple = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        """
+        Initialize the API key, session, and request settings.
+
+        :param api_key:  The Virus Total API key.
+        :param session:  The pooled session shared by every key, a new one if not passed in.
+        :param base:  The base URL of the API, such as the benchmark stub server.
+        :param timeout:  Tuple of the connect and read timeouts in seconds.
+        """
+        # If no API key was passed in #
+        if not api_key:
+            raise ApiError('You must supply a valid VirusTotal API key.')
+
+        self.api_key = api_key
+        self.session = session or create_session()
+        self.base = base.rstrip('/') + '/'
+        self.timeout = timeout
+
+    def get_file_report(self, resource: str | list[str], timeout: tuple = None) -> dict:
+        """
+        Gets the reports of one or more comma-separated hashes over a pooled connection.
+
+        :param resource:  The hash, comma-separated hashes, or list of hashes to be looked up.
+        :param timeout:  Optional connect and read timeouts replacing the client timeouts.
+        :return:  The response dictionary, holding only an error message if the request failed.
+        """
+        # If a list of hashes was passed in, send them as one batch #
+        if isinstance(resource, list):
+            resource = ', '.join(resource)
+
+        try:
+            response = self.session.get(f'{self.base}file/report',
+                                        params={'apikey': self.api_key, 'resource': resource},
+                                        timeout=timeout or self.timeout)
+
+        # If the connection failed or timed out, keep the key in the URL out of the logs #
+        except requests.RequestException as req_err:
+            return {'error': str(req_err).replace(self.api_key, '<api key>')}
+
+        return parse_response(response)
+
+    def scan_file(self, file_path: Path, timeout: tuple = None) -> dict:
+        """
+        Uploads a file for analysis as a streamed multipart body over a pooled connection.
+
+        :param file_path:  The path to the file to be uploaded.
+        :param timeout:  Optional connect and read timeouts replacing the client timeouts.
+        :return:  The response dictionary with the scan ID of the queued analysis, holding only \
+                  an error message if the request failed.
+        """
+        try:
+            body = MultipartFile(file_path)
+
+        # If the file can no longer be read #
+        except OSError as file_err:
+            return {'error': f'Unable to read {file_path} - {file_err.strerror}'}
+
+        try:
+            response = self.session.post(f'{self.base}file/scan', params={'apikey': self.api_key},
+                                         data=body, headers={'Content-Type': body.content_type},
+                                         timeout=timeout or self.timeout)
+
+        # If the connection failed or timed out, keep the key in the URL out of the logs #
+        except (requests.RequestException, OSError) as req_err:
+            return {'error': str(req_err).replace(self.api_key, '<api key>')}
+
+        finally:
+            body.close()
+
+        return parse_response(response)
+
+
+def create_session(pool_size: int = HTTP_POOL_SIZE, proxy: str | None = HTTP_PROXY) \
+        -> requests.Session:
+    """
+    Creates a session keeping up to pool_size keep-alive connections open per host.
+
+    :param pool_size:  The maximum number of pooled connections per host.
+    :param proxy:  Optional proxy URL for every request, otherwise the standard proxy environment
+                   variables are honored.
+    :return:  The configured session.
+    """
+    session = requests.Session()
+    # Retries are handled by the scan retry queue, not the transport #
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    # If a proxy was set #
+    if proxy:
+        session.proxies.update({'http': proxy, 'https': proxy})
+
+    return session
+
+
+def parse_response(response: requests.Response) -> dict:
+    """
+    Converts an HTTP response to the response dictionary format of the virus_total_apis package.
+
+    :param response:  The HTTP response of a request.
+    :return:  Dictionary with the JSON results and response code, or an error message.
+    """
+    # If the request was successful #
+    if response.status_code == 200:
+        try:
+            return {'results': response.json(), 'response_code': 200}
+
+        # If the body was cut short or is not JSON, the request can be retried #
+        except ValueError as json_err:
+            return {'error': f'Invalid JSON response - {json_err}'}
+
+    # If the response code has a known error message #
+    if response.status_code in RESPONSE_MESSAGES:
+        return {'error': RESPONSE_MESSAGES[response.status_code],
+                'response_code': response.status_code}
+
+    return {'response_code': response.status_code}
@@ -1,128 +1,98 @@
-# pylint: disable=I1101
+# pylint: disable=E0611,I1101
 """
 Virus-Total Public API limits 500 requests per day at a rate of 4 requests per minute
 
 Built-in modules
 """
-import json
 import logging
-import sys
-import time
 from pathlib import Path
 # External modules #
-import PyQt5.QtGui as Qtg
-from virus_total_apis import PublicApi as VirusTotalPublicApi
+from PyQt5.QtCore import QObject, pyqtSignal
 # Custom modules #
-from Modules.utils import error_query, get_files, hash_send, qt_err
-
-
-def vtotal_scan(api_key: str, scan_dir: Path, path: Path, time_obj: object, daily_count: int,
-                gui_outbox) -> int:
-    """
-    Facilitates Virus Total API scans on contents of VTotalScanDock directory, sleep 60 seconds per
-    4 queries.
-
-    :param api_key:  The Virus Total API key.
-    :param scan_dir:  The directory containing the files to be scanned.
-    :param path:  The path object to current working directory.
-    :param time_obj:  The program execution time tracking instance.
-    :param daily_count:  The current number of daily API calls within the last recorded 24-hour
-                         period
-    :param gui_outbox:  Reference to Virus Total text box for updating GUI output.
-    :return:  The update daily number of API calls after scanning files with API.
-    """
-    minute_count = 4
-    output_text = ''
-
-    # Initialize the Virus-Total API object #
-    vt_object = VirusTotalPublicApi(api_key)
-    # Get list of files to be scanned #
-    files = get_files(scan_dir)
-
-    # Get the contents of input dir as list #
-    for file in files:
-        # Format output report path for current file #
-        report_file = path / f'{file.name}_{time_obj.month}-{time_obj.day}-{time_obj.hour}.txt'
+from Modules.quota_profile import QuotaProfile
+from Modules.file_walker import walk_files
+from Modules.scan_engine import ScanEngine, ScanError
+
+
+class ScanWorker(QObject):
+    """ Class to run the Virus Total scan in a worker thread, reporting to the GUI by signals. """
+    # Status message for the GUI, such as rate limit waits #
+    progress = pyqtSignal(str)
+    # ScanResult of each scanned file #
+    file_result = pyqtSignal(object)
+    # Number of API calls made within the last 24 hours #
+    daily_count = pyqtSignal(int)
+    # Error message that stopped the scan #
+    error = pyqtSignal(str)
+    # Emitted once the scan stopped and its state was saved #
+    finished = pyqtSignal()
+
+    def __init__(self, api_keys: list[str], scan_dir: Path, path: Path, time_obj: object,
+                 resume: bool = False, quota_profile: QuotaProfile = None):
+        """
+        Initialize the scan engine with callbacks that emit the worker signals.
+
+        :param api_keys:  The Virus Total API keys requests are spread across.
+        :param scan_dir:  The directory containing the files to be scanned.
+        :param path:  The path object to current working directory.
+        :param time_obj:  The program execution time tracking instance.
+        :param resume:  Whether to continue the previous scan from where it stopped.
+        :param quota_profile:  Optional request limits and concurrency of the API tier.
+        """
+        super().__init__()
+        self.scan_dir = scan_dir
+        self.engine = ScanEngine(api_keys, path, time_obj,
+                                 on_daily_count=self.daily_count.emit,
+                                 on_quota_exhausted=lambda: self.progress.emit(
+                                     f'Only {self.engine.quota_profile.daily_limit} queries '
+                                     'allowed per day per key .. stopping scan'),
+                                 on_retry=lambda files, delay, reason: self.progress.emit(
+                                     f'Request {reason}, requeued {len(files)} file(s) to retry '
+                                     f'in {delay:.0f} seconds'),
+                                 on_wait=lambda wait: self.progress.emit(
+                                     'Every key is at its per minute query limit, sleeping '
+                                     f'{wait:.0f} seconds'),
+                                 resume=resume, quota_profile=quota_profile,
+                                 on_submit=lambda files: self.progress.emit(
+                                     f'Uploading unknown file for analysis: {files[0].name}'),
+                                 on_carry_over=lambda wait, eta, files_left: self.progress.emit(
+                                     'Daily query quota of every key is used, carrying '
+                                     f'{files_left} file(s) over for {wait / 3600:.1f} hours, '
+                                     f'backlog estimated to be scanned in {eta / 3600:.1f} hours'))
+
+    def cancel(self):
+        """
+        Requests the scan to stop after the current request, interrupting rate limit waits.
+
+        :return:  Nothing
+        """
+        self.engine.cancel()
+
+    def run(self):
+        """
+        Runs the scan, emitting each result and the error that stopped it, then finished when done.
+
+        :return:  Nothing
+        """
         try:
-            # Open report file in append mode #
-            with report_file.open('a', encoding='utf-8') as out_file:
-                output_text += f'{file.name}\n\n'
-                # Write current file name to GUI output box #
-                gui_outbox.setText(output_text)
-                # Call app to update GUI output box #
-                Qtg.QGuiApplication.processEvents()
-
-                # If the maximum API calls have been used for the day #
-                if daily_count == 500:
-                    # write error to GUI output box #
-                    gui_outbox.setText('Only 500 queries allowed per day .. exiting program')
-                    # Call app to update GUI output box #
-                    Qtg.QGuiApplication.processEvents()
-                    break
-
-                # If the maximum API calls have been used for the minute #
-                if minute_count == 0:
-                    # Write error to GUI output box #
-                    gui_outbox.setText('Only 4 queries allowed per minute, sleeping 60 seconds')
-                    # Call app to update GUI output box #
-                    Qtg.QGuiApplication.processEvents()
-
-                    time.sleep(60)
-                    output_text = ''
-                    minute_count = 4
-
-                # Hash file and send report, return response #
-                response = hash_send(file, vt_object)
-
-                # If successful response code is returned #
-                if response['response_code'] == 200:
-                    # Write the name of the current file to report file #
-                    out_file.write(f'File - {file.name}:\n{(9 + len(file.name)) * "*"}\n')
-                    # Write json results to output report file #
-                    json.dump(response, out_file, sort_keys=False, indent=4)
-                    out_file.write('\n\n')
-
-                # If response code is for maximum API calls per minute #
-                elif response['response_code'] == 204:
-                    # Display error on app and log #
-                    qt_err('Max API Error: API calls per minute maxed out at 4,'
-                           ' wait 60 seconds and try again')
-                    logging.exception('Max API Error: API calls per minute maxed out at 4,'
-                                      ' wait 60 seconds and try again')
-                    sys.exit(8)
-
-                # If response code is for invalid request #
-                elif response['response_code'] == 400:
-                    # Display error on app and log #
-                    qt_err('Request Error: Invalid API request detected, check request formatting')
-                    logging.exception('Request Error: Invalid API request detected,'
-                                      ' check request formatting')
-                    sys.exit(9)
-
-                # If response code is for forbidden access #
-                elif response['response_code'] == 403:
-                    # Display error on app and log #
-                    qt_err('Forbidden Error: Unable to access API,'
-                            ' confirm key exists and is valid')
-                    logging.exception('Forbidden Error: Unable to access API,'
-                                      ' confirm key exists and is valid')
-                    sys.exit(10)
-
-                # If unknown response code occurs #
-                else:
-                    # Display error on app and log #
-                    qt_err('Unknown response code occurred')
-                    logging.exception('Unknown response code occurred')
-                    sys.exit(11)
-
-                daily_count += 1
-                minute_count -= 1
-
-        # If error occurs writing to report output file #
-        except OSError as file_err:
-            # Display error on application #
-            qt_err(file_err)
-            # Lookup, display, and log IO error #
-            error_query(out_file, 'a', file_err)
-
-    return daily_count
+            # Iterate through the scan results as they arrive #
+            for result in self.engine.scan(walk_files(self.scan_dir)):
+                self.file_result.emit(result)
+
+        # If every key was rejected or no key is set #
+        except ScanError as scan_err:
+            self.error.emit(str(scan_err))
+            logging.error('Scan stopped: %s', scan_err)
+
+        # If a file or database error exited the scan #
+        except SystemExit as exit_err:
+            self.error.emit(f'Scan stopped with exit code {exit_err.code}, check the log for '
+                            'details')
+            logging.error('Scan stopped with exit code %s', exit_err.code)
+
+        # If unexpected exception occurs #
+        except Exception as err:
+            self.error.emit(f'Unexpected error occurred - {err}')
+            logging.exception('Unexpected error occurred - %s', err)
+
+        self.finished.emit()
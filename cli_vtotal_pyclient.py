@@ -4,22 +4,27 @@ Virus-Total Public API limits 500 requests per day at a rate of 4 requests per m
 
 Built-in modules
 """
-import json
+import argparse
 import logging
-import os
 import sys
-import time
-from datetime import datetime
+from contextlib import closing
+from datetime import datetime, timedelta
 from pathlib import Path
-# External modules #
-from virus_total_apis import PublicApi as VirusTotalPublicApi
 # Custom modules #
-from Modules.utils import error_query, get_files, hash_send, load_data, print_err, store_data, \
-                          TimeTracker
+from Modules.archive_members import ARCHIVE_SCAN
+from Modules.dir_watch import DirWatcher
+from Modules.file_walker import get_walk_filter, SYMLINK_POLICIES, walk_files
+from Modules.key_pool import get_api_keys, get_daily_count
+from Modules.quota_profile import get_quota_profile, QUOTA_PROFILE, QUOTA_PROFILES
+from Modules.scan_engine import CARRY_OVER, ScanEngine, ScanError
+from Modules.scan_metrics import METRICS_NAME, profile_run
+from Modules.submit_queue import SUBMIT_UNKNOWN
+from Modules.utils import print_err, TimeTracker
 
 
 # Pseudo constants #
-API_KEY = os.environ.get('VTOTAL_API_KEY')
+API_KEYS = get_api_keys()
+PROFILE_NAME = 'VTotal_Profile.prof'
 
 
 def main():
@@ -29,25 +34,64 @@ def main():
 
     :return:  Nothing
     """
+    parser = argparse.ArgumentParser(description='Scans the files in VTotalScanDock with the '
+                                                 'Virus-Total API.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the previous scan from where it stopped, skipping the files '
+                             'it completed.')
+    parser.add_argument('--quota-profile', choices=QUOTA_PROFILES, default=QUOTA_PROFILE,
+                        help='Request limits of the API tier of the keys, premium keys allow '
+                             'concurrent requests.')
+    parser.add_argument('--concurrency', type=int,
+                        help='Number of requests kept in flight, overriding the quota profile.')
+    parser.add_argument('--submit', action='store_true', default=SUBMIT_UNKNOWN,
+                        help='Upload the files unknown to Virus-Total and wait for their analysis, '
+                             'sharing the files with Virus-Total.')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running after the scan, scanning each file that lands in '
+                             'VTotalScanDock once its writes settle.')
+    parser.add_argument('--carry-over', action='store_true', default=CARRY_OVER,
+                        help='Wait for the daily quota to free up when it runs out, scanning the '
+                             'rest of the files unattended instead of exiting.')
+    parser.add_argument('--include', help='Comma-separated globs of the files to be scanned, '
+                                              'such as *.exe,*.dll.')
+    parser.add_argument('--exclude', help='Comma-separated globs of the files and folders to be '
+                                          'skipped.')
+    parser.add_argument('--min-size', type=int, help='Size in bytes of the smallest file scanned.')
+    parser.add_argument('--max-size', type=int,
+                        help='Size in bytes of the largest file scanned, 0 for no limit.')
+    parser.add_argument('--depth', type=int,
+                        help='Folder levels walked below VTotalScanDock, 0 for only its files.')
+    parser.add_argument('--symlinks', choices=SYMLINK_POLICIES,
+                        help='Skip symlinks, follow them to files only, or follow them to files '
+                             'and folders.')
+    parser.add_argument('--types', help='Comma-separated file types detected by magic bytes to be '
+                                        'scanned, such as pe,elf,script.')
+    parser.add_argument('--archives', action='store_true', default=ARCHIVE_SCAN,
+                        help='Also hash and look up the files inside zip, tar, and 7z archives, '
+                             'read from the archive without extracting them.')
+    parser.add_argument('--profile', action='store_true',
+                        help=f'Profile the scan with cProfile into {PROFILE_NAME} and a text '
+                             'summary of the slowest calls, only the main thread is profiled.')
+    args = parser.parse_args()
+    # Get the request limits of the API tier with any overrides #
+    quota_profile = get_quota_profile(args.quota_profile, {'concurrency': args.concurrency})
+    # Get the file filters with any overrides #
+    walk_filter = get_walk_filter({'include': args.include, 'exclude': args.exclude,
+                                   'min_size': args.min_size, 'max_size': args.max_size,
+                                   'depth': args.depth, 'symlinks': args.symlinks,
+                                   'types': args.types})
+
     # Initialize time tracking instance #
     time_obj = TimeTracker()
     # Get the current execution time #
     start_time = datetime.now()
     time_obj.month, time_obj.day, time_obj.hour = start_time.month, start_time.day, start_time.hour
-    # Set the counter file and execution time file paths #
-    counter_file = cwd / 'counter_data.data'
-    execution_time_file = cwd / 'last_execution_time.csv'
-
-    # Load the program data (API daily call count & exec time of first call) #
-    total_count, time_obj.old_month, \
-    time_obj.old_day, time_obj.old_hour = load_data(counter_file, execution_time_file, time_obj)
-
-    # Initialize the Virus-Total API object #
-    vt_object = VirusTotalPublicApi(API_KEY)
-    minute_count = 4
 
-    # Get list of files to be scanned #
-    files = get_files(input_dir)
+    # Get the number of API calls made in the last 24 hours #
+    total_count = get_daily_count(API_KEYS, cwd)
+    # Walk the files to be scanned as the scan goes #
+    files = walk_files(input_dir, walk_filter)
 
     print('''
  _   ___                ______     __       __  ___       ________          __ 
@@ -56,85 +100,137 @@ def main():
 |___/_/_/  \\_,_/___/   /_/  \\___/\\__/\\_,_/_/ /_/   \\_, /\\___/_/_/\\__/_//_/\\__/ 
                                                   /___/
 ''')
-    print(f'Current number of daily Virus-Total API queries: {total_count}\n')
+    print(f'Current number of daily Virus-Total API queries: {total_count} across '
+          f'{len(API_KEYS)} API key(s)')
+    print(f'Quota profile {quota_profile.name}: {quota_profile.minute_limit} queries per minute '
+          f'and {quota_profile.daily_limit} per day per key, {quota_profile.concurrency} in '
+          'flight\n')
     print(f'Starting Virus-Total file check on file in {input_dir.name}')
     print(f'{(44 + len(input_dir.name)) * "*"}')
 
-    # Iterate through gathered file list #
-    for file in files:
-        # Format report file path #
-        report_file = cwd / f'{file.name}_{time_obj.month}-{time_obj.day}-{time_obj.hour}.txt'
-        try:
-            # Open report file in append mode #
-            with report_file.open('a', encoding='utf-8') as out_file:
-                # If the maximum API calls have been used for the day #
-                if total_count == 500:
-                    print_err('\nOnly 500 queries allowed per day .. exiting program')
-                    break
-
-                # If the maximum API calls have been used for the minute #
-                if minute_count == 0:
-                    print('\nOnly 4 queries allowed per minute, sleeping 60 seconds\n')
-                    time.sleep(60)
-                    minute_count = 4
-
-                print(f'Generating report for: {file.name}')
-
-                # Hash file and send report, return response #
-                response = hash_send(file, vt_object)
-
-                # If successful response code is returned #
-                if response['response_code'] == 200:
-                    # Write the name of the current file to report file #
-                    out_file.write(f'File - {file.name}:\n{(9 + len(file.name)) * "*"}\n')
-                    # Write json results to output report file #
-                    json.dump(response, out_file, sort_keys=False, indent=4)
-                    out_file.write('\n\n')
-
-                # If response code is for maximum API calls per minute #
-                elif response['response_code'] == 204:
-                    # Print error and log #
-                    print_err('Max API Error: API calls per minute maxed out at 4,'
-                              ' wait 60 seconds and try again')
-                    logging.exception('Max API Error: API calls per minute maxed out at 4,'
-                                      ' wait 60 seconds and try again')
-                    sys.exit(8)
-
-                # If response code is for invalid request #
-                elif response['response_code'] == 400:
-                    # Print error and log #
-                    print_err('Request Error: Invalid API request detected,'
-                              ' check request formatting')
-                    logging.exception('Request Error: Invalid API request detected,'
-                                      ' check request formatting')
-                    sys.exit(9)
-
-                # If response code is for forbidden access #
-                elif response['response_code'] == 403:
-                    # Print error and log #
-                    print_err('Forbidden Error: Unable to access API,'
-                              ' confirm key exists and is valid')
-                    logging.exception('Forbidden Error: Unable to access API,'
-                                      ' confirm key exists and is valid')
-                    sys.exit(10)
-
-                # If unknown response code occurs #
-                else:
-                    # Print error and log #
-                    print_err('Unknown response code occurred')
-                    logging.exception('Unknown response code occurred')
-                    sys.exit(11)
-
-                total_count += 1
-                minute_count -= 1
-
-        # If error occurs writing to report output file #
-        except OSError as file_err:
-            # Lookup, display, and log IO error #
-            error_query(str(report_file), 'a', file_err)
-
-    # Store the program data for next execution #
-    store_data(counter_file, total_count, execution_time_file, time_obj)
+    # Set up the scan engine with terminal output for its events #
+    engine = ScanEngine(API_KEYS, cwd, time_obj, on_batch=show_batch,
+                        on_quota_exhausted=lambda: print_err(
+                            f'\nOnly {quota_profile.daily_limit} queries allowed per day per key '
+                            '.. exiting program'),
+                        on_retry=show_retry, on_wait=show_wait, resume=args.resume,
+                        quota_profile=quota_profile, submit=args.submit, on_submit=show_submit,
+                        carry_over=args.carry_over, on_carry_over=show_carry_over,
+                        archives=args.archives)
+    # Profile the scan if requested, saving the stats however it stops #
+    with profile_run(cwd / PROFILE_NAME if args.profile else None):
+        # If not watching, scan the files in the dock once #
+        if not args.watch:
+            run_scan(engine, files)
+            return
+
+        # Watch the dock and its subdirectories with the walk filters, the files already in them
+        # are handed out first #
+        with closing(DirWatcher(input_dir, walk_filter)) as watcher:
+            print(f'Watching {input_dir.name} for new files with {watcher.mode}, Ctrl + C to stop')
+            # Iterate through the files as their writes settle #
+            for landed_files in watcher.watch():
+                # Name the reports after the time the files landed #
+                curr_time = datetime.now()
+                time_obj.month, time_obj.day, time_obj.hour = curr_time.month, curr_time.day, \
+                    curr_time.hour
+
+                print(f'\n{len(landed_files)} file(s) ready in {input_dir.name}')
+                run_scan(engine, landed_files)
+                # Carry the files a scan did not reach, such as when the quota ran out, over #
+                engine.resume = True
+
+
+def run_scan(engine: ScanEngine, files):
+    """
+    Scans the passed in files, displaying the cached and failed results as they arrive and the \
+    throughput of the run, and exits with the error code if the scan was stopped by an API error.
+
+    :param engine:  The scan engine instance.
+    :param files:  Iterable of the paths to the files to be scanned.
+    :return:  Nothing
+    """
+    try:
+        # Close the scan on any exit, including Ctrl + C, so the journal and state are saved #
+        with closing(engine.scan(files)) as results:
+            # Iterate through the scan results as they arrive #
+            for result in results:
+                # If the report was retrieved without spending an API query #
+                if result.cached:
+                    print(f'Generating report for: {result.file.name} (cached)')
+                # If the file could not be scanned, the rest of the scan continues #
+                elif result.error:
+                    print_err(f'Failed to scan {result.file.name}: {result.error}')
+
+        run_time = engine.metrics.gauges.get(('run_seconds', ()), 0.0)
+        print(f'Scan took {run_time:.1f} seconds at '
+              f'{engine.metrics.gauges.get(("files_per_minute", ()), 0.0):.1f} files per minute, '
+              f'metrics saved to {engine.metrics_dir / METRICS_NAME}.prom')
+
+    # If every key was rejected or no key is set #
+    except ScanError as scan_err:
+        # Print error and log #
+        print_err(str(scan_err))
+        logging.error('Scan stopped: %s', scan_err)
+        sys.exit(scan_err.exit_code)
+
+
+def show_batch(batch_files: list[Path]):
+    """
+    Displays the names of the files in a batch before it is sent to the API.
+
+    :param batch_files:  The paths to the files in the batch.
+    :return:  Nothing
+    """
+    print(f'Generating report for: {", ".join(file.name for file in batch_files)}')
+
+
+def show_carry_over(wait: float, eta: float, files_left: int):
+    """
+    Displays when the scan continues after the daily quota ran out and when the backlog is \
+    estimated to be scanned.
+
+    :param wait:  The number of seconds until the daily quota frees up.
+    :param eta:  The estimated number of seconds until the backlog is scanned.
+    :param files_left:  The number of files left in the backlog.
+    :return:  Nothing
+    """
+    curr_time = datetime.now()
+    print(f'\nDaily query quota of every key is used, carrying {files_left} file(s) over to '
+          f'{curr_time + timedelta(seconds=wait):%Y-%m-%d %H:%M}, backlog estimated to be scanned '
+          f'by {curr_time + timedelta(seconds=eta):%Y-%m-%d %H:%M}\n')
+
+
+def show_retry(batch_files: list[Path], delay: float, reason: str):
+    """
+    Displays the files of a batch that was requeued to be resent.
+
+    :param batch_files:  The paths to the files in the batch.
+    :param delay:  The number of seconds before the batch is resent.
+    :param reason:  Why the batch was requeued.
+    :return:  Nothing
+    """
+    print(f'Request {reason}, requeued {len(batch_files)} file(s) to retry in {delay:.0f} seconds')
+
+
+def show_submit(batch_files: list[Path]):
+    """
+    Displays the name of an unknown file before it is uploaded for analysis.
+
+    :param batch_files:  The paths to the files sharing the uploaded digest.
+    :return:  Nothing
+    """
+    print(f'Uploading unknown file for analysis: {batch_files[0].name}')
+
+
+def show_wait(wait: float):
+    """
+    Displays the rate limit wait time.
+
+    :param wait:  The number of seconds until the next request is allowed.
+    :return:  Nothing
+    """
+    print(f'\nEvery key is at its per minute query limit, sleeping {wait:.0f} seconds\n')
 
 
 if __name__ == '__main__':
@@ -152,7 +248,7 @@ if __name__ == '__main__':
 
     # Ctrl + C to stop scan, store data, and exit #
     except KeyboardInterrupt:
-        print('\n[!] Ctrl + c detected .. exiting program')
+        print('\n[!] Ctrl + c detected .. exiting program, run with --resume to continue the scan')
 
     # If unexpected exception occurs #
     except Exception as err:
@@ -6,20 +6,27 @@ Built-in modules
 """
 import logging
 import os
+import sqlite3
 import sys
 from datetime import datetime
 from pathlib import Path
 # External modules #
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import QModelIndex, Qt, QThread
 import PyQt5.QtWidgets as Qtw
 import PyQt5.QtGui as Qtg
 # Custom modules #
-from Modules.utils import load_data, qt_err, store_data, TimeTracker
-from Modules.vtotal_scanner import vtotal_scan
+from Modules.key_pool import get_api_keys, get_daily_count
+from Modules.quota_profile import get_quota_profile
+from Modules.report_cache import ReportCache
+from Modules.results_model import load_history, ResultsModel
+from Modules.scan_journal import is_resumable, JOURNAL_NAME
+from Modules.utils import qt_err, TimeTracker
+from Modules.vtotal_scanner import ScanWorker
 
 
 # Global variables #
-API_KEY = os.environ.get('VTOTAL_API_KEY')
+API_KEYS = get_api_keys()
+QUOTA_LIMITS = get_quota_profile()
 global TOTAL_COUNT
 
 
@@ -49,6 +56,11 @@ class MainWindow(Qtw.QWidget):
         self._cwd = cwd
         # Save the program time instance #
         self._time_obj = time_instance
+        # Open the report cache the full reports of the results are loaded from #
+        self._report_cache = ReportCache(cwd / 'report_cache.db')
+        # The scan worker and the thread it runs in, set while a scan is running #
+        self._scan_thread = None
+        self._scan_worker = None
 
         # Create a label for instructions #
         self._instruction_label = Qtw.QLabel('Click button below to run Virus Total API'
@@ -86,12 +98,35 @@ class MainWindow(Qtw.QWidget):
         # Add counter label box to layout #
         __layout.addWidget(self._counter_label, 0, 3)
 
-        # Create scan output box #
+        # Create the model holding one row per scanned file, reports are loaded when opened from
+        # the report cache or the report files #
+        self._results_model = ResultsModel(self._report_cache.get, cwd, self)
+        # Create the results table view #
+        self._results_view = Qtw.QTableView(self)
+        self._results_view.setModel(self._results_model)
+        # Select and open whole rows #
+        self._results_view.setSelectionBehavior(Qtw.QAbstractItemView.SelectRows)
+        self._results_view.setSelectionMode(Qtw.QAbstractItemView.SingleSelection)
+        # Use fixed row heights so the view never measures rows it does not display #
+        self._results_view.verticalHeader().setSectionResizeMode(Qtw.QHeaderView.Fixed)
+        self._results_view.verticalHeader().setDefaultSectionSize(24)
+        self._results_view.verticalHeader().hide()
+        self._results_view.horizontalHeader().setStretchLastSection(True)
+        self._results_view.setWordWrap(False)
+        # Set results table css border #
+        self._results_view.setStyleSheet('''
+            background-color: #ffffff;
+            border: 2px solid #000000;
+        ''')
+        # Show the report of a row when it is selected #
+        self._results_view.selectionModel().currentRowChanged.connect(self.on_select)
+
+        # Create report output box #
         self._output_box = Qtw.QTextEdit('', self)
         # Set the console output screen to read-only #
         self._output_box.setReadOnly(True)
         # Change label font size #
-        self._output_box.setFont(Qtg.QFont('Arial', 16))
+        self._output_box.setFont(Qtg.QFont('Arial', 12))
         # Align label left #
         self._output_box.setAlignment(Qt.AlignLeft)
         # Set output box css border #
@@ -100,8 +135,13 @@ class MainWindow(Qtw.QWidget):
             border: 2px solid #000000;
             border-radius: 20px;
         ''')
-        # Add output box to layout #
-        __layout.addWidget(self._output_box, 1, 0, 4, 4)
+
+        # Stack the results table over the report output box #
+        results_splitter = Qtw.QSplitter(Qt.Vertical, self)
+        results_splitter.addWidget(self._results_view)
+        results_splitter.addWidget(self._output_box)
+        # Add results splitter to layout #
+        __layout.addWidget(results_splitter, 1, 0, 4, 4)
 
         # Create button to execute tests #
         self._scan_button = Qtw.QPushButton('Run Scan', self)
@@ -126,34 +166,198 @@ class MainWindow(Qtw.QWidget):
             }
         ''')
         # Add scan button box to layout #
-        __layout.addWidget(self._scan_button, 5, 0, 1, 4)
+        __layout.addWidget(self._scan_button, 5, 0, 1, 2)
+
+        # Create button to load the results of earlier scans #
+        self._history_button = Qtw.QPushButton('Load History', self)
+        # Change button font size #
+        self._history_button.setFont(Qtg.QFont('Arial', 20))
+        # Set the history button minimum height #
+        self._history_button.setMinimumHeight(60)
+        # Set function to execute when pressed #
+        self._history_button.clicked.connect(self.on_history)
+        # Set button css #
+        self._history_button.setStyleSheet('''
+            QPushButton {
+                color: #000000;
+                background-color: #ffffff;
+                border: 2px solid #000000;
+            }
+
+            QPushButton:hover {
+                color: #1eb300;
+                background-color: #000000;
+                border: 10px double #fff663;
+            }
+        ''')
+        # Add history button box to layout #
+        __layout.addWidget(self._history_button, 5, 2)
+
+        # Create button to cancel a running scan #
+        self._cancel_button = Qtw.QPushButton('Cancel', self)
+        # Change button font size #
+        self._cancel_button.setFont(Qtg.QFont('Arial', 20))
+        # Set the cancel button minimum height #
+        self._cancel_button.setMinimumHeight(60)
+        # Set function to execute when pressed #
+        self._cancel_button.clicked.connect(self.on_cancel)
+        # Disable the button until a scan is running #
+        self._cancel_button.setEnabled(False)
+        # Set button css #
+        self._cancel_button.setStyleSheet('''
+            QPushButton {
+                color: #000000;
+                background-color: #ffffff;
+                border: 2px solid #000000;
+            }
+
+            QPushButton:hover {
+                color: #1eb300;
+                background-color: #000000;
+                border: 10px double #fff663;
+            }
+        ''')
+        # Add cancel button box to layout #
+        __layout.addWidget(self._cancel_button, 5, 3)
         # Establish GUI layout #
         self.setLayout(__layout)
 
-    def on_press(self):
+    def closeEvent(self, event: Qtg.QCloseEvent):
         """
-        Executes Virus Total scanner function when button is clicked.
+        Cancels a running scan and waits for its state to be saved before the window closes.
 
+        :param event:  The window close event.
+        :return:  Nothing
+        """
+        # If a scan is running #
+        if self._scan_thread:
+            self._scan_worker.cancel()
+            # The queued finished to quit connection needs the GUI event loop, so quit directly #
+            self._scan_thread.quit()
+            self._scan_thread.wait()
+
+        self._report_cache.close()
+        event.accept()
+
+    def on_cancel(self):
+        """
+        Cancels the running scan when the cancel button is clicked.
+
+        :return:  Nothing
+        """
+        # If a scan is running #
+        if self._scan_worker:
+            self._cancel_button.setEnabled(False)
+            self._instruction_label.setText('Cancelling scan .. saving quota and report state')
+            self._scan_worker.cancel()
+
+    def on_count(self, daily_calls: int):
+        """
+        Updates the daily API counter label with the count from the scan worker.
+
+        :param daily_calls:  The number of API calls made within the last 24 hours.
         :return:  Nothing
         """
         global TOTAL_COUNT
-        print(self._instruction_label.setText('Scan is running .. 4 items are scanned every 60 '
-                                             'seconds based on API limitations. This operation '
-                                             'could take some time depending on the amount of '
-                                             'files in the VTotalScanDock'))
-        # Call app to process label text change #
-        Qtg.QGuiApplication.processEvents()
+        TOTAL_COUNT = self._api_count = daily_calls
+        self._counter_label.setText(f'# of daily API calls\n{daily_calls}')
 
-        # Pass needed params into virus scanner, get the updated daily API call total in return #
-        TOTAL_COUNT = vtotal_scan(API_KEY, INPUT_DIR, self._cwd, self._time_obj,
-                                  self._api_count, self._output_box)
+    def on_error(self, message: str):
+        """
+        Displays the error that stopped the scan.
 
-        # Update daily API counter #
-        self._counter_label.setText(f'# of daily API calls\n{TOTAL_COUNT}')
-        # Call app to process counter text change #
-        Qtg.QGuiApplication.processEvents()
+        :param message:  The error message from the scan worker.
+        :return:  Nothing
+        """
+        qt_err(message)
 
-        print(self._instruction_label.setText('Scan is complete .. check directory for report'))
+    def on_finished(self):
+        """
+        Resets the buttons and instructions once the scan worker has stopped.
+
+        :return:  Nothing
+        """
+        self._scan_thread = None
+        self._scan_worker = None
+        self._scan_button.setEnabled(True)
+        self._cancel_button.setEnabled(False)
+        self._instruction_label.setText('Scan is complete .. check directory for report')
+
+    def on_history(self):
+        """
+        Loads the results of earlier scans into the results table when button is clicked.
+
+        :return:  Nothing
+        """
+        try:
+            history_rows = load_history(self._cwd)
+
+        # If error occurs reading the databases #
+        except sqlite3.Error as db_err:
+            # Display error on app and log #
+            qt_err(f'Error occurred loading scan history - {db_err}')
+            logging.exception('Error occurred loading scan history: %s', db_err)
+            return
+
+        # Only load the history once #
+        self._history_button.setEnabled(False)
+        self._results_model.add_history(history_rows)
+        self._instruction_label.setText(f'Loaded {len(history_rows)} results of earlier scans')
+
+    def on_press(self):
+        """
+        Starts the Virus Total scan in a worker thread when button is clicked, keeping the GUI \
+        responsive.
+
+        :return:  Nothing
+        """
+        resume = False
+        # If the previous scan stopped before every file was scanned, offer to continue it #
+        if is_resumable(self._cwd / JOURNAL_NAME):
+            answer = Qtw.QMessageBox.question(self, 'Resume scan',
+                                              'The previous scan stopped before it finished, '
+                                              'continue it without rescanning the files it '
+                                              'completed?')
+            resume = answer == Qtw.QMessageBox.Yes
+
+        self._instruction_label.setText('Scan is running .. up to '
+                                        f'{QUOTA_LIMITS.minute_limit * QUOTA_LIMITS.batch_size} '
+                                        'items are scanned every 60 seconds per API key based on '
+                                        'API limitations. This operation could take some time '
+                                        'depending on the amount of files in the VTotalScanDock')
+        self._scan_button.setEnabled(False)
+        self._cancel_button.setEnabled(True)
+
+        # Create the scan worker and move it to its own thread #
+        self._scan_thread = QThread(self)
+        self._scan_worker = ScanWorker(API_KEYS, INPUT_DIR, self._cwd, self._time_obj, resume,
+                                       QUOTA_LIMITS)
+        self._scan_worker.moveToThread(self._scan_thread)
+
+        # Connect the worker signals, queued to the GUI thread #
+        self._scan_thread.started.connect(self._scan_worker.run)
+        self._scan_worker.progress.connect(self._instruction_label.setText)
+        self._scan_worker.file_result.connect(self._results_model.add_result)
+        self._scan_worker.daily_count.connect(self.on_count)
+        self._scan_worker.error.connect(self.on_error)
+        self._scan_worker.finished.connect(self._scan_thread.quit)
+        self._scan_worker.finished.connect(self._scan_worker.deleteLater)
+        self._scan_thread.finished.connect(self._scan_thread.deleteLater)
+        self._scan_thread.finished.connect(self.on_finished)
+
+        self._scan_thread.start()
+
+    def on_select(self, current: QModelIndex, _previous: QModelIndex):
+        """
+        Loads and displays the full report of the selected result row.
+
+        :param current:  The index of the selected row.
+        :param _previous:  The index of the previously selected row.
+        :return:  Nothing
+        """
+        # If a row is selected #
+        if current.isValid():
+            self._output_box.setPlainText(self._results_model.report(current.row()))
 
 
 def main():
@@ -176,12 +380,8 @@ def main():
     start_time = datetime.now()
     time_obj.month, time_obj.day, time_obj.hour = start_time.month, start_time.day, start_time.hour
 
-    counter_file = cwd / 'counter_data.data'
-    execution_time_file = cwd / 'last_execution_time.csv'
-
-    # Load the program data (API daily call count & exec time of first call) #
-    TOTAL_COUNT, time_obj.old_month, \
-    time_obj.old_day, time_obj.old_hour = load_data(counter_file, execution_time_file, time_obj)
+    # Get the number of API calls made in the last 24 hours from the key quota ledgers #
+    TOTAL_COUNT = get_daily_count(API_KEYS, cwd)
 
     logging.info('Count before app %s', TOTAL_COUNT)
 
@@ -202,9 +402,6 @@ def main():
 
     logging.info('Count after app: %s', TOTAL_COUNT)
 
-    # Store the program data for next execution #
-    store_data(counter_file, TOTAL_COUNT, execution_time_file, time_obj)
-
 
 if __name__ == "__main__":
     # Set program file paths #